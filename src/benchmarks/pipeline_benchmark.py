@@ -0,0 +1,418 @@
+"""
+End-to-end benchmark of the scrape, load, train and predict stages on a synthetic corpus.
+
+Run from `src/`:
+    python -m benchmarks.pipeline_benchmark --sizes 1000 10000 100000
+    python -m benchmarks.pipeline_benchmark --sizes 1000 --baseline ../bench_results.json
+
+The corpus is generated locally under `data/benchmarks/corpus_<size>` (reused between
+runs) and downloads are served by a local HTTP stand-in for image hosts, so results do
+not depend on DuckDuckGo or the network. Results are written as JSON; with `--baseline`
+any stage that got slower than `--tolerance` allows is reported and the exit code is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+
+# show_batch draws a figure while the DataBlock is built, never open a window here
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+from PIL import Image
+
+from logging_.log_and_print import Logger
+from utils.path_utils import ProjPaths
+from utils.tracing import Tracer
+
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+BENCHMARK_DIRNAME = "benchmarks"
+CATEGORIES = ("positive", "negative")
+IMAGES_PER_PHRASE = 100
+STAGES = ("import", "download", "scan", "init", "datablock", "train", "predict")
+# Entry points that must stay cheap to import, and the dependencies they must not load
+IMPORT_TARGETS = (
+    "model.image_classifier",
+    "model.inference_server",
+    "scrapers.images.ddg_images",
+)
+HEAVY_MODULES = ("torch", "fastai", "duckduckgo_search", "fastcore", "httpx")
+
+
+class StageTimer:
+    """Collects one result record per timed stage."""
+
+    def __init__(self, size: int, logger: Logger):
+        self.size = size
+        self.logger = logger
+        self.results: List[dict] = []
+
+    def time(self, stage: str, fn: Callable, items: int, **extra) -> object:
+        start = time.perf_counter()
+        ret = fn()
+        self.record(stage, time.perf_counter() - start, items, **extra)
+        return ret
+
+    def record(self, stage: str, seconds: float, items: int, **extra) -> None:
+        result = {
+            "size": self.size,
+            "stage": stage,
+            "seconds": round(seconds, 6),
+            "items": items,
+            "items_per_sec": round(items / seconds, 3) if seconds > 0 else None,
+            **extra,
+        }
+        self.results.append(result)
+        self.logger.log(
+            f"[{self.size}] {stage:<28}{seconds:>10.3f}s {items:>8} items"
+        )
+
+
+def corpus_layout(size: int) -> Iterator[Tuple[str, str, int]]:
+    """Yields (category, phrase, index) for `size` images split evenly over categories."""
+    for i in range(size):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        index = i // len(CATEGORIES)
+        yield category, f"phrase_{index // IMAGES_PER_PHRASE:04d}", index
+
+
+def write_synthetic_image(args: Tuple[Path, int, int, int]) -> None:
+    # Random low-frequency blobs over a per-class tint: decodable, distinct under
+    # perceptual hashing, learnable, and small on disk
+    path, seed, class_index, side = args
+    rng = np.random.default_rng(seed)
+    grid = rng.normal(0.0, 40.0, (8, 8, 3))
+    grid[..., class_index * 2] += 60.0
+    pixels = np.clip(grid + 128.0, 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).resize((side, side), Image.BILINEAR).save(
+        path, quality=85
+    )
+
+
+def generate_corpus(root: Path, size: int, side: int = 96) -> List[Path]:
+    """Creates (or reuses) `size` synthetic JPEGs under `root/<category>/<phrase>/`."""
+    paths, pending = [], []
+    for i, (category, phrase, index) in enumerate(corpus_layout(size)):
+        path = root / category / phrase / f"{phrase}_{index}.jpg"
+        paths.append(path)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            pending.append((path, i, CATEGORIES.index(category), side))
+    with ThreadPool(os.cpu_count()) as pool:
+        pool.map(write_synthetic_image, pending, chunksize=64)
+    return paths
+
+
+class LocalImageHost:
+    """Serves a directory over HTTP on localhost, standing in for remote image hosts."""
+
+    def __init__(self, root: Path):
+        class QuietHandler(SimpleHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+        self.root = root
+        self.httpd = ThreadingHTTPServer(
+            ("127.0.0.1", 0), partial(QuietHandler, directory=str(root))
+        )
+        self.httpd.daemon_threads = True
+        self.__thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self) -> "LocalImageHost":
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, path: Path) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{path.relative_to(self.root).as_posix()}"
+
+
+def local_search_results(
+    host: LocalImageHost, paths: List[Path]
+) -> Dict[str, List[dict]]:
+    """DDG-shaped search results per phrase, pointing at the local host."""
+    results: Dict[str, List[dict]] = {}
+    for path in paths:
+        results.setdefault(path.parent.name, []).append(
+            {
+                "title": path.stem,
+                "image": host.url(path),
+                "thumbnail": host.url(path),
+                "url": host.url(path),
+                "height": 0,
+                "width": 0,
+                "source": "benchmark",
+            }
+        )
+    return results
+
+
+def bench_downloads(
+    timer: StageTimer, corpus_root: Path, paths: List[Path], count: int
+) -> None:
+    from scrapers.images.ddg_images import DuckDuckGoImageScraper
+    from scrapers.images.download_policy import DownloadPolicy
+
+    sample = paths[:count]
+    with LocalImageHost(corpus_root) as host:
+        results = local_search_results(host, sample)
+        phrases = [(phrase, len(phrase_results)) for phrase, phrase_results in results.items()]
+        for mode, concurrent in (("sequential", False), ("concurrent", True)):
+            dl_dirname = f"{BENCHMARK_DIRNAME}/downloads_{timer.size}_{mode}"
+            dl_root = ProjPaths.get_data() / dl_dirname
+            shutil.rmtree(dl_root, ignore_errors=True)
+            dl_root.mkdir(parents=True)
+            scraper = DuckDuckGoImageScraper(
+                dl_dirname,
+                sleep_interval=0,
+                concurrent=concurrent,
+                download_rate=1e6,
+                search_rate=1e6,
+                # The corpus has no separate thumbnails, time full-image downloads
+                download_policy=DownloadPolicy(thumbnail_first=False),
+                verbose=False,
+            )
+            scraper.search_images = lambda phrase, max_images: results[phrase][
+                :max_images
+            ]
+            scraped = timer.time(
+                f"download_{mode}",
+                lambda: scraper.scrape("benchmark", phrases),
+                len(sample),
+            )
+            missing = sum("download_path" not in result for result in scraped)
+            if missing:
+                timer.logger.log(
+                    f"{missing} benchmark downloads failed", color_override="red"
+                )
+            scraper.scrape_cache.close()
+
+
+def bench_scans(timer: StageTimer, corpus_root: Path, n_images: int) -> None:
+    from fastai.vision.all import get_image_files
+
+    from dataset.manifest import MANIFEST_FILENAME, DatasetManifest
+
+    timer.time("scan_get_image_files", lambda: get_image_files(corpus_root), n_images)
+    (corpus_root / MANIFEST_FILENAME).unlink(missing_ok=True)
+    manifest = DatasetManifest(corpus_root)
+    timer.time("scan_manifest_refresh_cold", manifest.refresh, n_images)
+    timer.time("scan_manifest_refresh_warm", manifest.refresh, n_images)
+
+
+def bench_predict(timer: StageTimer, classifier, paths: List[Path], count: int) -> None:
+    sample = paths[:count]
+    latencies = []
+    for path in sample[: min(len(sample), 64)]:
+        start = time.perf_counter()
+        classifier.predict(path)
+        latencies.append(time.perf_counter() - start)
+    timer.record(
+        "predict_single",
+        sum(latencies),
+        len(latencies),
+        p50_ms=round(statistics.median(latencies) * 1000, 3),
+        p95_ms=round(float(np.percentile(latencies, 95)) * 1000, 3),
+    )
+    timer.time("predict_batch", lambda: classifier.predict_batch(sample), len(sample))
+
+
+def bench_imports(timer: StageTimer, budget_ms: float) -> List[str]:
+    """
+    Imports each of `IMPORT_TARGETS` in a fresh interpreter and returns a description
+    of every one that exceeded `budget_ms` or eagerly loaded one of `HEAVY_MODULES`.
+    """
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "__import__(sys.argv[1])\n"
+        "seconds = time.perf_counter() - start\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(json.dumps({'seconds': seconds, 'heavy': heavy}))\n"
+    )
+    failures = []
+    for target in IMPORT_TARGETS:
+        completed = subprocess.run(
+            [sys.executable, "-c", script, target],
+            cwd=ProjPaths.get_src(),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        measured = json.loads(completed.stdout.strip().splitlines()[-1])
+        timer.record(f"import_{target}", measured["seconds"], 1, heavy=measured["heavy"])
+        if measured["seconds"] * 1000 > budget_ms:
+            failures.append(
+                f"import {target} took {measured['seconds'] * 1000:.0f}ms "
+                f"(budget {budget_ms:.0f}ms)"
+            )
+        if measured["heavy"]:
+            failures.append(f"import {target} eagerly loaded {measured['heavy']}")
+    return failures
+
+
+def run_size(size: int, args: argparse.Namespace, logger: Logger) -> List[dict]:
+    timer = StageTimer(size, logger)
+    corpus_dirname = f"{BENCHMARK_DIRNAME}/corpus_{size}"
+    corpus_root = ProjPaths.get_data() / corpus_dirname
+    paths = timer.time(
+        "corpus_generate", lambda: generate_corpus(corpus_root, size), size
+    )
+
+    if "download" in args.stages:
+        bench_downloads(timer, corpus_root, paths, min(size, args.download_count))
+    if "scan" in args.stages:
+        bench_scans(timer, corpus_root, size)
+
+    if not {"init", "datablock", "train", "predict"} & set(args.stages):
+        return timer.results
+
+    from model.image_classifier import BinaryImageClassifier
+
+    tracer = Tracer(enabled=args.trace_dir is not None)
+    (corpus_root / ".manifest.sqlite").unlink(missing_ok=True)
+    phrases = sorted({path.parent.name for path in paths})
+    classifier = timer.time(
+        "init",
+        lambda: BinaryImageClassifier(
+            *CATEGORIES,
+            phrases,
+            phrases,
+            batch_size=args.batch_size,
+            img_res=args.img_res,
+            tensor_cache=args.tensor_cache,
+            downloads_dirname=corpus_dirname,
+            tracer=tracer,
+        ),
+        size,
+    )
+    if "scan" in args.stages:
+        timer.time(
+            "scan_collect_images_recursive",
+            lambda: classifier.collect_images_recursive(corpus_root),
+            size,
+        )
+    if "datablock" in args.stages:
+        timer.time("datablock", classifier.create_datablock, size)
+    if "train" in args.stages or "predict" in args.stages:
+        # fine_tune(1) is one frozen epoch followed by one unfrozen epoch
+        timer.time(
+            "train_one_epoch",
+            lambda: classifier.train_(epochs=1, use_cache=False),
+            size,
+        )
+    if "predict" in args.stages:
+        bench_predict(timer, classifier, paths, min(size, args.predict_count))
+    if tracer.enabled:
+        args.trace_dir.mkdir(parents=True, exist_ok=True)
+        tracer.export_chrome_trace(args.trace_dir / f"trace_{size}.json")
+    return timer.results
+
+
+def environment() -> dict:
+    def version(module: str) -> Optional[str]:
+        try:
+            return __import__(module).__version__
+        except ImportError:
+            return None
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ProjPaths.get_proj_root(),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": version("torch"),
+        "fastai": version("fastai"),
+    }
+
+
+def compare(results: List[dict], baseline: List[dict], tolerance: float) -> List[str]:
+    """Returns a description of every stage slower than `baseline` by more than `tolerance`."""
+    previous = {(result["size"], result["stage"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["size"], result["stage"]))
+        if before is None or before["seconds"] <= 0:
+            continue
+        ratio = result["seconds"] / before["seconds"]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                f"[{result['size']}] {result['stage']}: {before['seconds']:.3f}s -> "
+                f"{result['seconds']:.3f}s ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--download-count", type=int, default=500)
+    parser.add_argument("--predict-count", type=int, default=1024)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--img-res", type=int, default=128)
+    parser.add_argument("--tensor-cache", action="store_true")
+    parser.add_argument("--output", type=Path, default=None, help="Results JSON path")
+    parser.add_argument("--baseline", type=Path, default=None, help="Earlier results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--import-budget-ms", type=float, default=1000.0)
+    parser.add_argument(
+        "--trace-dir", type=Path, default=None, help="Also write per-size Chrome traces"
+    )
+    args = parser.parse_args()
+
+    logger = Logger("PipelineBenchmark", "magenta")
+    results, failures = [], []
+    if "import" in args.stages:
+        import_timer = StageTimer(0, logger)
+        failures += bench_imports(import_timer, args.import_budget_ms)
+        results += import_timer.results
+    if set(args.stages) - {"import"}:
+        for size in args.sizes:
+            results += run_size(size, args, logger)
+
+    output = args.output or ProjPaths.get_proj_root() / "bench_results.json"
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2)
+    logger.log(f"Wrote {len(results)} benchmark results to {output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        failures += [f"Regression {regression}" for regression in regressions]
+    for failure in failures:
+        logger.log(failure, color_override="red")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,13 @@ VERBOSE = True
 PROJECT_NAME = "image-question-answer"
 PHOTO_DL_DIRNAME = "image_downloads"
 MAX_BATCH_SIZE = 64
+MODEL_STORE_DIRNAME = "models"
+TENSOR_CACHE_DIRNAME = "tensor_cache"
+QUARANTINE_DIRNAME = "quarantine"
+EMBEDDING_CACHE_DIRNAME = "embeddings"
+BLOB_STORE_DIRNAME = "blobs"
+CHECKPOINT_DIRNAME = "checkpoints"
+MANIFEST_DIRNAME = "manifests"
 VIDEO_EXTENSION_LIST = [
     ".mp4",
     ".mov",
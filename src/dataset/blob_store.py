@@ -0,0 +1,312 @@
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from constants import BLOB_STORE_DIRNAME, PICTURE_EXTENSION_LIST
+from logging_.log_and_print import Logger
+from utils.hashing import file_sha256
+from utils.path_utils import ProjPaths
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+INDEX_FILENAME = "index.sqlite"
+OBJECTS_DIRNAME = "objects"
+VIEWS_DIRNAME = "views"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    added_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS labels (
+    label TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (label, sha256)
+);
+CREATE INDEX IF NOT EXISTS labels_sha256 ON labels (sha256);
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS view_links (
+    view TEXT NOT NULL,
+    label TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (view, label, sha256)
+);
+"""
+
+
+class BlobStore:
+    """
+    Content-addressed image store shared by every category and question.
+
+    Each distinct image is stored once as `objects/<aa>/<bb>/<sha256><ext>`. A SQLite
+    index maps labels (categories) to blob ids and source URLs to the blob they
+    downloaded to, so a URL found again under another phrase, category or question is
+    not fetched twice. Labels are many-to-many: one blob can belong to several
+    categories.
+
+    Training code still sees the usual `<root>/<label>/<file>` layout through
+    `materialize`, which builds a view of hard links (no copies) for a set of labels.
+    Blobs no label refers to any more are deleted by `gc`.
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.logger = Logger("BlobStore", "magenta")
+        self.root = (
+            Path(root) if root is not None else ProjPaths.get_data() / BLOB_STORE_DIRNAME
+        )
+        self.objects_path = self.root / OBJECTS_DIRNAME
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        # Scrapers call into the store from their download threads
+        self.conn = sqlite3.connect(self.root / INDEX_FILENAME, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def blob_path(self, sha: str, ext: Optional[str] = None) -> Path:
+        if ext is None:
+            row = self.conn.execute(
+                "SELECT ext FROM blobs WHERE sha256 = ?", (sha,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"Unknown blob {sha}")
+            ext = row[0]
+        return self.objects_path / sha[:2] / sha[2:4] / f"{sha}{ext}"
+
+    def has(self, sha: str) -> bool:
+        row = self.conn.execute(
+            "SELECT ext FROM blobs WHERE sha256 = ?", (sha,)
+        ).fetchone()
+        return row is not None and self.blob_path(sha, row[0]).exists()
+
+    def put_file(
+        self,
+        path: Path,
+        labels: Iterable[str] = (),
+        url: Optional[str] = None,
+        move: bool = False,
+    ) -> str:
+        """
+        Adds the file at `path` under its sha256, tags it with `labels` and records
+        `url` as its source. With `move`, `path` is consumed: moved into the store, or
+        deleted if the content is already stored. Returns the blob id.
+        """
+        path = Path(path)
+        sha = file_sha256(path)
+        ext = path.suffix.lower()
+        with self.__lock, self.conn:
+            if self.has(sha):
+                if move:
+                    path.unlink()
+            else:
+                dest = self.blob_path(sha, ext)
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                if move:
+                    shutil.move(path, dest)
+                else:
+                    tmp_path = dest.with_name(f".{dest.name}.part")
+                    shutil.copyfile(path, tmp_path)
+                    os.replace(tmp_path, dest)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+                    (sha, ext, dest.stat().st_size, time.time()),
+                )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO labels VALUES (?, ?)",
+                [(label, sha) for label in labels],
+            )
+            if url is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, sha)
+                )
+        return sha
+
+    def sha_for_url(self, url: str) -> Optional[str]:
+        """Blob previously downloaded from `url`, if it is still stored."""
+        row = self.conn.execute(
+            "SELECT sha256 FROM urls WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None or not self.has(row[0]):
+            return None
+        return row[0]
+
+    def add_labels(self, label: str, shas: Iterable[str]) -> None:
+        with self.__lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO labels VALUES (?, ?)",
+                [(label, sha) for sha in shas],
+            )
+
+    def remove_labels(self, label: str, shas: Optional[Iterable[str]] = None) -> int:
+        """Untags `shas` (or every blob) from `label`. The blobs stay until `gc`."""
+        with self.__lock, self.conn:
+            if shas is None:
+                return self.conn.execute(
+                    "DELETE FROM labels WHERE label = ?", (label,)
+                ).rowcount
+            return self.conn.executemany(
+                "DELETE FROM labels WHERE label = ? AND sha256 = ?",
+                [(label, sha) for sha in shas],
+            ).rowcount
+
+    def blobs(self, label: str) -> List[str]:
+        return [
+            sha
+            for (sha,) in self.conn.execute(
+                "SELECT sha256 FROM labels WHERE label = ? ORDER BY sha256", (label,)
+            )
+        ]
+
+    def labels(self) -> Dict[str, int]:
+        """{label: number of blobs}."""
+        return dict(
+            self.conn.execute("SELECT label, COUNT(*) FROM labels GROUP BY label")
+        )
+
+    def view_path(self, labels: Iterable[str]) -> Path:
+        return self.root / VIEWS_DIRNAME / "+".join(sorted(labels))
+
+    def materialize(
+        self, labels: Iterable[str], view_path: Optional[Path] = None
+    ) -> Path:
+        """
+        Syncs a `<view_path>/<label>/<sha256><ext>` tree of hard links with the label
+        index and returns `view_path`. Usable anywhere a `dataset_path` is expected.
+
+        A link that was created by an earlier call and has since been deleted from the
+        view (e.g. moved to quarantine by `ImageVerifier`) untags that blob from the
+        label instead of being recreated.
+        """
+        labels = list(labels)
+        view_path = Path(view_path) if view_path is not None else self.view_path(labels)
+        view = str(view_path)
+        added = removed = untagged = 0
+        with self.conn:
+            for label in labels:
+                label_dir = view_path / label
+                label_dir.mkdir(parents=True, exist_ok=True)
+                linked = {
+                    sha
+                    for (sha,) in self.conn.execute(
+                        "SELECT sha256 FROM view_links WHERE view = ? AND label = ?",
+                        (view, label),
+                    )
+                }
+                wanted = dict(
+                    self.conn.execute(
+                        "SELECT labels.sha256, blobs.ext FROM labels "
+                        "JOIN blobs ON blobs.sha256 = labels.sha256 WHERE label = ?",
+                        (label,),
+                    )
+                )
+
+                deleted = [
+                    sha
+                    for sha in linked & wanted.keys()
+                    if not (label_dir / f"{sha}{wanted[sha]}").exists()
+                ]
+                untagged += self.remove_labels(label, deleted)
+                for sha in deleted:
+                    del wanted[sha]
+
+                for sha in linked - wanted.keys() - set(deleted):
+                    for link in label_dir.glob(f"{sha}.*"):
+                        link.unlink()
+                    removed += 1
+                for sha in wanted.keys() - linked:
+                    link = label_dir / f"{sha}{wanted[sha]}"
+                    if not link.exists():
+                        self.__link(self.blob_path(sha, wanted[sha]), link)
+                    added += 1
+
+                self.conn.execute(
+                    "DELETE FROM view_links WHERE view = ? AND label = ?", (view, label)
+                )
+                self.conn.executemany(
+                    "INSERT INTO view_links VALUES (?, ?, ?)",
+                    [(view, label, sha) for sha in wanted],
+                )
+        if added or removed or untagged:
+            self.logger.log(
+                f"View {view_path.name}: {added} linked, {removed} unlinked, "
+                f"{untagged} untagged after being removed from the view"
+            )
+        return view_path
+
+    def gc(self, dry_run: bool = False) -> Tuple[int, int]:
+        """Deletes blobs without any label and returns (blob count, bytes freed)."""
+        unreferenced = self.conn.execute(
+            "SELECT sha256, ext, size FROM blobs "
+            "WHERE sha256 NOT IN (SELECT sha256 FROM labels)"
+        ).fetchall()
+        freed = sum(size for _, _, size in unreferenced)
+        if dry_run or not unreferenced:
+            return len(unreferenced), freed
+
+        with self.conn:
+            for sha, ext, _ in unreferenced:
+                # Stale view links are hard links too, they would keep the data alive
+                for view, label in self.conn.execute(
+                    "SELECT view, label FROM view_links WHERE sha256 = ?", (sha,)
+                ).fetchall():
+                    (Path(view) / label / f"{sha}{ext}").unlink(missing_ok=True)
+                self.blob_path(sha, ext).unlink(missing_ok=True)
+            shas = [(sha,) for sha, _, _ in unreferenced]
+            for table in ("blobs", "urls", "view_links"):
+                self.conn.executemany(f"DELETE FROM {table} WHERE sha256 = ?", shas)
+        self.logger.log(
+            f"Garbage collected {len(unreferenced)} blobs ({freed / 1e6:.1f} MB)"
+        )
+        return len(unreferenced), freed
+
+    def import_tree(
+        self,
+        root: Path,
+        labeller: Optional[Callable[[Path], str]] = None,
+        move: bool = False,
+    ) -> int:
+        """
+        Adds every image under a `<root>/<label>/...` download tree, labelled by its
+        category directory unless `labeller` says otherwise. Returns how many files
+        were imported.
+        """
+        root = Path(root)
+        labeller = labeller or (lambda path: path.relative_to(root).parts[0])
+        imported = 0
+        for dirpath, _, filenames in os.walk(root):
+            if Path(dirpath) == root:
+                continue
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                if filename.startswith(".") or path.suffix.lower() not in (
+                    PICTURE_EXTENSION_LIST
+                ):
+                    continue
+                self.put_file(path, [labeller(path)], move=move)
+                imported += 1
+        self.logger.log(f"Imported {imported} images from {root}")
+        return imported
+
+    @staticmethod
+    def __link(src: Path, dest: Path) -> None:
+        try:
+            os.link(src, dest)
+        except OSError:
+            # Filesystems without hard links, or a view on another device
+            try:
+                os.symlink(src, dest)
+            except OSError:
+                shutil.copyfile(src, dest)
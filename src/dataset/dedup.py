@@ -0,0 +1,221 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from dataset.manifest import DatasetManifest
+from logging_.log_and_print import Logger
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+HASH_INPUT_SIZE = 32
+HASH_LOW_FREQ_SIZE = 8
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+DCT_MATRIX = _dct_matrix(HASH_INPUT_SIZE)
+BIT_WEIGHTS = (np.uint64(1) << np.arange(63, -1, -1, dtype=np.uint64)).astype(np.uint64)
+
+
+def load_hash_input(path: str) -> np.ndarray:
+    """Decodes an image to the 32x32 grayscale array the perceptual hash is computed on."""
+    with Image.open(path) as img:
+        # JPEG draft mode decodes at 1/2 - 1/8 scale, which is plenty for a 32px thumbnail
+        img.draft("L", (HASH_INPUT_SIZE * 4, HASH_INPUT_SIZE * 4))
+        img = img.convert("L").resize(
+            (HASH_INPUT_SIZE, HASH_INPUT_SIZE), Image.BILINEAR
+        )
+        return np.asarray(img, dtype=np.uint8)
+
+
+def perceptual_hashes(images: np.ndarray) -> np.ndarray:
+    """
+    DCT perceptual hashes for a (N, 32, 32) stack of grayscale images, computed in one
+    batched matrix product. Returns an (N,) uint64 array.
+    """
+    pixels = images.astype(np.float32)
+    coeffs = DCT_MATRIX @ pixels @ DCT_MATRIX.T
+    low_freq = coeffs[:, :HASH_LOW_FREQ_SIZE, :HASH_LOW_FREQ_SIZE].reshape(len(images), -1)
+    # The DC term only encodes overall brightness, so it's left out of the median
+    medians = np.median(low_freq[:, 1:], axis=1, keepdims=True)
+    bits = (low_freq > medians).astype(np.uint64)
+    return (bits * BIT_WEIGHTS).sum(axis=1, dtype=np.uint64)
+
+
+def hamming_distances(query: np.uint64, hashes: np.ndarray) -> np.ndarray:
+    xor = np.bitwise_xor(hashes, query)
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class HammingIndex:
+    """
+    Multi-index hashing over 64-bit hashes. Hashes are split into `max_distance + 1`
+    bands, so by the pigeonhole principle any hash within `max_distance` bits of a query
+    matches it exactly on at least one band, and only those candidates are compared.
+    """
+
+    def __init__(self, max_distance: int = 4):
+        self.max_distance = max_distance
+        n_bands = max_distance + 1
+        edges = np.linspace(0, 64, n_bands + 1).astype(int)
+        self.band_masks = [
+            (int(start), ((1 << int(end - start)) - 1))
+            for start, end in zip(edges[:-1], edges[1:])
+        ]
+        self.tables: List[Dict[int, List[int]]] = [
+            defaultdict(list) for _ in self.band_masks
+        ]
+        self.hashes: List[int] = []
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __bands(self, phash: int) -> List[int]:
+        return [(phash >> start) & mask for start, mask in self.band_masks]
+
+    def add(self, phash: int) -> int:
+        index = len(self.hashes)
+        self.hashes.append(phash)
+        for table, band in zip(self.tables, self.__bands(phash)):
+            table[band].append(index)
+        return index
+
+    def query(self, phash: int) -> Optional[int]:
+        """Returns the index of the closest stored hash within `max_distance`, if any."""
+        candidates = set()
+        for table, band in zip(self.tables, self.__bands(phash)):
+            candidates.update(table.get(band, ()))
+        if not candidates:
+            return None
+        candidates = list(candidates)
+        distances = hamming_distances(
+            np.uint64(phash),
+            np.array([self.hashes[i] for i in candidates], dtype=np.uint64),
+        )
+        best = int(np.argmin(distances))
+        if distances[best] > self.max_distance:
+            return None
+        return candidates[best]
+
+
+class Deduplicator:
+    """
+    Marks identical and near-identical images in a manifest as duplicates, so they are
+    left out of the DataBlock (and can't straddle the train/valid split). Within a
+    label the first image in path order is kept. Near-identical images under different
+    labels are an ambiguous example rather than a duplicate, and all of them are left
+    out.
+    """
+
+    def __init__(
+        self,
+        manifest: DatasetManifest,
+        max_distance: int = 4,
+        workers: Optional[int] = None,
+        inline_threshold: int = 64,
+    ):
+        self.logger = Logger("Deduplicator", "yellow")
+        self.manifest = manifest
+        self.max_distance = max_distance
+        self.workers = workers or os.cpu_count() or 1
+        self.inline_threshold = inline_threshold
+
+    def run(self, labels: Iterable[str]) -> int:
+        """
+        Hashes new images, refreshes the duplicate markers and returns the number of
+        images left out.
+        """
+        labels = list(labels)
+        duplicates: Dict[Path, Path] = {}
+        n_unique = n_duplicates = n_conflicting = 0
+        for cluster in self.clusters(labels):
+            kept = cluster[0][0]
+            for path, _ in cluster[1:]:
+                duplicates[path] = kept
+            if len({label for _, label in cluster}) == 1:
+                n_unique += 1
+                n_duplicates += len(cluster) - 1
+                continue
+            duplicates[kept] = cluster[1][0]
+            n_conflicting += len(cluster)
+            self.logger.log(
+                "Leaving out near-identical images with different labels: "
+                + ", ".join(f"{path} ({label})" for path, label in cluster),
+                color_override="red",
+            )
+
+        self.manifest.set_duplicates(labels, duplicates)
+        if n_duplicates:
+            self.logger.log(
+                f"Skipping {n_duplicates} duplicate images, {n_unique} unique"
+            )
+        if n_conflicting:
+            self.logger.log(
+                f"Skipping {n_conflicting} images whose near-identical copies have "
+                "another label",
+                color_override="red",
+            )
+        return len(duplicates)
+
+    def clusters(self, labels: Iterable[str]) -> List[List[Tuple[Path, str]]]:
+        """
+        Groups the verified images of `labels` into clusters of near-identical
+        (path, label), hashing new images first. Clusters and their members are in
+        path order.
+        """
+        labels = list(labels)
+        self.__hash_missing(labels)
+        entries = sorted(
+            (path, label, phash)
+            for label in labels
+            for path, phash in self.manifest.phashes([label], verified_only=True)
+            if phash is not None
+        )
+
+        index = HammingIndex(self.max_distance)
+        clusters: List[List[Tuple[Path, str]]] = []
+        for path, label, phash in entries:
+            match = index.query(phash & 0xFFFFFFFFFFFFFFFF)
+            if match is None:
+                index.add(phash & 0xFFFFFFFFFFFFFFFF)
+                clusters.append([(path, label)])
+            else:
+                clusters[match].append((path, label))
+        return clusters
+
+    def __hash_missing(self, labels: List[str]) -> None:
+        missing = [
+            path
+            for path, phash in self.manifest.phashes(labels, verified_only=True)
+            if phash is None
+        ]
+        if not missing:
+            return
+        self.logger.log(f"Computing perceptual hashes for {len(missing)} images")
+
+        paths = [str(path) for path in missing]
+        if len(paths) <= self.inline_threshold or self.workers == 1:
+            thumbnails = [load_hash_input(path) for path in paths]
+        else:
+            chunksize = max(1, len(paths) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                thumbnails = list(
+                    executor.map(load_hash_input, paths, chunksize=chunksize)
+                )
+
+        hashes = perceptual_hashes(np.stack(thumbnails))
+        # SQLite integers are signed 64-bit, so store the same bits as int64
+        self.manifest.set_phashes(
+            {path: int(phash) for path, phash in zip(missing, hashes.view(np.int64))}
+        )
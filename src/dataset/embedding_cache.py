@@ -0,0 +1,165 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+
+from dataset.tensor_cache import to_resized_array
+from logging_.log_and_print import Logger
+
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+EMBEDDINGS_FILENAME = "embeddings.f16"
+INDEX_FILENAME = "index.sqlite"
+
+
+class ImageEmbedder:
+    """
+    Pooled backbone features for raw images: decode, squish to `img_res`, normalize with
+    ImageNet stats and run the body of `arch` under `inference_mode`.
+    """
+
+    def __init__(self, arch: Any, img_res: int = 128, pretrained: bool = True):
+        from fastai.vision.all import (
+            create_vision_model,
+            imagenet_stats,
+            num_features_model,
+        )
+
+        body = create_vision_model(arch, 1, pretrained=pretrained)[0]
+        self.dim = num_features_model(body)
+        self.model = nn.Sequential(body, nn.AdaptiveAvgPool2d(1), nn.Flatten()).eval()
+        self.img_res = img_res
+        self.mean = torch.tensor(imagenet_stats[0]).view(1, 3, 1, 1)
+        self.std = torch.tensor(imagenet_stats[1]).view(1, 3, 1, 1)
+
+    def __call__(self, arrays: np.ndarray) -> np.ndarray:
+        """(N, img_res, img_res, 3) uint8 -> (N, dim) float32."""
+        batch = torch.from_numpy(arrays).permute(0, 3, 1, 2).float().div_(255)
+        with torch.inference_mode():
+            return self.model((batch - self.mean) / self.std).float().numpy()
+
+    def embed(
+        self,
+        images: Sequence[Any],
+        batch_size: int = 64,
+        workers: int = os.cpu_count() or 1,
+    ) -> np.ndarray:
+        """Embeds paths, bytes, PIL images or arrays, decoding each batch in threads."""
+        ret = [np.empty((0, self.dim), dtype=np.float32)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(images), batch_size):
+                arrays = list(
+                    executor.map(
+                        lambda image: to_resized_array(image, self.img_res),
+                        images[start : start + batch_size],
+                    )
+                )
+                ret.append(self(np.stack(arrays)))
+        return np.concatenate(ret)
+
+
+class EmbeddingCache:
+    """
+    Append-only float16 embeddings on disk, one row per image content hash (sha256).
+
+    Rows live in a raw `embeddings.f16` file that is read through a memmap, and a SQLite
+    index maps each hash to its row. A row is only indexed after it has been written, so
+    an interrupted `ensure` loses at most the batch in flight, which is truncated away
+    the next time the cache is opened.
+    """
+
+    def __init__(self, cache_dir: Path, dim: int):
+        self.logger = Logger("EmbeddingCache", "magenta")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.embeddings_path = self.cache_dir / EMBEDDINGS_FILENAME
+        self.conn = sqlite3.connect(self.cache_dir / INDEX_FILENAME)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (sha256 TEXT PRIMARY KEY, row INTEGER NOT NULL)"
+        )
+        self.n_rows = self.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+        row_bytes = self.dim * np.dtype(np.float16).itemsize
+        if self.embeddings_path.exists():
+            if self.embeddings_path.stat().st_size != self.n_rows * row_bytes:
+                os.truncate(self.embeddings_path, self.n_rows * row_bytes)
+        else:
+            self.embeddings_path.touch()
+        self._embeddings: Optional[np.memmap] = None
+
+    def __len__(self):
+        return self.n_rows
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        if self._embeddings is None or len(self._embeddings) != self.n_rows:
+            if self.n_rows == 0:
+                return np.empty((0, self.dim), dtype=np.float16)
+            self._embeddings = np.memmap(
+                self.embeddings_path,
+                dtype=np.float16,
+                mode="r",
+                shape=(self.n_rows, self.dim),
+            )
+        return self._embeddings
+
+    def rows(self, hashes: Sequence[str]) -> Dict[str, int]:
+        ret = {}
+        # SQLite caps the number of bound parameters per statement
+        for start in range(0, len(hashes), 900):
+            chunk = list(hashes[start : start + 900])
+            ret.update(
+                self.conn.execute(
+                    f"SELECT sha256, row FROM rows WHERE sha256 IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+            )
+        return ret
+
+    def add(self, hashes: Sequence[str], embeddings: np.ndarray) -> None:
+        hashes = list(dict.fromkeys(hashes))
+        known = self.rows(hashes)
+        new = [i for i, sha in enumerate(hashes) if sha not in known]
+        if not new:
+            return
+        with open(self.embeddings_path, "ab") as f:
+            f.write(np.ascontiguousarray(embeddings[new], dtype=np.float16).tobytes())
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO rows VALUES (?, ?)",
+                [(hashes[i], self.n_rows + offset) for offset, i in enumerate(new)],
+            )
+        self.n_rows += len(new)
+
+    def ensure(
+        self,
+        hashes: Dict[Path, str],
+        embed: Callable[[List[Path]], np.ndarray],
+        batch_size: int = 512,
+    ) -> int:
+        """Embeds every path whose content hash isn't cached yet. Returns how many were added."""
+        known = self.rows(list(hashes.values()))
+        missing: Dict[str, Path] = {}
+        for path, sha in hashes.items():
+            if sha not in known:
+                missing.setdefault(sha, path)
+        if not missing:
+            return 0
+        self.logger.log(f"Embedding {len(missing)} new images")
+        items = list(missing.items())
+        for start in range(0, len(items), batch_size):
+            chunk = items[start : start + batch_size]
+            self.add([sha for sha, _ in chunk], embed([path for _, path in chunk]))
+        return len(missing)
+
+    def lookup(self, hashes: Sequence[str]) -> np.ndarray:
+        """float32 embeddings in the order of `hashes`. Every hash must be cached."""
+        rows = self.rows(hashes)
+        return np.asarray(
+            self.embeddings[[rows[sha] for sha in hashes]], dtype=np.float32
+        )
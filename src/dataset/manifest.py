@@ -0,0 +1,319 @@
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+
+from constants import MANIFEST_DIRNAME, PICTURE_EXTENSION_LIST
+from logging_.log_and_print import Logger
+from utils.hashing import file_sha256
+from utils.path_utils import ProjPaths
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+MANIFEST_FILENAME = ".manifest.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    label TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT,
+    verified INTEGER,
+    phash INTEGER,
+    duplicate_of TEXT
+);
+CREATE INDEX IF NOT EXISTS images_label ON images (label);
+CREATE INDEX IF NOT EXISTS images_directory ON images (directory);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+"""
+
+# Columns added after the first manifest version, applied to older databases on open
+MIGRATIONS = {
+    "phash": "ALTER TABLE images ADD COLUMN phash INTEGER",
+    "duplicate_of": "ALTER TABLE images ADD COLUMN duplicate_of TEXT",
+}
+
+
+def external_manifest_path(root: Path) -> Path:
+    """
+    Manifest database for a dataset folder the project does not own, kept under
+    `data/manifests` and keyed by the folder's absolute path instead of written into it.
+    """
+    root = Path(root).resolve()
+    key = hashlib.sha256(str(root).encode()).hexdigest()[:16]
+    return ProjPaths.get_data() / MANIFEST_DIRNAME / f"{root.name}-{key}.sqlite"
+
+
+class CategoryLabeller:
+    """Labels an image by the category directory directly under `root` (`<root>/<label>/...`)."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def __call__(self, path: Path) -> str:
+        return Path(path).relative_to(self.root).parts[0]
+
+
+class DatasetManifest:
+    """
+    Persistent index of the images under a download root.
+
+    One row per image records its path (relative to `root`), label, size, mtime, sha256
+    and verification status. `refresh` only lists directories whose mtime changed since
+    the last run, so a warm start with no new downloads costs one `stat` per directory
+    instead of a walk over every file.
+    """
+
+    def __init__(self, root: Path, db_path: Optional[Path] = None):
+        self.logger = Logger("DatasetManifest", "yellow")
+        self.root = Path(root)
+        self.db_path = db_path or self.root / MANIFEST_FILENAME
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(SCHEMA)
+        self.__migrate()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def refresh(self, full: bool = False) -> int:
+        """
+        Brings the manifest up to date with the filesystem and returns the number of
+        image rows added, changed or removed.
+
+        With `full=True` every directory is relisted and every file re-stat'ed, which
+        also picks up files overwritten in place.
+        """
+        if not self.root.exists():
+            return 0
+        changed = 0
+        with self.conn:
+            stack = [""]
+            while stack:
+                rel_dir = stack.pop()
+                dir_changed, subdirs = self.__refresh_directory(rel_dir, full)
+                changed += dir_changed
+                stack.extend(subdirs)
+        if changed:
+            self.logger.log(f"Manifest updated: {changed} image entries changed")
+        return changed
+
+    def paths(
+        self,
+        labels: Optional[Iterable[str]] = None,
+        verified_only: bool = False,
+        unique_only: bool = False,
+    ) -> List[Path]:
+        query, params = self.__select("path", labels, verified_only)
+        if unique_only:
+            query += " AND duplicate_of IS NULL"
+        return [self.root / row[0] for row in self.conn.execute(query, params)]
+
+    def count(self, label: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM images WHERE label = ?", (label,)
+        ).fetchone()[0]
+
+    def unverified(self, labels: Optional[Iterable[str]] = None) -> List[Path]:
+        query, params = self.__select("path", labels)
+        query += " AND verified IS NULL"
+        return [self.root / row[0] for row in self.conn.execute(query, params)]
+
+    def set_verified(self, results: Dict[Path, bool]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE images SET verified = ? WHERE path = ?",
+                [(int(ok), self.__rel(path)) for path, ok in results.items()],
+            )
+
+    def phashes(
+        self, labels: Optional[Iterable[str]] = None, verified_only: bool = False
+    ) -> List[Tuple[Path, Optional[int]]]:
+        """(path, perceptual hash) pairs ordered by path. Hashes are None until computed."""
+        query, params = self.__select("path, phash", labels, verified_only)
+        return [
+            (self.root / path, phash)
+            for path, phash in self.conn.execute(query + " ORDER BY path", params)
+        ]
+
+    def set_phashes(self, phashes: Dict[Path, int]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE images SET phash = ? WHERE path = ?",
+                [(phash, self.__rel(path)) for path, phash in phashes.items()],
+            )
+
+    def set_duplicates(
+        self, labels: Iterable[str], duplicates: Dict[Path, Path]
+    ) -> None:
+        """Replaces the duplicate markers for `labels` with `duplicates` (duplicate -> kept image)."""
+        query, params = self.__select("path", labels)
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE images SET duplicate_of = NULL WHERE path IN ({query})", params
+            )
+            self.conn.executemany(
+                "UPDATE images SET duplicate_of = ? WHERE path = ?",
+                [
+                    (self.__rel(original), self.__rel(path))
+                    for path, original in duplicates.items()
+                ],
+            )
+
+    def remove(self, paths: Iterable[Path]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM images WHERE path = ?",
+                [(self.__rel(path),) for path in paths],
+            )
+
+    def ensure_hashes(self, labels: Optional[Iterable[str]] = None) -> int:
+        """Computes sha256 for rows that don't have one yet and returns how many were hashed."""
+        query, params = self.__select("path", labels)
+        query += " AND sha256 IS NULL"
+        missing = [row[0] for row in self.conn.execute(query, params)]
+        updates = []
+        for rel_path in missing:
+            try:
+                updates.append((file_sha256(self.root / rel_path), rel_path))
+            except FileNotFoundError:
+                continue
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE images SET sha256 = ? WHERE path = ?", updates
+            )
+        return len(updates)
+
+    def hashes(self, labels: Optional[Iterable[str]] = None) -> Dict[Path, str]:
+        self.ensure_hashes(labels)
+        query, params = self.__select("path, sha256", labels)
+        return {self.root / path: sha for path, sha in self.conn.execute(query, params)}
+
+    def dataset_hash(self, labels: Optional[Iterable[str]] = None) -> str:
+        """Content hash of the image set. Relative paths are included since they define the labels."""
+        self.ensure_hashes(labels)
+        query, params = self.__select("path, sha256", labels)
+        digest = hashlib.sha256()
+        for path, sha in self.conn.execute(query + " ORDER BY path", params):
+            digest.update(path.encode())
+            digest.update((sha or "").encode())
+        return digest.hexdigest()
+
+    def __select(
+        self,
+        columns: str,
+        labels: Optional[Iterable[str]] = None,
+        verified_only: bool = False,
+    ) -> Tuple[str, list]:
+        query = f"SELECT {columns} FROM images WHERE 1 = 1"
+        params = []
+        if labels is not None:
+            labels = list(labels)
+            query += f" AND label IN ({', '.join('?' * len(labels))})"
+            params += labels
+        if verified_only:
+            query += " AND verified = 1"
+        return query, params
+
+    def __migrate(self) -> None:
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(images)")}
+        with self.conn:
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    self.conn.execute(statement)
+
+    def __rel(self, path: Path) -> str:
+        return Path(path).relative_to(self.root).as_posix()
+
+    def __refresh_directory(self, rel_dir: str, full: bool) -> Tuple[int, List[str]]:
+        abs_dir = self.root / rel_dir
+        try:
+            dir_mtime = os.stat(abs_dir).st_mtime_ns
+        except FileNotFoundError:
+            return self.__forget_directory(rel_dir), []
+
+        row = self.conn.execute(
+            "SELECT mtime_ns FROM directories WHERE path = ?", (rel_dir,)
+        ).fetchone()
+        if row is not None and row[0] == dir_mtime and not full:
+            known_subdirs = self.conn.execute(
+                "SELECT path FROM directories WHERE parent = ?", (rel_dir,)
+            ).fetchall()
+            return 0, [subdir for (subdir,) in known_subdirs]
+
+        known = {
+            path: (size, mtime)
+            for path, size, mtime in self.conn.execute(
+                "SELECT path, size, mtime_ns FROM images WHERE directory = ?",
+                (rel_dir,),
+            )
+        }
+        upserts = []
+        subdirs = []
+        seen = set()
+        with os.scandir(abs_dir) as entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if entry.is_dir():
+                    subdirs.append(rel_path)
+                elif (
+                    rel_dir
+                    and entry.is_file()
+                    and Path(entry.name).suffix.lower() in PICTURE_EXTENSION_LIST
+                ):
+                    seen.add(rel_path)
+                    stat = entry.stat()
+                    if known.get(rel_path) != (stat.st_size, stat.st_mtime_ns):
+                        label = rel_path.split("/", 1)[0]
+                        upserts.append(
+                            (rel_path, rel_dir, label, stat.st_size, stat.st_mtime_ns)
+                        )
+        removed = [(path,) for path in known.keys() - seen]
+        seen_subdirs = set(subdirs)
+
+        # A changed file may have a new hash and must be re-verified
+        self.conn.executemany(
+            "INSERT INTO images (path, directory, label, size, mtime_ns) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET size = excluded.size, "
+            "mtime_ns = excluded.mtime_ns, sha256 = NULL, verified = NULL, "
+            "phash = NULL, duplicate_of = NULL",
+            upserts,
+        )
+        self.conn.executemany("DELETE FROM images WHERE path = ?", removed)
+
+        forgotten = 0
+        for (stale_subdir,) in self.conn.execute(
+            "SELECT path FROM directories WHERE parent = ?", (rel_dir,)
+        ).fetchall():
+            if stale_subdir not in seen_subdirs:
+                forgotten += self.__forget_directory(stale_subdir)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO directories (path, parent, mtime_ns) VALUES (?, ?, ?)",
+            (rel_dir, rel_dir.rpartition("/")[0] if rel_dir else None, dir_mtime),
+        )
+        return len(upserts) + len(removed) + forgotten, subdirs
+
+    def __forget_directory(self, rel_dir: str) -> int:
+        # substr() rather than LIKE, since "_" is common in scraped file names
+        prefix = f"{rel_dir}/"
+        removed = self.conn.execute(
+            "DELETE FROM images WHERE directory = ? OR substr(directory, 1, ?) = ?",
+            (rel_dir, len(prefix), prefix),
+        ).rowcount
+        self.conn.execute(
+            "DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?",
+            (rel_dir, len(prefix), prefix),
+        )
+        return removed
@@ -0,0 +1,178 @@
+"""
+Fast decode of prediction inputs down to the model's input size.
+
+JPEGs are decoded with PIL's `draft` mode, which lets libjpeg produce a 1/2, 1/4 or 1/8
+scale image directly instead of decoding every pixel of a 4000px photo and resizing it
+afterwards. Batches are decoded across a process pool, and the workers write straight
+into one shared memory block so the pixels aren't pickled back to the caller.
+
+This module only imports numpy and PIL, so pool workers start without loading torch.
+"""
+
+import io
+import math
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+
+def draft_decode(source: Any, img_res: int) -> np.ndarray:
+    """
+    Decodes `source` (path, raw bytes, PIL image or HxWx3 array) into an RGB uint8 array
+    squished to `img_res` x `img_res`, like `dataset.tensor_cache.to_resized_array` but
+    letting JPEG decoding skip straight to the smallest scale that is still >= `img_res`.
+    """
+    if isinstance(source, np.ndarray):
+        if source.shape == (img_res, img_res, 3) and source.dtype == np.uint8:
+            return source
+        image = Image.fromarray(source)
+    elif isinstance(source, Image.Image):
+        image = source
+    else:
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        image = Image.open(source)
+        # Only has an effect on JPEGs, and only before the image is loaded
+        image.draft("RGB", (img_res, img_res))
+    image = image.convert("RGB")
+    if image.size != (img_res, img_res):
+        image = image.resize((img_res, img_res), Image.BILINEAR)
+    return np.array(image, dtype=np.uint8)
+
+
+# Worker side: the shared block a worker process is currently attached to
+_attached: Optional[shared_memory.SharedMemory] = None
+
+
+def _decode_into(
+    shm_name: str,
+    shape: Tuple[int, int, int, int],
+    items: List[Tuple[int, Any]],
+    img_res: int,
+) -> None:
+    global _attached
+    if _attached is None or _attached.name != shm_name:
+        if _attached is not None:
+            _attached.close()
+        _attached = shared_memory.SharedMemory(name=shm_name)
+    out = np.ndarray(shape, dtype=np.uint8, buffer=_attached.buf)
+    for index, source in items:
+        out[index] = draft_decode(source, img_res)
+
+
+def _release(shm: shared_memory.SharedMemory) -> None:
+    shm.close()
+    shm.unlink()
+
+
+class ParallelDecoder:
+    """
+    Decodes batches of images into (N, img_res, img_res, 3) uint8 arrays.
+
+    Paths and raw bytes are split across `workers` processes once a batch has at least
+    `min_parallel` of them. Smaller batches, such as single `predict` calls, are decoded
+    in the calling process, where draft decoding alone is the bulk of the win and a pool
+    round trip would only add latency.
+    """
+
+    def __init__(
+        self,
+        img_res: int,
+        workers: int = os.cpu_count() or 1,
+        min_parallel: int = 4,
+    ):
+        self.img_res = img_res
+        self.workers = workers
+        self.min_parallel = min_parallel
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._shm_finalizer: Optional[weakref.finalize] = None
+        # The shared block is reused between calls, one batch at a time
+        self.__lock = threading.Lock()
+
+    def __enter__(self) -> "ParallelDecoder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getstate__(self):
+        # Learners and classifiers holding a decoder still pickle; the pool is recreated
+        return {
+            "img_res": self.img_res,
+            "workers": self.workers,
+            "min_parallel": self.min_parallel,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def decode(self, items: Sequence[Any]) -> np.ndarray:
+        items = list(items)
+        remote = [
+            (index, str(item) if isinstance(item, Path) else item)
+            for index, item in enumerate(items)
+            if isinstance(item, (str, Path, bytes, bytearray))
+        ]
+        if self.workers <= 1 or len(remote) < self.min_parallel:
+            return self.__decode_local(items)
+
+        shape = (len(items), self.img_res, self.img_res, 3)
+        with self.__lock:
+            shm = self.__shared_block(math.prod(shape))
+            out = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            remote_indices = {index for index, _ in remote}
+            for index, item in enumerate(items):
+                if index not in remote_indices:
+                    out[index] = draft_decode(item, self.img_res)
+
+            chunk_size = math.ceil(len(remote) / self.workers)
+            futures = [
+                self.__get_pool().submit(
+                    _decode_into,
+                    shm.name,
+                    shape,
+                    remote[start : start + chunk_size],
+                    self.img_res,
+                )
+                for start in range(0, len(remote), chunk_size)
+            ]
+            for future in futures:
+                future.result()
+            # Copy out, the block is overwritten by the next batch
+            return out.copy()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._shm_finalizer is not None:
+            self._shm_finalizer()
+            self._shm, self._shm_finalizer = None, None
+
+    def __decode_local(self, items: List[Any]) -> np.ndarray:
+        if not items:
+            return np.empty((0, self.img_res, self.img_res, 3), dtype=np.uint8)
+        return np.stack([draft_decode(item, self.img_res) for item in items])
+
+    def __get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def __shared_block(self, n_bytes: int) -> shared_memory.SharedMemory:
+        if self._shm is None or self._shm.size < n_bytes:
+            if self._shm_finalizer is not None:
+                self._shm_finalizer()
+            self._shm = shared_memory.SharedMemory(create=True, size=n_bytes)
+            # Unlinks the block even if `close` is never called
+            self._shm_finalizer = weakref.finalize(self, _release, self._shm)
+        return self._shm
@@ -0,0 +1,187 @@
+import io
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+from fastai.vision.all import TensorImage
+
+from logging_.log_and_print import Logger
+
+from typing import Any, List, Optional
+
+
+IMAGES_FILENAME = "images.u8"
+LABELS_FILENAME = "labels.npy"
+META_FILENAME = "meta.json"
+
+
+def to_resized_array(source: Any, img_res: int) -> np.ndarray:
+    """
+    Decodes `source` (path, raw bytes, PIL image or HxWx3 array) into an RGB uint8 array
+    squished to `img_res` x `img_res`, matching `Resize(img_res, method="squish")`.
+    """
+    if isinstance(source, np.ndarray):
+        if source.shape == (img_res, img_res, 3) and source.dtype == np.uint8:
+            return source
+        image = Image.fromarray(source)
+    elif isinstance(source, Image.Image):
+        image = source
+    elif isinstance(source, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        image = Image.open(source)
+    image = image.convert("RGB")
+    if image.size != (img_res, img_res):
+        image = image.resize((img_res, img_res), Image.BILINEAR)
+    return np.array(image, dtype=np.uint8)
+
+
+class CachedImageGetter:
+    """
+    fastai type transform that reads training images from a `TensorCache` by index.
+
+    Anything other than an index (a path, bytes, an array) is decoded and resized on the
+    fly, so an exported learner trained from the cache still predicts on plain files.
+    """
+
+    def __init__(self, cache_dir: Path, n_images: int, img_res: int):
+        self.cache_dir = Path(cache_dir)
+        self.n_images = n_images
+        self.img_res = img_res
+        self._images: Optional[np.memmap] = None
+
+    def __getstate__(self):
+        # The memmap is reopened lazily in each DataLoader worker / after unpickling
+        return {**self.__dict__, "_images": None}
+
+    @property
+    def images(self) -> np.memmap:
+        if self._images is None:
+            # Copy-on-write so torch.from_numpy gets a writable, zero-copy view
+            self._images = np.memmap(
+                self.cache_dir / IMAGES_FILENAME,
+                dtype=np.uint8,
+                mode="c",
+                shape=(self.n_images, self.img_res, self.img_res, 3),
+            )
+        return self._images
+
+    def __call__(self, item: Any) -> TensorImage:
+        if isinstance(item, (int, np.integer)):
+            array = self.images[item]
+        else:
+            array = to_resized_array(item, self.img_res)
+        return TensorImage(torch.from_numpy(array).permute(2, 0, 1))
+
+
+class CachedLabelGetter:
+    def __init__(self, labels: np.ndarray, vocab: List[str]):
+        self.labels = labels
+        self.vocab = vocab
+
+    def __call__(self, index: int) -> str:
+        return self.vocab[self.labels[index]]
+
+
+class TensorCache:
+    """
+    Decoded, pre-resized training images stored as one memory-mapped uint8 array of
+    shape (N, img_res, img_res, 3) plus a label array.
+
+    Each `img_res` gets its own directory under `cache_root`. The cache is rebuilt when
+    the dataset hash it was built from no longer matches.
+    """
+
+    def __init__(self, cache_root: Path, img_res: int):
+        self.logger = Logger("TensorCache", "magenta")
+        self.img_res = img_res
+        self.cache_dir = Path(cache_root) / f"res_{img_res}"
+        self.meta = self.__read_meta()
+
+    def __len__(self):
+        return self.meta["n_images"] if self.meta else 0
+
+    def is_valid(self, dataset_hash: str) -> bool:
+        return self.meta is not None and self.meta["dataset_hash"] == dataset_hash
+
+    def ensure(
+        self,
+        image_paths: List[Path],
+        labels: List[str],
+        dataset_hash: str,
+        workers: int = os.cpu_count() or 1,
+    ) -> "TensorCache":
+        if self.is_valid(dataset_hash):
+            self.logger.log(f"Reusing tensor cache with {len(self)} images")
+            return self
+        self.build(image_paths, labels, dataset_hash, workers)
+        return self
+
+    def build(
+        self,
+        image_paths: List[Path],
+        labels: List[str],
+        dataset_hash: str,
+        workers: int = os.cpu_count() or 1,
+    ) -> None:
+        self.logger.log(
+            f"Building {self.img_res}px tensor cache for {len(image_paths)} images"
+        )
+        tmp_dir = self.cache_dir.with_name(self.cache_dir.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        images = np.memmap(
+            tmp_dir / IMAGES_FILENAME,
+            dtype=np.uint8,
+            mode="w+",
+            shape=(len(image_paths), self.img_res, self.img_res, 3),
+        )
+
+        def decode_into(index: int) -> None:
+            images[index] = to_resized_array(image_paths[index], self.img_res)
+
+        # PIL releases the GIL while decoding, so threads are enough here
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(decode_into, range(len(image_paths))))
+        images.flush()
+        del images
+
+        vocab = sorted(set(labels))
+        label_to_id = {label: i for i, label in enumerate(vocab)}
+        label_ids = np.array([label_to_id[label] for label in labels], dtype=np.int64)
+        np.save(tmp_dir / LABELS_FILENAME, label_ids)
+        meta = {
+            "dataset_hash": dataset_hash,
+            "img_res": self.img_res,
+            "n_images": len(image_paths),
+            "vocab": vocab,
+            "paths": [str(path) for path in image_paths],
+        }
+        # meta.json is written last and marks the cache as complete
+        with open(tmp_dir / META_FILENAME, "w") as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.cache_dir)
+        self.meta = meta
+
+    def image_getter(self) -> CachedImageGetter:
+        return CachedImageGetter(self.cache_dir, len(self), self.img_res)
+
+    def label_getter(self) -> CachedLabelGetter:
+        return CachedLabelGetter(
+            np.load(self.cache_dir / LABELS_FILENAME), self.meta["vocab"]
+        )
+
+    def __read_meta(self) -> Optional[dict]:
+        meta_path = self.cache_dir / META_FILENAME
+        if not meta_path.exists():
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
@@ -0,0 +1,110 @@
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+
+from PIL import Image
+
+from dataset.manifest import DatasetManifest
+from logging_.log_and_print import Logger
+
+from typing import TYPE_CHECKING, Iterable, Optional, Tuple
+
+if TYPE_CHECKING:
+    from scrapers.images.scrape_cache import ScrapeCache
+
+
+MIN_IMAGE_SIDE = 32
+
+
+def verify_image(path: str, min_side: int = MIN_IMAGE_SIDE) -> Optional[str]:
+    """Returns None if the image is usable for training, otherwise the reason it isn't."""
+    try:
+        with Image.open(path) as img:
+            img.verify()
+        # verify() doesn't decode pixel data, so truncated files only fail on a full load
+        with Image.open(path) as img:
+            if min(img.size) < min_side:
+                return f"Image too small: {img.size[0]}x{img.size[1]}px"
+            img.convert("RGB").load()
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+class ImageVerifier:
+    """
+    Checks every not-yet-verified image in a manifest across a process pool and moves
+    failures into `quarantine_path`, mirroring their layout under the manifest root.
+    Without a `quarantine_path`, e.g. for a user's own dataset folder that must not be
+    modified, failures stay where they are and are only marked as failed in the manifest,
+    which leaves them out of `paths(verified_only=True)`.
+
+    Results are stored in the manifest, and a file is only checked again once its size
+    or mtime changes. Quarantined downloads are also marked in `scrape_cache`, the
+    ledger of the scraper that fetched them, so their URLs are not downloaded again.
+    """
+
+    def __init__(
+        self,
+        manifest: DatasetManifest,
+        quarantine_path: Optional[Path],
+        min_side: int = MIN_IMAGE_SIDE,
+        workers: Optional[int] = None,
+        inline_threshold: int = 64,
+        scrape_cache: Optional["ScrapeCache"] = None,
+    ):
+        self.logger = Logger("ImageVerifier", "yellow")
+        self.manifest = manifest
+        self.quarantine_path = (
+            Path(quarantine_path) if quarantine_path is not None else None
+        )
+        self.min_side = min_side
+        self.workers = workers or os.cpu_count() or 1
+        self.inline_threshold = inline_threshold
+        self.scrape_cache = scrape_cache
+
+    def run(self, labels: Optional[Iterable[str]] = None) -> Tuple[int, int]:
+        """Verifies pending images and returns (verified count, failed count)."""
+        pending = self.manifest.unverified(labels)
+        if not pending:
+            return 0, 0
+        self.logger.log(f"Verifying {len(pending)} new images")
+
+        paths = [str(path) for path in pending]
+        if len(paths) <= self.inline_threshold or self.workers == 1:
+            errors = [verify_image(path, self.min_side) for path in paths]
+        else:
+            chunksize = max(1, len(paths) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                errors = list(
+                    executor.map(
+                        verify_image, paths, repeat(self.min_side), chunksize=chunksize
+                    )
+                )
+
+        passed = {path: True for path, error in zip(pending, errors) if error is None}
+        failed = [(path, error) for path, error in zip(pending, errors) if error]
+        self.manifest.set_verified(passed)
+        if self.quarantine_path is None:
+            for path, error in failed:
+                self.logger.log(f"Excluding {path}: {error}", color_override="red")
+            self.manifest.set_verified({path: False for path, _ in failed})
+        else:
+            for path, error in failed:
+                self.logger.log(f"Quarantining {path}: {error}", color_override="red")
+                self.__quarantine(path)
+            self.manifest.remove(path for path, _ in failed)
+            if self.scrape_cache is not None:
+                self.scrape_cache.record_quarantined(failed)
+
+        return len(passed), len(failed)
+
+    def __quarantine(self, path: Path) -> None:
+        dest = self.quarantine_path / path.relative_to(self.manifest.root)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            shutil.move(path, dest)
+        except FileNotFoundError:
+            pass
@@ -1,18 +1,29 @@
+import json
 import time
 from pathlib import Path
 
 from constants import VERBOSE
+from logging_.log_writer import LogWriter
 from utils.path_utils import ProjPaths
 
 from termcolor import colored
-from typing import Any, Union
+from typing import Any, Optional, Union
 
 
 class Logger:
-    def __init__(self, caller_name, color="green"):
+    def __init__(
+        self,
+        caller_name,
+        color="green",
+        verbose: Optional[bool] = None,
+        structured: bool = False,
+    ):
         self.name = caller_name
         self.color = color
         self.prefix_color = f"light_{color}"
+        self.verbose = VERBOSE if verbose is None else verbose
+        # JSON-lines records ({"time", "logger", "message"}) instead of plain text
+        self.structured = structured
 
         # Create logfile
         hour_time = time.strftime("%H_%M_%S")
@@ -22,6 +33,7 @@ class Logger:
         except FileNotFoundError:
             open(ProjPaths.get_logs() / Path(self.filename), "w").close()
             self.logfile_path = ProjPaths.get_logs(self.filename)
+        self.writer = LogWriter.for_path(self.logfile_path)
 
     def log(
         self,
@@ -30,7 +42,7 @@ class Logger:
         color_override: Union[str, bool] = False,
         inline: bool = False,
     ):
-        if VERBOSE:
+        if self.verbose:
             if isinstance(message, dict):
                 message = self.prettify_dict(message)
             elif isinstance(message, list):
@@ -39,8 +51,11 @@ class Logger:
         if not print_only:
             self.__write_to_log(message)
 
+    def flush(self) -> None:
+        self.writer.flush()
+
     def preview_dataframe(self, df):
-        if VERBOSE:
+        if self.verbose:
             print(
                 colored(
                     f"[{self.name}]", self.prefix_color, "on_black", attrs=["bold"]
@@ -58,15 +73,18 @@ class Logger:
         return "[\n" + "\n    ".join([str(item) for item in lst]) + "\n]"
 
     def __write_to_log(self, message):
-        with open(self.logfile_path, "a") as f:
-            f.write(str(message) + "\n")
+        if self.structured:
+            line = json.dumps(
+                {"time": time.time(), "logger": self.name, "message": message},
+                default=str,
+            )
+        else:
+            line = str(message)
+        self.writer.write(line)
 
     def __print(self, message, color_override=False, inline=False):
-        if VERBOSE:
-            print(
-                colored(
-                    f"[{self.name}]", self.prefix_color, "on_black", attrs=["bold"]
-                ),
-                "\n" if inline else "",
-                colored(f"{str(message).strip()}", color_override or self.color),
-            )
+        print(
+            colored(f"[{self.name}]", self.prefix_color, "on_black", attrs=["bold"]),
+            "\n" if inline else "",
+            colored(f"{str(message).strip()}", color_override or self.color),
+        )
@@ -0,0 +1,88 @@
+import atexit
+import threading
+from collections import deque
+from pathlib import Path
+
+from typing import Dict
+
+
+class LogWriter:
+    """
+    Appends lines to a logfile from a background thread.
+
+    `write` only appends to an in-memory ring buffer, so callers never touch the file.
+    The writer thread drains the buffer in batches every `flush_interval` seconds, or
+    sooner once `batch_size` lines are waiting. If the buffer fills up faster than it
+    drains, the oldest lines are dropped and counted rather than blocking the caller.
+    """
+
+    __writers: Dict[Path, "LogWriter"] = {}
+    __writers_lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path: Path) -> "LogWriter":
+        """One shared writer per logfile."""
+        path = Path(path)
+        with cls.__writers_lock:
+            if path not in cls.__writers:
+                cls.__writers[path] = cls(path)
+            return cls.__writers[path]
+
+    @classmethod
+    def flush_all(cls) -> None:
+        with cls.__writers_lock:
+            writers = list(cls.__writers.values())
+        for writer in writers:
+            writer.flush()
+
+    def __init__(
+        self,
+        path: Path,
+        buffer_size: int = 10_000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+    ):
+        self.path = Path(path)
+        self.buffer: deque = deque(maxlen=buffer_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.__condition = threading.Condition()
+        self.__file_lock = threading.Lock()
+        self.__thread = threading.Thread(
+            target=self.__run, name=f"log-writer-{self.path.name}", daemon=True
+        )
+        self.__thread.start()
+
+    def write(self, line: str) -> None:
+        with self.__condition:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.dropped += 1
+            self.buffer.append(line)
+            if len(self.buffer) >= self.batch_size:
+                self.__condition.notify()
+
+    def flush(self) -> None:
+        # Draining under the file lock keeps batches in order across flushing threads
+        with self.__file_lock:
+            with self.__condition:
+                lines = list(self.buffer)
+                self.buffer.clear()
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                lines.insert(
+                    0, f"[LogWriter] Dropped {dropped} log lines, buffer was full"
+                )
+            if not lines:
+                return
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                self.__condition.wait(timeout=self.flush_interval)
+            self.flush()
+
+
+atexit.register(LogWriter.flush_all)
@@ -0,0 +1,79 @@
+import itertools
+
+import numpy as np
+
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from fastai.learner import Learner
+
+    from dataset.parallel_decode import ParallelDecoder
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def learner_img_res(learner: "Learner") -> Optional[int]:
+    """Square squish size of the learner's `Resize` item transform, if it has one."""
+    for tfm in learner.dls.after_item.fs:
+        size = getattr(tfm, "size", None)
+        if type(tfm).__name__ == "Resize" and getattr(tfm, "method", None) == "squish":
+            if size is not None and size[0] == size[1]:
+                return int(size[0])
+    return None
+
+
+def iter_batch_probs(
+    learner: "Learner",
+    items: Iterable[Any],
+    batch_size: int = 64,
+    chunk_batches: int = 16,
+    num_workers: int = 0,
+    decoder: Optional["ParallelDecoder"] = None,
+) -> Iterator[np.ndarray]:
+    """
+    Runs batched forward passes over `items` and yields one float32 array of shape
+    (batch, n_classes) per batch, in input order. Columns follow `learner.dls.vocab`.
+
+    Items are consumed lazily `batch_size * chunk_batches` at a time, so memory stays
+    bounded no matter how long the input iterable is. `num_workers` defaults to 0 since
+    spawning DataLoader workers for every chunk costs more than it saves on small inputs.
+    With a `decoder`, each chunk is decoded to model-sized arrays up front, and the
+    learner's own `Resize` has nothing left to do.
+    """
+    import torch
+
+    model = learner.model.eval()
+    activation = getattr(learner.loss_func, "activation", None)
+    with torch.inference_mode():
+        for chunk in chunked(items, batch_size * chunk_batches):
+            if decoder is not None:
+                chunk = list(decoder.decode(chunk))
+            # rm_type_tfms=0 keeps the full type pipeline, so raw paths, bytes and
+            # arrays are decoded the same way regardless of how the learner was trained
+            test_dl = learner.dls.test_dl(
+                chunk, bs=batch_size, rm_type_tfms=0, num_workers=num_workers
+            )
+            for batch in test_dl:
+                logits = model(batch[0])
+                probs = (
+                    activation(logits)
+                    if activation is not None
+                    else torch.softmax(logits, dim=1)
+                )
+                yield probs.float().cpu().numpy()
+
+
+def batch_probs(
+    learner: "Learner",
+    items: Iterable[Any],
+    batch_size: int = 64,
+    decoder: Optional["ParallelDecoder"] = None,
+) -> np.ndarray:
+    batches = list(iter_batch_probs(learner, items, batch_size, decoder=decoder))
+    if not batches:
+        return np.empty((0, len(learner.dls.vocab)), dtype=np.float32)
+    return np.concatenate(batches)
@@ -0,0 +1,269 @@
+"""
+fastai training callbacks. Pass them to `fit`/`fine_tune` through `cbs=` rather than to
+the Learner, so they are removed after training and never end up in an exported model.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+from fastai.callback.core import Callback, CancelFitException
+from fastai.callback.tracker import EarlyStoppingCallback, SaveModelCallback
+
+from logging_.log_and_print import Logger
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    from fastai.learner import Learner
+
+
+class ThroughputCallback(Callback):
+    """Logs training images/sec for every epoch, to compare DataLoader settings."""
+
+    order = 60
+
+    def __init__(self):
+        self.logger = Logger("Throughput", "cyan")
+        self.history: List[Dict[str, float]] = []
+
+    def before_train(self):
+        self.n_images = 0
+        self.start = time.perf_counter()
+
+    def after_batch(self):
+        if self.training:
+            self.n_images += len(self.yb[0])
+
+    def after_train(self):
+        seconds = time.perf_counter() - self.start
+        images_per_sec = self.n_images / seconds if seconds > 0 else 0.0
+        self.history.append(
+            {
+                "epoch": self.epoch,
+                "images": self.n_images,
+                "seconds": seconds,
+                "images_per_sec": images_per_sec,
+            }
+        )
+        self.logger.log(
+            f"Epoch {self.epoch}: {self.n_images} images in {seconds:.1f}s "
+            f"({images_per_sec:.1f} images/sec)"
+        )
+
+
+class TimeBudgetCallback(Callback):
+    """
+    Stops training at a `time.monotonic()` deadline. After each epoch, training stops if
+    another epoch as long as the last one would not finish in time. Mid-epoch it stops
+    once the deadline has passed, throwing away that partial epoch.
+    """
+
+    order = 65
+
+    def __init__(self, deadline: float):
+        self.logger = Logger("TimeBudget", "yellow")
+        self.deadline = deadline
+        self.exceeded = False
+
+    def before_epoch(self):
+        self.epoch_start = time.monotonic()
+
+    def after_batch(self):
+        if self.training and time.monotonic() >= self.deadline:
+            self.__stop(f"Time budget ran out during epoch {self.epoch}")
+
+    def after_epoch(self):
+        epoch_seconds = time.monotonic() - self.epoch_start
+        if time.monotonic() + epoch_seconds > self.deadline:
+            self.__stop(
+                f"Stopping after epoch {self.epoch}, another {epoch_seconds:.0f}s epoch "
+                "would overrun the time budget"
+            )
+
+    def __stop(self, message: str) -> None:
+        self.exceeded = True
+        self.logger.log(message)
+        raise CancelFitException()
+
+
+class SkippedEpochsMixin:
+    """
+    For tracker callbacks used with `fit(start_epoch=...)`, which cancels the epochs
+    before `start_epoch`. Those epochs record no metrics for `after_epoch` to compare.
+    """
+
+    def before_epoch(self):
+        self.skipped_epoch = False
+
+    def after_cancel_epoch(self):
+        self.skipped_epoch = True
+
+    def after_epoch(self):
+        if not self.skipped_epoch:
+            super().after_epoch()
+
+
+class ResumableEarlyStoppingCallback(SkippedEpochsMixin, EarlyStoppingCallback):
+    pass
+
+
+class TrainingCheckpointCallback(SkippedEpochsMixin, SaveModelCallback):
+    """
+    `SaveModelCallback` that makes training resumable.
+
+    The best epoch by `monitor` is saved as `<fname>.pth` and loaded back when a fit
+    ends, as usual. After every epoch the latest weights and optimizer state are also
+    saved as `<fname>.last.pth`, and `<fname>.json` records which fit and epoch they
+    belong to. A new callback for the same `fname` reads that record, so a restarted run
+    can `restore` the learner and skip ahead with `start_epoch`.
+
+    The best value is kept across fits, so the frozen and unfrozen phases of
+    `fine_tune` share one best checkpoint. The learner's `model_dir` must be
+    `checkpoint_dir`.
+    """
+
+    def __init__(self, checkpoint_dir: Path, fname: str, monitor: str = "error_rate"):
+        super().__init__(monitor=monitor, fname=fname, reset_on_fit=False)
+        self.logger = Logger("TrainingCheckpoint", "yellow")
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.state_path = self.checkpoint_dir / f"{fname}.json"
+        self.state: Optional[Dict[str, Any]] = None
+        if self.state_path.exists():
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+            self.best = self.state["best"]
+        # Index of the current fit, set by the caller before each one
+        self.fit_index = 0
+        self.started = time.monotonic()
+        self.elapsed_before = self.state["elapsed"] if self.state else 0.0
+
+    @property
+    def elapsed(self) -> float:
+        """Training seconds across this run and the interrupted ones it resumes."""
+        return self.elapsed_before + time.monotonic() - self.started
+
+    @property
+    def done(self) -> bool:
+        return self.state is not None and self.state["done"]
+
+    def start_epoch(self, fit_index: int, n_epoch: int) -> Optional[int]:
+        """First epoch of fit `fit_index` still to run, None if it already ran."""
+        if self.done:
+            return None
+        if self.state is None or fit_index > self.state["fit_index"]:
+            return 0
+        if fit_index < self.state["fit_index"]:
+            return None
+        start_epoch = self.state["epoch"] + 1
+        return start_epoch if start_epoch < n_epoch else None
+
+    def restore(self, learn: "Learner", with_opt: bool = True) -> None:
+        """
+        Loads the latest weights into `learn`, or the best ones once training is done.
+        `freeze_to` clears the optimizer state, so `learn` must already be frozen as in
+        the fit being resumed.
+        """
+        if self.state is None:
+            return
+        if self.done:
+            learn.load(self.fname, weights_only=False)
+        else:
+            learn.load(f"{self.fname}.last", with_opt=with_opt, weights_only=False)
+        self.logger.log(
+            f"Resuming from fit {self.state['fit_index']} epoch {self.state['epoch']} "
+            f"(best {self.monitor} {self.best:.4f})"
+        )
+
+    def after_epoch(self):
+        if self.skipped_epoch:
+            return
+        super().after_epoch()
+        self.learn.save(f"{self.fname}.last", with_opt=True)
+        self.__write_state(epoch=self.epoch, done=False)
+
+    def after_cancel_fit(self):
+        # Early stopping or the time budget ended training, it is not resumed
+        if self.state is not None:
+            self.__write_state(epoch=self.state["epoch"], done=True)
+
+    def after_fit(self, **kwargs):
+        # Nothing to load when the fit was cancelled before its first epoch
+        if (self.checkpoint_dir / f"{self.fname}.pth").exists():
+            super().after_fit(**kwargs)
+
+    def finish(self) -> None:
+        """Marks training complete, so a rerun goes straight to the best weights."""
+        if self.state is not None:
+            self.__write_state(epoch=self.state["epoch"], done=True)
+
+    def clear(self) -> None:
+        for path in (
+            self.checkpoint_dir / f"{self.fname}.pth",
+            self.checkpoint_dir / f"{self.fname}.last.pth",
+            self.state_path,
+        ):
+            path.unlink(missing_ok=True)
+
+    def __write_state(self, epoch: int, done: bool) -> None:
+        self.state = {
+            "fit_index": self.fit_index,
+            "epoch": epoch,
+            "best": float(self.best),
+            "elapsed": self.elapsed,
+            "done": done,
+        }
+        tmp_path = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def fine_tune_resumable(
+    learn: "Learner",
+    epochs: int,
+    checkpoint: TrainingCheckpointCallback,
+    cbs: Sequence[Callback] = (),
+    early_stopping: Optional[EarlyStoppingCallback] = None,
+    base_lr: float = 2e-3,
+) -> None:
+    """
+    `Learner.fine_tune`'s schedule, with one `fit_one_cycle` per phase so either can be
+    resumed part way through from `checkpoint`, which must be in `cbs`.
+    `early_stopping` only watches the unfrozen phase, which is not started once a
+    `TimeBudgetCallback` in `cbs` has stopped training.
+    """
+    phases = [
+        (1, slice(base_lr), {"pct_start": 0.99}),
+        (epochs, slice(base_lr / 2 / 100, base_lr / 2), {"pct_start": 0.3, "div": 5.0}),
+    ]
+    budget = next((cb for cb in cbs if isinstance(cb, TimeBudgetCallback)), None)
+    restored = False
+    for fit_index, (n_epoch, lr_max, kwargs) in enumerate(phases):
+        start_epoch = checkpoint.start_epoch(fit_index, n_epoch)
+        if start_epoch is None:
+            continue
+        if checkpoint.done or (budget is not None and budget.exceeded):
+            break
+        fit_cbs = list(cbs)
+        if fit_index == 0:
+            learn.freeze()
+        else:
+            learn.unfreeze()
+            if early_stopping is not None:
+                # Improvements are measured against the best epoch so far
+                early_stopping.best = checkpoint.best
+                fit_cbs.append(early_stopping)
+        if not restored:
+            # A phase starting from its first epoch begins with a fresh optimizer state
+            checkpoint.restore(learn, with_opt=start_epoch > 0)
+            restored = True
+        checkpoint.fit_index = fit_index
+        learn.fit_one_cycle(
+            n_epoch, lr_max, cbs=fit_cbs, start_epoch=start_epoch, **kwargs
+        )
+    if not restored:
+        # Nothing left to run, the best weights are all that is needed
+        checkpoint.restore(learn)
+    checkpoint.finish()
@@ -0,0 +1,222 @@
+"""
+Exports a trained learner as a self-contained TorchScript artifact for CPU inference.
+
+The artifact takes a uint8 (N, img_res, img_res, 3) batch and returns class
+probabilities: the int -> float conversion, the learner's `Normalize` stats and the loss
+function's activation are traced into the graph, so `model.cpu_runtime.CpuClassifier`
+can run it without fastai. The network itself can be left in fp32 or quantized to int8:
+
+    dynamic   int8 weights for the Linear layers of the head, activations stay float
+    static    FX graph mode int8 for the whole network, calibrated on training batches
+
+`compare_exports` reports accuracy against the original learner on a validation set,
+plus single-image latency and batch throughput.
+"""
+
+import copy
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+
+from logging_.log_and_print import Logger
+from model.batch_inference import batch_probs
+from model.cpu_runtime import META_FILENAME, CpuClassifier
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    from fastai.learner import Learner
+
+
+QUANTIZE_MODES = ("none", "dynamic", "static")
+
+
+class FusedPreprocessModel(nn.Module):
+    """uint8 NHWC images -> probabilities, with preprocessing and activation inlined."""
+
+    def __init__(
+        self,
+        model: nn.Module,
+        mean: Optional[torch.Tensor],
+        std: Optional[torch.Tensor],
+        activation: Optional[Callable[[torch.Tensor], torch.Tensor]],
+    ):
+        super().__init__()
+        self.model = model
+        self.normalize = mean is not None
+        self.register_buffer(
+            "mean", mean.view(1, 3, 1, 1) if mean is not None else torch.zeros(1)
+        )
+        self.register_buffer(
+            "std", std.view(1, 3, 1, 1) if std is not None else torch.ones(1)
+        )
+        self.activation = activation
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        x = images.permute(0, 3, 1, 2).float().div(255)
+        if self.normalize:
+            x = (x - self.mean) / self.std
+        logits = self.model(x)
+        if self.activation is not None:
+            return self.activation(logits)
+        return torch.softmax(logits, dim=1)
+
+
+def normalization_stats(learner: "Learner") -> Optional[tuple]:
+    """(mean, std) of the learner's `Normalize` batch transform, if it has one."""
+    for tfm in learner.dls.after_batch.fs:
+        if type(tfm).__name__ == "Normalize":
+            return (
+                torch.as_tensor(tfm.mean, dtype=torch.float32).flatten().cpu(),
+                torch.as_tensor(tfm.std, dtype=torch.float32).flatten().cpu(),
+            )
+    return None
+
+
+def quantized_engine() -> str:
+    """fbgemm-based `x86` on Intel/AMD, `qnnpack` on ARM."""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError(f"No int8 CPU backend available, found {engines}")
+
+
+def export_torchscript(
+    learner: "Learner",
+    path: Path,
+    img_res: int,
+    quantize: str = "static",
+    calibration: Optional[Iterable[torch.Tensor]] = None,
+) -> Path:
+    """
+    Args:
+        quantize (str): One of `QUANTIZE_MODES`.
+        calibration (Optional[Iterable[torch.Tensor]]): Preprocessed float batches, as
+            the model sees them after `after_batch`, used to pick the int8 activation
+            ranges. Required for static quantization.
+    """
+    if quantize not in QUANTIZE_MODES:
+        raise ValueError(f"quantize must be one of {QUANTIZE_MODES}, got {quantize!r}")
+    logger = Logger("CpuExport", "magenta")
+    model = copy.deepcopy(learner.model).cpu().eval()
+    meta: Dict[str, Any] = {
+        "vocab": [str(label) for label in learner.dls.vocab],
+        "img_res": img_res,
+        "quantize": quantize,
+    }
+
+    if quantize != "none":
+        engine = quantized_engine()
+        torch.backends.quantized.engine = engine
+        meta["quantized_engine"] = engine
+    if quantize == "dynamic":
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {nn.Linear}, dtype=torch.qint8
+        )
+    elif quantize == "static":
+        if calibration is None:
+            raise ValueError("Static quantization needs calibration batches")
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        example = torch.zeros(1, 3, img_res, img_res)
+        prepared = prepare_fx(model, get_default_qconfig_mapping(engine), (example,))
+        n_calibration = 0
+        with torch.inference_mode():
+            for batch in calibration:
+                batch = torch.as_tensor(batch).as_subclass(torch.Tensor)
+                prepared(batch.float().cpu())
+                n_calibration += len(batch)
+        logger.log(f"Calibrated int8 ranges on {n_calibration} images")
+        model = convert_fx(prepared)
+
+    stats = normalization_stats(learner)
+    fused = FusedPreprocessModel(
+        model,
+        *(stats or (None, None)),
+        activation=getattr(learner.loss_func, "activation", None),
+    ).eval()
+    example = torch.zeros(2, img_res, img_res, 3, dtype=torch.uint8)
+    with torch.inference_mode():
+        scripted = torch.jit.freeze(torch.jit.trace(fused, example))
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.jit.save(scripted, str(path), _extra_files={META_FILENAME: json.dumps(meta)})
+    logger.log(f"Exported {quantize} TorchScript model to {path}")
+    return path
+
+
+def compare_exports(
+    learner: "Learner",
+    artifact_paths: Dict[str, Path],
+    inputs: List[Any],
+    targets: List[str],
+    batch_size: int = 64,
+    n_latency: int = 32,
+) -> List[Dict[str, Any]]:
+    """
+    Accuracy, agreement with the original learner, single-image p50 latency and batch
+    throughput for the learner (row "fastai") and each exported artifact.
+    """
+    logger = Logger("CpuExport", "magenta")
+    vocab = [str(label) for label in learner.dls.vocab]
+    target_ids = np.array([vocab.index(str(target)) for target in targets])
+    latency_inputs = inputs[:n_latency]
+
+    def measure(name: str, predict_batch: Callable[[List[Any]], np.ndarray]) -> dict:
+        # TorchScript optimizes the graph over its first few calls
+        for _ in range(3):
+            predict_batch(latency_inputs[:1])
+        latencies = []
+        for item in latency_inputs:
+            start = time.perf_counter()
+            predict_batch([item])
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        probs = predict_batch(inputs)
+        seconds = time.perf_counter() - start
+        return {
+            "name": name,
+            "probs": probs,
+            "accuracy": float((probs.argmax(axis=1) == target_ids).mean()),
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "images_per_sec": len(inputs) / seconds if seconds > 0 else float("inf"),
+        }
+
+    rows = [
+        measure(
+            "fastai", lambda items: batch_probs(learner, items, batch_size=batch_size)
+        )
+    ]
+    for name, path in artifact_paths.items():
+        runtime = CpuClassifier(path)
+        try:
+            rows.append(
+                measure(name, lambda items: runtime.predict_batch(items, batch_size))
+            )
+        finally:
+            runtime.close()
+        rows[-1]["size_mb"] = Path(path).stat().st_size / 1e6
+
+    reference = rows[0]
+    reference_ids = reference["probs"].argmax(axis=1)
+    for row in rows:
+        predicted_ids = row.pop("probs").argmax(axis=1)
+        row["accuracy_delta"] = row["accuracy"] - reference["accuracy"]
+        row["agreement"] = float((predicted_ids == reference_ids).mean())
+        row["speedup"] = row["images_per_sec"] / reference["images_per_sec"]
+
+    logger.log(f"CPU export comparison on {len(inputs)} validation images")
+    for row in rows:
+        logger.log(
+            f"{row['name']:<10} accuracy {row['accuracy']:.4f} "
+            f"({row['accuracy_delta']:+.4f}), agreement {row['agreement']:.4f}, "
+            f"p50 {row['p50_ms']:.2f}ms, {row['images_per_sec']:.1f} img/s "
+            f"({row['speedup']:.2f}x)"
+        )
+    return rows
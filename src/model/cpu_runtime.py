@@ -0,0 +1,66 @@
+"""
+Loads the TorchScript artifacts written by `model.cpu_export` and predicts on CPU.
+
+Only torch, numpy and PIL are imported: preprocessing (uint8 -> float, normalization)
+and the output activation are part of the scripted graph, so nothing from fastai is
+needed at inference time.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from dataset.parallel_decode import ParallelDecoder
+
+from typing import Any, Iterable, List, Optional, Tuple
+
+
+META_FILENAME = "meta.json"
+
+
+class CpuClassifier:
+    def __init__(self, artifact_path: Path, decode_workers: Optional[int] = None):
+        """
+        Args:
+            decode_workers (Optional[int]): Processes used to decode large batches of
+                paths, see `ParallelDecoder`. Defaults to one per CPU.
+        """
+        extra_files = {META_FILENAME: ""}
+        self.artifact_path = Path(artifact_path)
+        self.model = torch.jit.load(
+            str(artifact_path), map_location="cpu", _extra_files=extra_files
+        ).eval()
+        self.meta = json.loads(extra_files[META_FILENAME])
+        engine = self.meta.get("quantized_engine")
+        if engine and engine in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = engine
+        self.vocab: List[str] = self.meta["vocab"]
+        self.img_res: int = self.meta["img_res"]
+        self.decoder = ParallelDecoder(
+            self.img_res, decode_workers or os.cpu_count() or 1
+        )
+
+    def predict_batch(self, images: Iterable[Any], batch_size: int = 64) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: float32 array of shape (len(images), n_classes), columns in
+                `self.vocab` order like `BinaryImageClassifier.predict_batch`.
+        """
+        images = list(images)
+        ret = [np.empty((0, len(self.vocab)), dtype=np.float32)]
+        with torch.inference_mode():
+            for start in range(0, len(images), batch_size):
+                arrays = self.decoder.decode(images[start : start + batch_size])
+                ret.append(self.model(torch.from_numpy(arrays)).float().numpy())
+        return np.concatenate(ret)
+
+    def predict(self, image: Any) -> Tuple[str, np.ndarray]:
+        """(predicted label, probabilities in `self.vocab` order)."""
+        probs = self.predict_batch([image])[0]
+        return self.vocab[int(np.argmax(probs))], probs
+
+    def close(self) -> None:
+        self.decoder.close()
@@ -0,0 +1,416 @@
+"""
+Classifies images as they land in a directory and appends the results to a JSONL or CSV
+file.
+
+Run from `src/`:
+    python -m model.folder_watch --model ../data/models/<key>.pkl --watch ../incoming \\
+        --output ../results.jsonl
+
+New files are found with watchdog (inotify/FSEvents) when it is installed, otherwise by
+polling. A file is only picked up once its size and mtime have stopped changing. Paths
+flow through bounded queues (discovery -> decode threads -> batched inference), so a
+slow model blocks discovery instead of buffering images in memory. Processed files are
+recorded in a SQLite checkpoint next to the output, and a restart skips them.
+"""
+
+import argparse
+import csv
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from constants import PICTURE_EXTENSION_LIST
+from dataset.parallel_decode import draft_decode
+from logging_.log_and_print import Logger
+from model.batch_inference import batch_probs, learner_img_res
+
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from fastai.learner import Learner
+
+    from model.image_classifier import BinaryImageClassifier
+
+
+# (size, mtime_ns) identifies one version of a file
+FileVersion = Tuple[int, int]
+
+
+class ResultSink:
+    """Appends one row per classified file to a `.jsonl` or `.csv` file."""
+
+    def __init__(self, path: Path, vocab: List[str]):
+        self.path = Path(path)
+        self.vocab = vocab
+        self.is_csv = self.path.suffix.lower() == ".csv"
+        self.fieldnames = ["path", "prediction", "error", "classified_at"] + [
+            f"p_{label}" for label in vocab
+        ]
+        write_header = self.is_csv and (
+            not self.path.exists() or self.path.stat().st_size == 0
+        )
+        self.file = open(self.path, "a", newline="")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames)
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, rows: List[dict]) -> None:
+        for row in rows:
+            if self.is_csv:
+                probs = row.get("probabilities") or {}
+                self.writer.writerow(
+                    {
+                        **{k: row.get(k) for k in self.fieldnames[:4]},
+                        **{f"p_{label}": probs.get(label) for label in self.vocab},
+                    }
+                )
+            else:
+                self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ClassificationCheckpoint:
+    """SQLite record of which file versions have been classified already."""
+
+    def __init__(self, db_path: Path):
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed "
+            "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)"
+        )
+        self.__lock = threading.Lock()
+        self.processed: Dict[str, FileVersion] = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self.conn.execute("SELECT * FROM processed")
+        }
+
+    def is_done(self, path: Path, version: FileVersion) -> bool:
+        return self.processed.get(str(path)) == version
+
+    def mark(self, entries: List[Tuple[Path, FileVersion]]) -> None:
+        with self.__lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO processed VALUES (?, ?, ?)",
+                [(str(path), size, mtime) for path, (size, mtime) in entries],
+            )
+            for path, version in entries:
+                self.processed[str(path)] = version
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class FolderClassifier:
+    """
+    Runs a trained learner over a watched folder. Like `InferenceServer` it wraps the
+    fastai `Learner` itself rather than a `BinaryImageClassifier`, since constructing
+    one of those scrapes and verifies a training set. Use `from_classifier` to watch
+    with a classifier that is already trained, or `from_export` for a stored model.
+    """
+
+    def __init__(
+        self,
+        learner: "Learner",
+        watch_dir: Path,
+        output_path: Path,
+        checkpoint_path: Optional[Path] = None,
+        batch_size: int = 32,
+        max_wait: float = 0.5,
+        queue_size: int = 256,
+        decode_workers: int = 4,
+        poll_interval: float = 1.0,
+        settle_seconds: float = 1.0,
+        use_watchdog: bool = True,
+    ):
+        self.logger = Logger("FolderClassifier", "green")
+        self.learner = learner
+        self.vocab = list(learner.dls.vocab)
+        self.img_res = learner_img_res(learner)
+        self.watch_dir = Path(watch_dir)
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.decode_workers = decode_workers
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.use_watchdog = use_watchdog
+
+        self.sink = ResultSink(output_path, self.vocab)
+        self.checkpoint = ClassificationCheckpoint(
+            checkpoint_path or Path(output_path).with_suffix(".checkpoint.sqlite")
+        )
+        # Both queues are bounded: a slow model stalls discovery rather than memory
+        self.paths: "queue.Queue[Optional[Tuple[Path, FileVersion]]]" = queue.Queue(
+            queue_size
+        )
+        self.decoded: "queue.Queue" = queue.Queue(max(batch_size * 2, queue_size // 4))
+        self.in_flight: Dict[Path, FileVersion] = {}
+        self.__in_flight_lock = threading.Lock()
+        self.classified = 0
+        self.failed = 0
+
+    @classmethod
+    def from_classifier(
+        cls, classifier: "BinaryImageClassifier", *args: Any, **kwargs: Any
+    ) -> "FolderClassifier":
+        return cls(classifier.model, *args, **kwargs)
+
+    @classmethod
+    def from_export(
+        cls, model_path: Path, *args: Any, **kwargs: Any
+    ) -> "FolderClassifier":
+        from fastai.learner import load_learner
+
+        return cls(load_learner(model_path, cpu=True), *args, **kwargs)
+
+    def run(
+        self, stop_event: Optional[threading.Event] = None, once: bool = False
+    ) -> None:
+        """
+        Classifies until `stop_event` is set. With `once`, classifies the files already in
+        the directory and returns.
+        """
+        stop_event = stop_event or threading.Event()
+        threads = [
+            threading.Thread(
+                target=self.__discover, args=(stop_event, once), name="folder-discovery"
+            )
+        ] + [
+            threading.Thread(target=self.__decode, name=f"folder-decode-{i}")
+            for i in range(self.decode_workers)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self.logger.log(f"Classifying images in {self.watch_dir} into {self.sink.path}")
+        try:
+            self.__classify()
+        finally:
+            stop_event.set()
+            self.sink.close()
+            self.checkpoint.close()
+        self.logger.log(f"Classified {self.classified} images, {self.failed} failed")
+
+    def __discover(self, stop_event: threading.Event, once: bool) -> None:
+        observer = None
+        changed: "queue.Queue[Path]" = queue.Queue()
+        if self.use_watchdog and not once:
+            observer = self.__start_watchdog(changed)
+
+        # path -> (version, first seen at) for files that may still be written to
+        pending: Dict[Path, Tuple[FileVersion, float]] = {}
+        next_scan = 0.0
+        try:
+            while not stop_event.is_set():
+                now = time.monotonic()
+                if observer is None or next_scan == 0.0:
+                    if now >= next_scan:
+                        for path in self.__scan():
+                            pending.setdefault(path, (None, now))
+                        next_scan = now + self.poll_interval
+                while not changed.empty():
+                    pending.setdefault(changed.get_nowait(), (None, now))
+
+                for path, (previous, _) in list(pending.items()):
+                    version = self.__version(path)
+                    if version is None:
+                        del pending[path]
+                        continue
+                    if self.checkpoint.is_done(path, version) or self.__is_in_flight(
+                        path, version
+                    ):
+                        del pending[path]
+                        continue
+                    settled = time.time() - version[1] / 1e9 >= self.settle_seconds
+                    if once or (version == previous and settled):
+                        del pending[path]
+                        with self.__in_flight_lock:
+                            self.in_flight[path] = version
+                        # Blocks while the decode queue is full
+                        self.paths.put((path, version))
+                    else:
+                        pending[path] = (version, now)
+
+                if once:
+                    break
+                stop_event.wait(min(self.poll_interval, self.settle_seconds) / 2)
+        finally:
+            if observer is not None:
+                observer.stop()
+            for _ in range(self.decode_workers):
+                self.paths.put(None)
+
+    def __decode(self) -> None:
+        while (item := self.paths.get()) is not None:
+            path, version = item
+            try:
+                if self.img_res is not None:
+                    array = draft_decode(path, self.img_res)
+                else:
+                    with Image.open(path) as image:
+                        array = np.array(image.convert("RGB"))
+                self.decoded.put((path, version, array, None))
+            except Exception as e:
+                self.decoded.put((path, version, None, f"{type(e).__name__}: {e}"))
+        self.decoded.put(None)
+
+    def __classify(self) -> None:
+        finished_decoders = 0
+        while finished_decoders < self.decode_workers:
+            batch = []
+            item = self.decoded.get()
+            deadline = time.monotonic() + self.max_wait
+            while True:
+                if item is None:
+                    finished_decoders += 1
+                    if finished_decoders == self.decode_workers:
+                        break
+                else:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.decoded.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if batch:
+                self.__write_batch(batch)
+
+    def __predict(self, batch: List[tuple]) -> List[Any]:
+        """Probabilities of each item in `batch`, or the error message if it failed."""
+        decoded = [i for i, (_, _, _, error) in enumerate(batch) if error is None]
+        results = [error for _, _, _, error in batch]
+        if not decoded:
+            return results
+        arrays = [batch[i][2] for i in decoded]
+        try:
+            probs = batch_probs(self.learner, arrays, self.batch_size)
+            for i, row_probs in zip(decoded, probs):
+                results[i] = row_probs
+        except Exception:
+            # One bad image shouldn't fail the rest of the batch, or stop the pipeline
+            for i, array in zip(decoded, arrays):
+                try:
+                    results[i] = batch_probs(self.learner, [array], 1)[0]
+                except Exception as e:
+                    results[i] = f"{type(e).__name__}: {e}"
+        return results
+
+    def __write_batch(self, batch: List[tuple]) -> None:
+        classified_at = time.time()
+        rows = []
+        for (path, _, _, _), result in zip(batch, self.__predict(batch)):
+            row = {"path": str(path), "classified_at": classified_at}
+            if not isinstance(result, str):
+                row["prediction"] = self.vocab[int(np.argmax(result))]
+                row["probabilities"] = {
+                    label: float(prob) for label, prob in zip(self.vocab, result)
+                }
+                self.classified += 1
+            else:
+                row["error"] = result
+                self.failed += 1
+            rows.append(row)
+        # Results are written before the checkpoint, so a crash can only repeat a row
+        self.sink.write(rows)
+        self.checkpoint.mark([(path, version) for path, version, _, _ in batch])
+        with self.__in_flight_lock:
+            for path, _, _, _ in batch:
+                self.in_flight.pop(path, None)
+
+    def __scan(self) -> Iterator[Path]:
+        stack = [self.watch_dir]
+        while stack:
+            try:
+                entries = list(os.scandir(stack.pop()))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif self.__is_image(entry.name):
+                    yield Path(entry.path)
+
+    def __start_watchdog(self, changed: "queue.Queue[Path]"):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            self.logger.log("watchdog is not installed, polling for new files")
+            return None
+
+        is_image = self.__is_image
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                path = getattr(event, "dest_path", None) or event.src_path
+                if is_image(os.path.basename(path)):
+                    changed.put(Path(path))
+
+        observer = Observer()
+        observer.schedule(Handler(), str(self.watch_dir), recursive=True)
+        observer.daemon = True
+        observer.start()
+        return observer
+
+    def __is_in_flight(self, path: Path, version: FileVersion) -> bool:
+        with self.__in_flight_lock:
+            return self.in_flight.get(path) == version
+
+    @staticmethod
+    def __is_image(name: str) -> bool:
+        return not name.startswith(".") and (
+            os.path.splitext(name)[1].lower() in PICTURE_EXTENSION_LIST
+        )
+
+    @staticmethod
+    def __version(path: Path) -> Optional[FileVersion]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--model", type=Path, required=True, help="Exported learner (.pkl)")
+    parser.add_argument("--watch", type=Path, required=True, help="Directory to watch")
+    parser.add_argument("--output", type=Path, required=True, help=".jsonl or .csv")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument(
+        "--once", action="store_true", help="Classify existing files and exit"
+    )
+    args = parser.parse_args()
+
+    folder_classifier = FolderClassifier.from_export(
+        args.model,
+        args.watch,
+        args.output,
+        batch_size=args.batch_size,
+        poll_interval=args.poll_interval,
+    )
+    try:
+        folder_classifier.run(once=args.once)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,56 @@
 """https://docs.fast.ai/learner.html#Learner.predict"""
 
+import itertools
+import time
+from contextlib import nullcontext
 from pathlib import Path
 
-from PIL import Image
-from fastai.vision.all import (
-    DataBlock,
-    ImageBlock,
-    CategoryBlock,
-    get_image_files,
-    RandomSplitter,
-    parent_label,
-)
-from fastai.vision.all import (
-    Resize,
-    vision_learner,
-    error_rate,
-    resnet18,
-    Learner,
-    PILImage,
-)
+import numpy as np
 
+from dataset.dedup import Deduplicator
+from dataset.manifest import (
+    CategoryLabeller,
+    DatasetManifest,
+    external_manifest_path,
+)
+from dataset.parallel_decode import ParallelDecoder
+from dataset.verification import ImageVerifier
+from model.batch_inference import batch_probs, iter_batch_probs
+from model.loader_config import LoaderConfig, tune_loader_config
+from model.model_store import ModelStore
+from utils.tracing import Tracer, traced
 from utils.path_utils import ProjPaths
-from scrapers.images.ddg_images import DuckDuckGoImageScraper
-from constants import PHOTO_DL_DIRNAME, PICTURE_EXTENSION_LIST
+from constants import (
+    CHECKPOINT_DIRNAME,
+    PHOTO_DL_DIRNAME,
+    PICTURE_EXTENSION_LIST,
+    QUARANTINE_DIRNAME,
+    TENSOR_CACHE_DIRNAME,
+)
 from logging_.log_and_print import Logger
 
-from typing import List, Tuple, Union, Any
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    Any,
+)
+
+# fastai (and through it torch, torchvision, pandas and matplotlib) is imported by the
+# methods that need it, so importing this module or predicting with a stored model
+# never loads the training or scraping stack up front
+if TYPE_CHECKING:
+    from fastai.data.core import DataLoaders
+    from fastai.learner import Learner
+
+    from dataset.blob_store import BlobStore
+    from model.callbacks import TrainingCheckpointCallback
 
 
 class BinaryImageClassifier:
@@ -33,27 +58,104 @@ class BinaryImageClassifier:
         self,
         positive,
         negative,
-        positive_phrases,
-        negative_phrases,
+        positive_phrases=None,
+        negative_phrases=None,
         photos_per_phrase=4,
         batch_size=32,
         img_res=128,
+        arch=None,
+        tensor_cache=False,
+        async_scraping=False,
+        downloads_dirname=PHOTO_DL_DIRNAME,
+        tracer: Optional[Tracer] = None,
+        dataset_path: Optional[Path] = None,
+        headless: bool = False,
+        blob_store: Optional["BlobStore"] = None,
+        loader_config: Optional[LoaderConfig] = None,
+        auto_tune_loader: bool = False,
     ):
+        """
+        Args:
+            dataset_path (Optional[Path]): Existing `<dataset_path>/<label>/...` image
+                folder to train on. No scraper is created and no images are downloaded.
+            headless (bool): Skip `show_batch` and fastai progress bars, for servers and
+                batch workers where nothing is displayed.
+            blob_store (Optional[BlobStore]): Shared content-addressed corpus. Scraped
+                images are stored there once, and training reads a hard-link view of
+                the two categories, so other classifiers reuse the same images.
+            loader_config (Optional[LoaderConfig]): DataLoader workers, prefetch depth,
+                pinned memory and torch thread counts used for training.
+            auto_tune_loader (bool): Time a few batches under several loader configs
+                before training and train with the fastest one.
+        """
         self.logger = Logger("BinaryImageClassifier", "blue")
+        # Per-stage timings, see `utils.tracing`. Disabled unless a tracer is passed in.
+        self.tracer = tracer or Tracer(enabled=False)
         self.positive = positive
         self.negative = negative
         self.batch_size = batch_size
         self.img_res = img_res
+        # Resolved on first use by `arch`, so constructing a classifier for prediction
+        # doesn't import fastai
+        self.__arch = arch
+        self.tensor_cache = tensor_cache
+        self.headless = headless
+        self.blob_store = blob_store
+        self.loader_config = loader_config or LoaderConfig()
+        self.auto_tune_loader = auto_tune_loader
+        self.loader_config.apply()
+        self.model_store = ModelStore()
+        # Draft-mode JPEG decode straight to `img_res` for prediction inputs
+        self.decoder = ParallelDecoder(img_res)
         self.__set_phrases(photos_per_phrase, positive_phrases, negative_phrases)
 
-        self.image_scraper = DuckDuckGoImageScraper(PHOTO_DL_DIRNAME)
-        self.training_images_path = self.image_scraper.get_dl_path()
-        self.positive_path = self.training_images_path / self.positive
-        self.negative_path = self.training_images_path / self.negative
-        self.positive_training_photos, self.negative_training_photos = self.get_photos()
+        self.async_scraping = async_scraping
+        with self.tracer.span("BinaryImageClassifier.__init__"):
+            with self.tracer.span("init.setup"):
+                if dataset_path is not None:
+                    self.image_scraper = None
+                    self.training_images_path = Path(dataset_path)
+                else:
+                    self.image_scraper = self.__create_scraper(downloads_dirname)
+                    self.training_images_path = (
+                        blob_store.view_path([positive, negative])
+                        if blob_store is not None
+                        else self.image_scraper.get_dl_path()
+                    )
+                self.positive_path = self.training_images_path / self.positive
+                self.negative_path = self.training_images_path / self.negative
+                # A local dataset is the user's own folder: its manifest is kept under
+                # data/ and failing images are only excluded, never moved
+                self.manifest = DatasetManifest(
+                    self.training_images_path,
+                    (
+                        external_manifest_path(self.training_images_path)
+                        if dataset_path is not None
+                        else None
+                    ),
+                )
+                self.verifier = ImageVerifier(
+                    self.manifest,
+                    (
+                        ProjPaths.get_data() / QUARANTINE_DIRNAME
+                        if dataset_path is None
+                        else None
+                    ),
+                    # A blob store view is not where the ledger recorded the downloads
+                    scrape_cache=(
+                        self.image_scraper.scrape_cache
+                        if self.image_scraper is not None and blob_store is None
+                        else None
+                    ),
+                )
+                self.deduplicator = Deduplicator(self.manifest)
+            (
+                self.positive_training_photos,
+                self.negative_training_photos,
+            ) = self.get_photos()
 
-        self.__verify_dataset()
-        self.__create_datablock()
+            self.__verify_dataset()
+            self.create_datablock()
         self.logger.log(self)
 
     def __str__(self):
@@ -71,15 +173,53 @@ class BinaryImageClassifier:
     def __len__(self):
         return len(self.positive_training_photos) + len(self.negative_training_photos)
 
+    @property
+    def arch(self):
+        if self.__arch is None:
+            from fastai.vision.all import resnet18
+
+            self.__arch = resnet18
+        return self.__arch
+
+    @traced()
     def predict(
         self, image_path: Path
     ) -> tuple[Any | None, Any | None, Any, Any] | tuple[Any | None, Any, Any]:
         """https://docs.fast.ai/learner.html"""
-        prediction, decoded_prediction, probs = self.model.predict(
-            PILImage.create(image_path)
-        )
+        from fastai.vision.core import PILImage
+
+        with self.__no_bar(self.model):
+            prediction, decoded_prediction, probs = self.model.predict(
+                PILImage.create(self.decoder.decode([image_path])[0]), rm_type_tfms=0
+            )
         return prediction, decoded_prediction, probs
 
+    def predict_batch(
+        self, image_paths: Iterable[Path], batch_size: int = 64
+    ) -> np.ndarray:
+        """
+        Classifies many images with one test DataLoader and vectorized forward passes.
+
+        Returns:
+            np.ndarray: float32 array of shape (len(image_paths), n_classes), rows aligned
+                with the inputs and columns in `self.model.dls.vocab` order.
+        """
+        image_paths = list(image_paths)
+        with self.tracer.span(
+            "BinaryImageClassifier.predict_batch", items=len(image_paths)
+        ):
+            return batch_probs(
+                self.model, image_paths, batch_size, decoder=self.decoder
+            )
+
+    def iter_predict_batch(
+        self, image_paths: Iterable[Path], batch_size: int = 64
+    ) -> Iterator[np.ndarray]:
+        """Streaming version of `predict_batch`, yielding one probability array per batch."""
+        return iter_batch_probs(
+            self.model, image_paths, batch_size, decoder=self.decoder
+        )
+
     def print_prediction(
         self,
         predict_out: (
@@ -98,8 +238,49 @@ class BinaryImageClassifier:
             f"{'Probability it is a ' + self.positive + ' image:':<42}{prob_string:>38}"
         )
 
-    def train_(self, epochs: int = 4) -> None:
-        learn_ = vision_learner(self.data_loader, resnet18, metrics=error_rate)
+    @traced()
+    def train_(
+        self,
+        epochs: int = 4,
+        use_cache: bool = True,
+        patience: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> None:
+        """
+        Args:
+            patience (Optional[int]): Stop once validation `error_rate` has not improved
+                for this many epochs, and keep the weights of the best epoch.
+            time_budget (Optional[float]): Wall-clock seconds of training, counted across
+                interrupted and resumed runs. No epoch is started that would overrun it.
+
+        With either set, every epoch is checkpointed under `data/checkpoints`, and calling
+        `train_` again after an interruption resumes after the last finished epoch.
+        """
+        budget = {
+            key: value
+            for key, value in [("patience", patience), ("time_budget", time_budget)]
+            if value is not None
+        }
+        with self.tracer.span("train_.model_store_lookup"):
+            model_key = self.model_store.key(
+                self.manifest.dataset_hash([self.positive, self.negative]),
+                img_res=self.img_res,
+                batch_size=self.batch_size,
+                epochs=epochs,
+                arch=self.arch.__name__,
+                **budget,
+            )
+            self.model_key = model_key
+            if use_cache and self.model_store.exists(model_key):
+                self.logger.log(f"Dataset unchanged, reusing trained model {model_key}")
+                self.model = self.model_store.load(model_key)
+                return
+
+        from fastai.vision.all import Learner, error_rate, vision_learner
+
+        from model.callbacks import ThroughputCallback
+
+        learn_ = vision_learner(self.data_loader, self.arch, metrics=error_rate)
 
         # Verify the implementation of the vision_learner function constructs and returns a Learner object
         assert (
@@ -109,11 +290,123 @@ class BinaryImageClassifier:
             learn_, Learner
         ), "The vision_learner function did not return a Learner object"
 
+        if self.auto_tune_loader:
+            with self.tracer.span("train_.tune_loader"):
+                self.loader_config, _ = tune_loader_config(learn_)
+
         self.logger.log("Training model")
         print()
 
-        learn_.fine_tune(epochs)
+        # fine_tune runs one frozen epoch before the unfrozen ones
+        with self.tracer.span(
+            "train_.fine_tune", items=len(self.training_images) * (epochs + 1)
+        ), self.__no_bar(learn_):
+            self.throughput = ThroughputCallback()
+            if budget:
+                checkpoint = self.__fine_tune_budgeted(
+                    learn_, epochs, patience, time_budget
+                )
+            else:
+                learn_.fine_tune(epochs, cbs=[self.throughput])
         self.model = learn_
+        with self.tracer.span("train_.export"):
+            self.model_store.save(
+                model_key,
+                learn_,
+                positive=self.positive,
+                negative=self.negative,
+                img_res=self.img_res,
+                batch_size=self.batch_size,
+                epochs=epochs,
+                arch=self.arch.__name__,
+                vocab=list(learn_.dls.vocab),
+                **budget,
+            )
+        if budget:
+            checkpoint.clear()
+
+    def __fine_tune_budgeted(
+        self,
+        learn_: "Learner",
+        epochs: int,
+        patience: Optional[int],
+        time_budget: Optional[float],
+    ) -> "TrainingCheckpointCallback":
+        from model.callbacks import (
+            ResumableEarlyStoppingCallback,
+            TimeBudgetCallback,
+            TrainingCheckpointCallback,
+            fine_tune_resumable,
+        )
+
+        checkpoint_dir = ProjPaths.get_data() / CHECKPOINT_DIRNAME
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        model_dir, learn_.model_dir = learn_.model_dir, checkpoint_dir
+        checkpoint = TrainingCheckpointCallback(checkpoint_dir, self.model_key)
+        cbs = [self.throughput, checkpoint]
+        if time_budget is not None:
+            cbs.append(
+                TimeBudgetCallback(time.monotonic() + time_budget - checkpoint.elapsed)
+            )
+        early_stopping = None
+        if patience is not None:
+            early_stopping = ResumableEarlyStoppingCallback(
+                monitor="error_rate", patience=patience, reset_on_fit=False
+            )
+
+        try:
+            fine_tune_resumable(
+                learn_, epochs, checkpoint, cbs, early_stopping=early_stopping
+            )
+        finally:
+            learn_.model_dir = model_dir
+        return checkpoint
+
+    def export_cpu(
+        self,
+        quantize: Sequence[str] = ("none", "dynamic", "static"),
+        calibration_batches: int = 8,
+    ) -> Dict[str, Path]:
+        """
+        Writes one TorchScript artifact per quantization mode next to the stored model,
+        see `model.cpu_export`. Load them with `model.cpu_runtime.CpuClassifier`.
+        """
+        from model.cpu_export import export_torchscript
+
+        calibration = [
+            xb for xb, _ in itertools.islice(self.data_loader.train, calibration_batches)
+        ]
+        return {
+            mode: export_torchscript(
+                self.model,
+                self.model_store.store_path / f"{self.model_key}.{mode}.pt",
+                self.img_res,
+                quantize=mode,
+                calibration=calibration,
+            )
+            for mode in quantize
+        }
+
+    def compare_cpu_exports(self, artifact_paths: Dict[str, Path]) -> List[dict]:
+        """Accuracy delta and latency of `export_cpu` artifacts on the validation split."""
+        from model.cpu_export import compare_exports
+
+        valid_ds = self.data_loader.valid_ds
+        inputs = [
+            (
+                # Tensor cache items are indices, compare on the cached pixels
+                valid_ds.tls[0][i].permute(1, 2, 0).numpy()
+                if isinstance(item, (int, np.integer))
+                else item
+            )
+            for i, item in enumerate(valid_ds.items)
+        ]
+        targets = [
+            self.data_loader.vocab[int(valid_ds.tls[1][i])] for i in range(len(inputs))
+        ]
+        return compare_exports(
+            self.model, artifact_paths, inputs, targets, batch_size=self.batch_size
+        )
 
     def collect_images_recursive(self, path: Path) -> List[Path]:
         ret = []
@@ -125,9 +418,19 @@ class BinaryImageClassifier:
 
         return ret
 
+    @traced()
     def get_photos(self) -> Tuple[List[Path], List[Path]]:
         # Check if images already exist
         self.logger.log("Checking if images exist")
+        self.__sync_blob_view()
+        with self.tracer.span("get_photos.manifest_refresh"):
+            self.manifest.refresh()
+        if self.image_scraper is None:
+            # Local datasets are used as they are, there is nothing to scrape
+            return (
+                self.manifest.paths([self.positive]),
+                self.manifest.paths([self.negative]),
+            )
         existing_photos = self.__get_photos_if_exist()
         if existing_photos:
             self.logger.log(
@@ -137,12 +440,35 @@ class BinaryImageClassifier:
 
         # Scrape images if they don't exist
         self.logger.log("Scraping images")
-        positive_photos = self.image_scraper.scrape(
-            self.positive, self.positive_phrases
-        )
-        negative_photos = self.image_scraper.scrape(
-            self.negative, self.negative_phrases
-        )
+        with self.tracer.span("get_photos.scrape") as span:
+            if self.async_scraping:
+                # Both categories share one event loop and connection pool
+                scraped = self.image_scraper.scrape_categories(
+                    {
+                        self.positive: self.positive_phrases,
+                        self.negative: self.negative_phrases,
+                    }
+                )
+                positive_photos = scraped[self.positive]
+                negative_photos = scraped[self.negative]
+            else:
+                positive_photos = self.image_scraper.scrape(
+                    self.positive, self.positive_phrases
+                )
+                negative_photos = self.image_scraper.scrape(
+                    self.negative, self.negative_phrases
+                )
+            span.items = len(positive_photos) + len(negative_photos)
+
+        self.__sync_blob_view()
+        with self.tracer.span("get_photos.manifest_refresh"):
+            self.manifest.refresh()
+        if self.blob_store is not None:
+            # Includes images other classifiers already stored for these categories
+            return (
+                self.manifest.paths([self.positive]),
+                self.manifest.paths([self.negative]),
+            )
 
         # Remove any photos that don't have a download_path attribute or don't exist
         positive_photos = [
@@ -161,62 +487,152 @@ class BinaryImageClassifier:
         ]
 
     def __verify_dataset(self) -> None:
-        res = get_image_files(self.training_images_path)
+        labels = [self.positive, self.negative]
+        with self.tracer.span("init.verify") as span:
+            verified, failed = self.verifier.run(labels)
+            span.items = verified + failed
+        if verified or failed:
+            self.logger.log(
+                f"[DataBlock Verification] {verified} images passed, {failed} failed"
+            )
+
+        with self.tracer.span("init.dedup"):
+            self.deduplicator.run(labels)
+
+        res = sorted(self.manifest.paths(labels, verified_only=True, unique_only=True))
+        self.training_images = res
         if len(res) == 0:
             raise FileNotFoundError(
                 f"No images found in the self.images_path: {self.training_images_path}"
             )
 
-        tests_ct = 0
-        max_tests = min(self.batch_size // 2, 16)
-        for img in res:
-            try:
-                img = Image.open(img)
-                if img.verify() is None:
-                    tests_ct += 1
-            except Exception as e:
-                self.logger.log(
-                    f"[DataBlock Verification] Failed to verify image {img}"
-                )
-                self.logger.log(f"Error: {e}")
-            if tests_ct >= max_tests:
-                break
-
-    def __create_datablock(self) -> None:
+    def create_datablock(self) -> None:
+        """(Re)builds `self.data_loader` from the current verified training images."""
         self.logger.log("Creating datablock")
-        data = DataBlock(
-            blocks=(ImageBlock, CategoryBlock),
-            get_items=get_image_files,
-            splitter=RandomSplitter(valid_pct=0.2, seed=42),
-            get_y=parent_label,
-            item_tfms=[Resize(self.img_res, method="squish")],
-        ).dataloaders(self.training_images_path, bs=self.batch_size)
+        from fastai.vision.all import (
+            CategoryBlock,
+            DataBlock,
+            ImageBlock,
+            RandomSplitter,
+            Resize,
+        )
 
+        with self.tracer.span("init.datablock", items=len(self.training_images)):
+            if self.tensor_cache:
+                data = self.__create_cached_dataloaders()
+            else:
+                data = DataBlock(
+                    blocks=(ImageBlock, CategoryBlock),
+                    splitter=RandomSplitter(valid_pct=0.2, seed=42),
+                    get_y=CategoryLabeller(self.training_images_path),
+                    item_tfms=[Resize(self.img_res, method="squish")],
+                ).dataloaders(
+                    self.training_images,
+                    bs=self.batch_size,
+                    **self.loader_config.dataloader_kwargs(),
+                )
+
+        # Prefetch depth is not a fastai DataLoader argument, so it is set afterwards
+        self.loader_config.apply(data)
         self.data_loader = data
 
-        self.data_loader.show_batch()
+        if not self.headless:
+            with self.tracer.span("init.show_batch"):
+                self.data_loader.show_batch()
+
+    def __create_cached_dataloaders(self) -> "DataLoaders":
+        from fastai.vision.all import (
+            CategoryBlock,
+            DataBlock,
+            IntToFloatTensor,
+            RandomSplitter,
+            TransformBlock,
+        )
+
+        from dataset.tensor_cache import TensorCache
+
+        # Images are decoded and resized once into a memmap, then read by index each epoch
+        labeller = CategoryLabeller(self.training_images_path)
+        cache = TensorCache(self.tensor_cache_root, self.img_res).ensure(
+            self.training_images,
+            [labeller(path) for path in self.training_images],
+            self.manifest.dataset_hash([self.positive, self.negative]),
+        )
+        return DataBlock(
+            blocks=(
+                TransformBlock(
+                    type_tfms=cache.image_getter(), batch_tfms=IntToFloatTensor
+                ),
+                CategoryBlock,
+            ),
+            splitter=RandomSplitter(valid_pct=0.2, seed=42),
+            get_y=cache.label_getter(),
+        ).dataloaders(
+            list(range(len(cache))),
+            bs=self.batch_size,
+            **self.loader_config.dataloader_kwargs(),
+        )
+
+    @property
+    def tensor_cache_root(self) -> Path:
+        """Holds one `TensorCache` per `img_res` for this question."""
+        return (
+            ProjPaths.get_data() / TENSOR_CACHE_DIRNAME / f"{self.positive}-{self.negative}"
+        )
 
     def __get_photos_if_exist(self) -> Union[Tuple[List[Path], List[Path]], bool]:
-        pos_photos = self.collect_images_recursive(self.positive_path)
-        neg_photos = self.collect_images_recursive(self.negative_path)
-        if (
-            self.positive_path.exists()
-            and len(pos_photos) >= self.batch_size
-            and self.negative_path.exists()
-            and len(neg_photos) >= self.batch_size
-        ):
+        pos_photos = self.manifest.paths([self.positive])
+        neg_photos = self.manifest.paths([self.negative])
+        if len(pos_photos) >= self.batch_size and len(neg_photos) >= self.batch_size:
             return pos_photos, neg_photos
         return False
 
+    def __create_scraper(self, downloads_dirname: str):
+        # Imported here so classifiers over a local dataset never load the scraping stack
+        from scrapers.images.download_policy import DownloadPolicy
+
+        # Thumbnails that already cover img_res are kept instead of full-size photos
+        download_policy = DownloadPolicy(self.img_res)
+        if self.async_scraping:
+            from scrapers.images.async_ddg_images import AsyncDuckDuckGoImageScraper
+
+            return AsyncDuckDuckGoImageScraper(
+                downloads_dirname,
+                download_policy=download_policy,
+                blob_store=self.blob_store,
+            )
+        from scrapers.images.ddg_images import DuckDuckGoImageScraper
+
+        return DuckDuckGoImageScraper(
+            downloads_dirname,
+            download_policy=download_policy,
+            blob_store=self.blob_store,
+        )
+
+    def __sync_blob_view(self) -> None:
+        if self.blob_store is not None and self.image_scraper is not None:
+            self.blob_store.materialize(
+                [self.positive, self.negative], self.training_images_path
+            )
+
+    def __no_bar(self, learner: "Learner"):
+        return learner.no_bar() if self.headless else nullcontext()
+
     def __set_phrases(
         self,
         photos_per_phrase: int,
-        positive_phrases: List[Tuple[str, int]],
-        negative_phrases: List[Tuple[str, int]],
+        positive_phrases: Optional[List[str]],
+        negative_phrases: Optional[List[str]],
     ) -> None:
-        required_photos_per_phrase = (
-            self.batch_size // min(len(positive_phrases), len(negative_phrases))
-        ) + 1
+        positive_phrases = positive_phrases or []
+        negative_phrases = negative_phrases or []
+        if not positive_phrases or not negative_phrases:
+            # Nothing to scrape, e.g. a local dataset
+            required_photos_per_phrase = 0
+        else:
+            required_photos_per_phrase = (
+                self.batch_size // min(len(positive_phrases), len(negative_phrases))
+            ) + 1
         if photos_per_phrase < required_photos_per_phrase:
             self.logger.log(
                 f"Number of photos per phrase is too low to create batches of size {self.batch_size}."
@@ -0,0 +1,278 @@
+"""
+Long-running local HTTP service answering image questions with an exported learner.
+
+Run from `src/`:
+    python -m model.inference_server --model ../data/models/<key>.pkl --port 8000
+
+Endpoints:
+    POST /predict   raw image bytes, or JSON {"path": "..."}
+    GET  /stats     queue depth, batch-size histogram and request counts
+    GET  /health
+
+Malformed requests and images that can't be read get a 400, failures of the model a 500.
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from dataset.parallel_decode import ParallelDecoder
+from logging_.log_and_print import Logger
+from model.batch_inference import batch_probs, learner_img_res
+
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from fastai.learner import Learner
+
+
+# What decoding an unreadable upload or a bad path raises, as opposed to model failures
+DECODE_ERRORS = (OSError, ValueError, TypeError, Image.DecompressionBombError)
+
+
+class InvalidInputError(ValueError):
+    """A request item that could not be read as an image."""
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent `submit` calls into batches for `predict_fn`.
+
+    A batch is dispatched as soon as it holds `max_batch_size` items, or `max_wait_ms`
+    after its first item arrived, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List[Any]], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.requests: "queue.Queue[Tuple[Any, Future]]" = queue.Queue()
+        self.batch_size_histogram: Counter = Counter()
+        self.completed = 0
+        self.failed = 0
+        self.__stats_lock = threading.Lock()
+        self.__worker = threading.Thread(
+            target=self.__run, name="micro-batcher", daemon=True
+        )
+        self.__worker.start()
+
+    def submit(self, item: Any) -> "Future[np.ndarray]":
+        future: Future = Future()
+        self.requests.put((item, future))
+        return future
+
+    def stats(self) -> dict:
+        with self.__stats_lock:
+            return {
+                "queue_depth": self.requests.qsize(),
+                "completed": self.completed,
+                "failed": self.failed,
+                "batches": sum(self.batch_size_histogram.values()),
+                "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            }
+
+    def __run(self) -> None:
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.__dispatch(batch)
+
+    def __dispatch(self, batch: List[Tuple[Any, Future]]) -> None:
+        items = [item for item, _ in batch]
+        try:
+            results = list(self.predict_fn(items))
+        except Exception:
+            # One undecodable upload shouldn't fail everyone else in the batch
+            results = []
+            for item in items:
+                try:
+                    results.append(self.predict_fn([item])[0])
+                except Exception as e:
+                    results.append(e)
+
+        failed = 0
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                failed += 1
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        with self.__stats_lock:
+            self.batch_size_histogram[len(batch)] += 1
+            self.completed += len(batch) - failed
+            self.failed += failed
+
+
+class InferenceServer:
+    def __init__(
+        self,
+        learner: "Learner",
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+    ):
+        self.logger = Logger("InferenceServer", "green")
+        self.learner = learner
+        self.vocab = list(learner.dls.vocab)
+        img_res = learner_img_res(learner)
+        self.decoder: Optional[ParallelDecoder] = (
+            ParallelDecoder(img_res) if img_res is not None else None
+        )
+        self.batcher = MicroBatcher(
+            lambda items: batch_probs(learner, self.__decode(items), len(items)),
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+        )
+        self.httpd = ThreadingHTTPServer((host, port), self.__handler_class())
+        self.httpd.daemon_threads = True
+
+    @classmethod
+    def from_export(cls, model_path: Path, **kwargs: Any) -> "InferenceServer":
+        from fastai.learner import load_learner
+
+        return cls(load_learner(model_path, cpu=True), **kwargs)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    def serve_forever(self) -> None:
+        host, port = self.address
+        self.logger.log(f"Serving {self.vocab} predictions on http://{host}:{port}")
+        self.httpd.serve_forever()
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.decoder is not None:
+            self.decoder.close()
+
+    def predict(self, item: Any) -> dict:
+        probs = self.batcher.submit(item).result()
+        return {
+            "prediction": self.vocab[int(np.argmax(probs))],
+            "probabilities": {
+                label: float(prob) for label, prob in zip(self.vocab, probs)
+            },
+        }
+
+    def __decode(self, items: List[Any]) -> List[Any]:
+        # Decoded before the forward pass, so a bad input is told apart from a failure
+        # of the model itself
+        try:
+            if self.decoder is not None:
+                return list(self.decoder.decode(items))
+            from fastai.vision.core import PILImage
+
+            return [PILImage.create(item) for item in items]
+        except DECODE_ERRORS as e:
+            raise InvalidInputError(f"{type(e).__name__}: {e}") from e
+
+    def __handler_class(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/stats":
+                    self.__respond(200, server.batcher.stats())
+                elif self.path == "/health":
+                    self.__respond(200, {"status": "ok"})
+                else:
+                    self.__respond(404, {"error": f"Unknown path {self.path}"})
+
+            def do_POST(self):
+                if self.path != "/predict":
+                    self.__respond(404, {"error": f"Unknown path {self.path}"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    if length < 0:
+                        raise ValueError(f"negative Content-Length {length}")
+                    body = self.rfile.read(length)
+                    if self.headers.get("Content-Type", "").startswith(
+                        "application/json"
+                    ):
+                        item = json.loads(body)["path"]
+                    else:
+                        item = body
+                except (ValueError, KeyError, TypeError) as e:
+                    # Bad Content-Length, malformed JSON, or no "path" in the object
+                    self.__respond(
+                        400, {"error": f"Invalid request: {type(e).__name__}: {e}"}
+                    )
+                    return
+                try:
+                    self.__respond(200, server.predict(item))
+                except InvalidInputError as e:
+                    self.__respond(400, {"error": f"Invalid image: {e}"})
+                except Exception as e:
+                    # DataLoader errors embed the worker traceback, keep the last line
+                    message = str(e).strip().splitlines()[-1] if str(e) else ""
+                    server.logger.log(
+                        f"Prediction failed: {type(e).__name__}: {message}",
+                        color_override="red",
+                    )
+                    self.__respond(500, {"error": f"{type(e).__name__}: {message}"})
+
+            def log_message(self, format, *args):
+                # The default handler logs every request to stderr
+                pass
+
+            def __respond(self, status: int, payload: dict) -> None:
+                encoded = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--model", type=Path, required=True, help="Exported learner (.pkl)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    server = InferenceServer.from_export(
+        args.model,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
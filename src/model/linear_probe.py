@@ -0,0 +1,271 @@
+"""
+Binary questions answered by logistic regression over cached backbone embeddings.
+
+Backbone features are computed once per image (keyed by content hash) by
+`dataset.embedding_cache`, so training a new question over an already-embedded corpus
+only fits a linear head, which takes seconds rather than a `fine_tune` run. Fitted
+probes are kept in the `ModelStore` under the dataset and embedding model they were
+fitted on.
+"""
+
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from constants import EMBEDDING_CACHE_DIRNAME, PHOTO_DL_DIRNAME, QUARANTINE_DIRNAME
+from dataset.dedup import Deduplicator
+from dataset.embedding_cache import EmbeddingCache, ImageEmbedder
+from dataset.manifest import (
+    CategoryLabeller,
+    DatasetManifest,
+    external_manifest_path,
+)
+from dataset.verification import ImageVerifier
+from logging_.log_and_print import Logger
+from model.model_store import ModelStore
+from utils.path_utils import ProjPaths
+from utils.tracing import Tracer, traced
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+PROBE_SUFFIX = ".npz"
+
+
+class LinearProbe:
+    """L2-regularised logistic regression fitted full-batch with L-BFGS."""
+
+    def __init__(self, weight_decay: float = 1e-3, max_iter: int = 200):
+        self.weight_decay = weight_decay
+        self.max_iter = max_iter
+        self.mean: Optional[np.ndarray] = None
+        self.std: Optional[np.ndarray] = None
+        self.weight: Optional[np.ndarray] = None
+        self.bias = 0.0
+
+    def fit(self, features: np.ndarray, targets: np.ndarray) -> "LinearProbe":
+        self.mean = features.mean(axis=0)
+        self.std = features.std(axis=0) + 1e-6
+        x = torch.from_numpy((features - self.mean) / self.std).float()
+        y = torch.from_numpy(targets).float()
+        weight = torch.zeros(x.shape[1], requires_grad=True)
+        bias = torch.zeros(1, requires_grad=True)
+        optimizer = torch.optim.LBFGS(
+            [weight, bias], max_iter=self.max_iter, line_search_fn="strong_wolfe"
+        )
+
+        def closure():
+            optimizer.zero_grad()
+            loss = torch.nn.functional.binary_cross_entropy_with_logits(
+                x @ weight + bias, y
+            ) + self.weight_decay * weight.square().sum()
+            loss.backward()
+            return loss
+
+        optimizer.step(closure)
+        self.weight = weight.detach().numpy()
+        self.bias = float(bias.detach())
+        return self
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        """Probability of the positive class for each row of `features`."""
+        logits = ((features - self.mean) / self.std) @ self.weight + self.bias
+        return (1 / (1 + np.exp(-logits))).astype(np.float32)
+
+    def save(self, path: Path) -> None:
+        np.savez(
+            path,
+            mean=self.mean,
+            std=self.std,
+            weight=self.weight,
+            bias=self.bias,
+            weight_decay=self.weight_decay,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "LinearProbe":
+        data = np.load(path)
+        probe = cls(weight_decay=float(data["weight_decay"]))
+        probe.mean, probe.std, probe.weight = data["mean"], data["std"], data["weight"]
+        probe.bias = float(data["bias"])
+        return probe
+
+
+class LinearProbeClassifier:
+    def __init__(
+        self,
+        positive: str,
+        negative: str,
+        arch=None,
+        img_res: int = 128,
+        pretrained: bool = True,
+        downloads_dirname: str = PHOTO_DL_DIRNAME,
+        dataset_path: Optional[Path] = None,
+        embedder: Optional[ImageEmbedder] = None,
+        tracer: Optional[Tracer] = None,
+    ):
+        """
+        Args:
+            embedder (Optional[ImageEmbedder]): Shared backbone, so several questions
+                over the same corpus build it only once.
+        """
+        self.logger = Logger("LinearProbeClassifier", "blue")
+        self.tracer = tracer or Tracer(enabled=False)
+        self.positive = positive
+        self.negative = negative
+        # Same column order as a fastai CategoryBlock vocab
+        self.vocab = sorted([positive, negative])
+        if arch is None:
+            from fastai.vision.all import resnet18
+
+            arch = resnet18
+        self.embedder = embedder or ImageEmbedder(arch, img_res, pretrained)
+        self.model_store = ModelStore()
+
+        # A local dataset is the user's own folder and is never modified
+        self.local_dataset = dataset_path is not None
+        with self.tracer.span("LinearProbeClassifier.__init__"):
+            if dataset_path is not None:
+                self.training_images_path = Path(dataset_path)
+            else:
+                self.training_images_path = ProjPaths.get_data() / downloads_dirname
+            self.manifest = DatasetManifest(
+                self.training_images_path,
+                (
+                    external_manifest_path(self.training_images_path)
+                    if self.local_dataset
+                    else None
+                ),
+            )
+            self.manifest.refresh()
+            self.__verify_dataset()
+
+            # Names the embedding cache, so it identifies the features a probe is fit on
+            self.embedding_model = (
+                f"{arch.__name__}_{img_res}{'' if pretrained else '_random'}"
+            )
+            self.embedding_cache = EmbeddingCache(
+                ProjPaths.get_data() / EMBEDDING_CACHE_DIRNAME / self.embedding_model,
+                self.embedder.dim,
+            )
+            with self.tracer.span("init.embed", items=len(self.training_images)):
+                self.hashes = self.manifest.hashes([positive, negative])
+                self.embedding_cache.ensure(
+                    {path: self.hashes[path] for path in self.training_images},
+                    self.embedder.embed,
+                )
+
+    def __len__(self):
+        return len(self.training_images)
+
+    @traced()
+    def train_(
+        self,
+        valid_pct: float = 0.2,
+        weight_decay: float = 1e-3,
+        seed: int = 42,
+        use_cache: bool = True,
+    ) -> Dict[str, float]:
+        """
+        Fits the probe on cached embeddings and returns train/valid accuracy. With an
+        unchanged dataset and embedding model, the stored probe and its metrics are
+        reused instead.
+        """
+        start = time.perf_counter()
+        hyperparams = dict(
+            probe="linear",
+            embedding_model=self.embedding_model,
+            positive=self.positive,
+            negative=self.negative,
+            valid_pct=valid_pct,
+            weight_decay=weight_decay,
+            seed=seed,
+        )
+        self.model_key = self.model_store.key(
+            self.manifest.dataset_hash([self.positive, self.negative]), **hyperparams
+        )
+        probe_path = self.model_store.artifact_path(self.model_key, PROBE_SUFFIX)
+        if use_cache and self.model_store.exists(self.model_key, PROBE_SUFFIX):
+            self.logger.log(f"Dataset unchanged, reusing fitted probe {self.model_key}")
+            self.model = LinearProbe.load(probe_path)
+            metadata = self.model_store.metadata(self.model_key) or {}
+            return {
+                "train_accuracy": metadata.get("train_accuracy", float("nan")),
+                "valid_accuracy": metadata.get("valid_accuracy", float("nan")),
+                "seconds": time.perf_counter() - start,
+            }
+
+        features = self.embedding_cache.lookup(
+            [self.hashes[path] for path in self.training_images]
+        )
+        labeller = CategoryLabeller(self.training_images_path)
+        targets = np.array(
+            [labeller(path) == self.positive for path in self.training_images],
+            dtype=np.float32,
+        )
+        order = np.random.default_rng(seed).permutation(len(targets))
+        n_valid = int(len(order) * valid_pct)
+        valid, train = order[:n_valid], order[n_valid:]
+
+        self.model = LinearProbe(weight_decay).fit(features[train], targets[train])
+        metrics = {
+            "train_accuracy": self.__accuracy(features[train], targets[train]),
+            "valid_accuracy": self.__accuracy(features[valid], targets[valid]),
+            "seconds": time.perf_counter() - start,
+        }
+        self.logger.log(metrics)
+        # Refit on everything once the held-out accuracy has been measured
+        self.model = LinearProbe(weight_decay).fit(features, targets)
+        self.model.save(probe_path)
+        self.model_store.save_metadata(
+            self.model_key, vocab=self.vocab, **hyperparams, **metrics
+        )
+        self.logger.log(f"Saved fitted probe to {probe_path}")
+        return metrics
+
+    def predict_batch(self, images: Iterable, batch_size: int = 64) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: float32 array of shape (len(images), 2), columns in `self.vocab`
+                order like `BinaryImageClassifier.predict_batch`.
+        """
+        images = list(images)
+        with self.tracer.span("LinearProbeClassifier.predict_batch", items=len(images)):
+            positive = self.model.predict_proba(self.embedder.embed(images, batch_size))
+        probs = np.stack([1 - positive, positive], axis=1)
+        return probs if self.vocab[1] == self.positive else probs[:, ::-1].copy()
+
+    def predict(self, image) -> Tuple[str, float]:
+        """(predicted label, probability of `self.positive`)."""
+        probs = self.predict_batch([image])[0]
+        positive = float(probs[self.vocab.index(self.positive)])
+        return (self.positive if positive >= 0.5 else self.negative), positive
+
+    def __accuracy(self, features: np.ndarray, targets: np.ndarray) -> float:
+        if len(targets) == 0:
+            return float("nan")
+        return float(((self.model.predict_proba(features) >= 0.5) == targets).mean())
+
+    def __verify_dataset(self) -> None:
+        labels = [self.positive, self.negative]
+        quarantine_path = (
+            None if self.local_dataset else ProjPaths.get_data() / QUARANTINE_DIRNAME
+        )
+        scrape_cache = None
+        if not self.local_dataset:
+            from scrapers.images.scrape_cache import ScrapeCache
+
+            scrape_cache = ScrapeCache.existing(self.training_images_path)
+        ImageVerifier(self.manifest, quarantine_path, scrape_cache=scrape_cache).run(
+            labels
+        )
+        Deduplicator(self.manifest).run(labels)
+        self.training_images: List[Path] = sorted(
+            self.manifest.paths(labels, verified_only=True, unique_only=True)
+        )
+        if len(self.training_images) == 0:
+            raise FileNotFoundError(
+                f"No images found for {labels} in {self.training_images_path}"
+            )
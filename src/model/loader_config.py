@@ -0,0 +1,156 @@
+"""
+DataLoader and torch threading settings for CPU training, and a tuner that picks them
+from a short calibration run.
+
+Nothing here imports fastai at module level, so `LoaderConfig` can be passed to
+`BinaryImageClassifier` without loading the training stack.
+"""
+
+import os
+import time
+from dataclasses import asdict, dataclass, fields
+
+from logging_.log_and_print import Logger
+
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from fastai.data.core import DataLoaders
+    from fastai.learner import Learner
+
+
+@dataclass
+class LoaderConfig:
+    """
+    Args:
+        num_workers (Optional[int]): DataLoader worker processes decoding images. None
+            keeps fastai's default of one per CPU (up to 16). fastai forces 0 on macOS.
+        prefetch_factor (int): Batches each worker keeps ready ahead of the model.
+        pin_memory (bool): Page-locked batches, only useful when training on a GPU.
+        sharing_strategy (Optional[str]): torch.multiprocessing tensor sharing between
+            workers and the trainer, "file_descriptor" or "file_system".
+        torch_threads (Optional[int]): Intra-op threads for the training process. Set it
+            below the core count when workers decode on the same cores.
+        interop_threads (Optional[int]): Inter-op threads. torch only accepts this once,
+            before any parallel work has run.
+    """
+
+    num_workers: Optional[int] = None
+    prefetch_factor: int = 2
+    pin_memory: bool = False
+    sharing_strategy: Optional[str] = None
+    torch_threads: Optional[int] = None
+    interop_threads: Optional[int] = None
+
+    def dataloader_kwargs(self) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {"pin_memory": self.pin_memory}
+        if self.num_workers is not None:
+            kwargs["num_workers"] = self.num_workers
+        return kwargs
+
+    def apply(self, dls: Optional["DataLoaders"] = None) -> None:
+        """Applies the process-wide torch settings, and the loader ones to `dls`."""
+        import torch
+        import torch.multiprocessing
+
+        if self.sharing_strategy is not None:
+            torch.multiprocessing.set_sharing_strategy(self.sharing_strategy)
+        if self.torch_threads is not None:
+            torch.set_num_threads(self.torch_threads)
+        if self.interop_threads is not None:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError:
+                # Already fixed for this process
+                pass
+        if dls is None:
+            return
+        for dl in dls.loaders:
+            if self.num_workers is not None:
+                dl.fake_l.num_workers = self.num_workers
+            dl.pin_memory = dl.fake_l.pin_memory = self.pin_memory
+            # fastai's loader shim reads torch's prefetch depth from this attribute
+            dl.fake_l.prefetch_factor = self.prefetch_factor
+
+    def __str__(self):
+        return ", ".join(
+            f"{key}={value}" for key, value in asdict(self).items() if value is not None
+        )
+
+
+def default_candidates(n_cpus: Optional[int] = None) -> List[LoaderConfig]:
+    """Worker counts from 0 to all-but-one core, leaving the remaining cores to torch."""
+    n_cpus = n_cpus or os.cpu_count() or 1
+    worker_counts = sorted(
+        {0, 1, 2, 4, n_cpus // 4, n_cpus // 2, n_cpus - 1} & set(range(n_cpus))
+    )
+    return [
+        LoaderConfig(
+            num_workers=workers,
+            prefetch_factor=2 if workers == 0 else 4,
+            torch_threads=max(1, n_cpus - workers),
+        )
+        for workers in worker_counts
+    ]
+
+
+def tune_loader_config(
+    learner: "Learner",
+    candidates: Optional[Iterable[LoaderConfig]] = None,
+    n_batches: int = 6,
+) -> Tuple[LoaderConfig, List[Dict[str, Any]]]:
+    """
+    Times forward and backward passes over `n_batches` training batches for each
+    candidate and returns the fastest config with every measurement.
+
+    The model runs in eval mode with its gradients cleared afterwards, so BatchNorm
+    statistics and weights are exactly as they were before calibration.
+    """
+    import torch
+
+    logger = Logger("LoaderTuner", "yellow")
+    dls = learner.dls
+    model = learner.model
+    was_training = model.training
+    original_threads = torch.get_num_threads()
+    results = []
+    model.eval()
+    try:
+        for config in candidates or default_candidates():
+            config.apply(dls)
+            images = 0
+            batches = iter(dls.train)
+            # The first batch pays for worker startup, which is shared by a whole epoch
+            start = time.perf_counter()
+            for index in range(n_batches + 1):
+                try:
+                    xb, yb = next(batches)
+                except StopIteration:
+                    break
+                learner.loss_func(model(xb), yb).backward()
+                model.zero_grad(set_to_none=True)
+                if index == 0:
+                    start = time.perf_counter()
+                else:
+                    images += len(xb)
+            seconds = time.perf_counter() - start
+            # Let the workers exit before the next candidate starts its own
+            del batches
+            results.append(
+                {
+                    **asdict(config),
+                    "images_per_sec": images / seconds if seconds > 0 else 0.0,
+                }
+            )
+            logger.log(f"{config}: {results[-1]['images_per_sec']:.1f} images/sec")
+    finally:
+        model.train(was_training)
+        torch.set_num_threads(original_threads)
+
+    best = max(results, key=lambda result: result["images_per_sec"])
+    best_config = LoaderConfig(
+        **{field.name: best[field.name] for field in fields(LoaderConfig)}
+    )
+    best_config.apply(dls)
+    logger.log(f"Selected {best_config}")
+    return best_config, results
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from constants import MODEL_STORE_DIRNAME
+from logging_.log_and_print import Logger
+from utils.path_utils import ProjPaths
+
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from fastai.learner import Learner
+
+
+class ModelStore:
+    """
+    Exported learners keyed by the training image set and the hyperparameters used.
+
+    Artifacts live in `data/<store_dirname>/<key>.pkl` with a `<key>.json` metadata file
+    alongside, so a warm start with an unchanged dataset can skip fine-tuning entirely.
+    """
+
+    def __init__(self, store_dirname: str = MODEL_STORE_DIRNAME):
+        self.logger = Logger("ModelStore", "magenta")
+        self.store_path = ProjPaths.get_data() / store_dirname
+        self.store_path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(dataset_hash: str, **hyperparams: Any) -> str:
+        payload = json.dumps(
+            {"dataset": dataset_hash, **hyperparams}, sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+    def artifact_path(self, key: str, suffix: str = ".pkl") -> Path:
+        return self.store_path / f"{key}{suffix}"
+
+    def metadata_path(self, key: str) -> Path:
+        return self.store_path / f"{key}.json"
+
+    def exists(self, key: str, suffix: str = ".pkl") -> bool:
+        return self.artifact_path(key, suffix).exists()
+
+    def metadata(self, key: str) -> Optional[dict]:
+        if not self.metadata_path(key).exists():
+            return None
+        with open(self.metadata_path(key)) as f:
+            return json.load(f)
+
+    def load(self, key: str) -> Optional["Learner"]:
+        if not self.exists(key):
+            return None
+        from fastai.learner import load_learner
+
+        self.logger.log(f"Loading exported model {self.artifact_path(key).name}")
+        return load_learner(self.artifact_path(key), cpu=True)
+
+    def save(self, key: str, learner: "Learner", **metadata: Any) -> Path:
+        artifact_path = self.artifact_path(key)
+        learner.export(artifact_path)
+        self.save_metadata(key, **metadata)
+        self.logger.log(f"Exported model to {artifact_path}")
+        return artifact_path
+
+    def save_metadata(self, key: str, **metadata: Any) -> None:
+        """Written after the artifact, for models that are saved by their own class."""
+        with open(self.metadata_path(key), "w") as f:
+            json.dump(
+                {"key": key, "exported_at": time.time(), **metadata},
+                f,
+                indent=2,
+                default=str,
+            )
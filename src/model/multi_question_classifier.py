@@ -0,0 +1,477 @@
+"""
+Answers many yes/no image questions with one shared, frozen backbone.
+
+Each question is a (positive, negative) pair of categories from the usual
+`data/image_downloads/<category>/<phrase>/...` layout. An image is a training example
+for every question that mentions its category and is masked out of the loss for the
+rest, so one scraped corpus serves all questions. Only the small per-question heads are
+trained, and a single forward pass returns every answer.
+
+Unlike `model.image_classifier` this module imports torch and fastai up front, since the
+model classes below have to live at module level for exported learners to unpickle.
+"""
+
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from fastai.vision.all import (
+    AdaptiveConcatPool2d,
+    DataBlock,
+    Flatten,
+    ImageBlock,
+    Learner,
+    Metric,
+    Normalize,
+    RandomSplitter,
+    Resize,
+    TransformBlock,
+    create_vision_model,
+    imagenet_stats,
+    num_features_model,
+    params,
+    resnet18,
+)
+from torch import nn
+
+from constants import PHOTO_DL_DIRNAME, QUARANTINE_DIRNAME
+from dataset.dedup import Deduplicator
+from dataset.manifest import (
+    CategoryLabeller,
+    DatasetManifest,
+    external_manifest_path,
+)
+from dataset.parallel_decode import ParallelDecoder
+from dataset.verification import ImageVerifier
+from logging_.log_and_print import Logger
+from model.batch_inference import batch_probs
+from model.model_store import ModelStore
+from utils.path_utils import ProjPaths
+from utils.tracing import Tracer, traced
+
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from dataset.blob_store import BlobStore
+    from scrapers.images.scrape_cache import ScrapeCache
+
+
+# Target value for answers an image has no label for
+UNLABELLED = -1.0
+
+
+class QuestionTargets:
+    """
+    Maps an image path to one target per question: 1, 0, or `UNLABELLED`.
+
+    An image is labelled with its category, or with every category in
+    `merged_labels` when near-identical copies of it were found under other
+    categories. A question that sees both of its categories is left `UNLABELLED`.
+    """
+
+    # Class-level default, so learners exported before merging existed still unpickle
+    merged_labels: Dict[Path, List[str]] = {}
+
+    def __init__(
+        self,
+        root: Path,
+        questions: List[Tuple[str, str, str]],
+        merged_labels: Optional[Dict[Path, List[str]]] = None,
+    ):
+        self.labeller = CategoryLabeller(root)
+        self.questions = questions
+        if merged_labels:
+            self.merged_labels = merged_labels
+
+    def __call__(self, path: Path) -> torch.Tensor:
+        labels = self.merged_labels.get(Path(path)) or [self.labeller(path)]
+        return torch.tensor(self.targets(labels))
+
+    def targets(self, labels: Iterable[str]) -> List[float]:
+        labels = set(labels)
+        return [
+            (
+                UNLABELLED
+                if (positive in labels) == (negative in labels)
+                else 1.0 if positive in labels else 0.0
+            )
+            for _, positive, negative in self.questions
+        ]
+
+
+class MaskedBCEWithLogitsLoss:
+    """Binary cross-entropy over the labelled answers only."""
+
+    def __call__(self, logits: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+        mask = targets != UNLABELLED
+        if not mask.any():
+            return logits.sum() * 0.0
+        return F.binary_cross_entropy_with_logits(logits[mask], targets[mask])
+
+    def activation(self, logits: torch.Tensor) -> torch.Tensor:
+        return torch.sigmoid(logits)
+
+    def decodes(self, probs: torch.Tensor) -> torch.Tensor:
+        return probs > 0.5
+
+
+def masked_accuracy(logits: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+    """Per-batch accuracy over the labelled answers, see `MaskedAccuracy`."""
+    mask = targets != UNLABELLED
+    if not mask.any():
+        return logits.new_zeros(())
+    return ((logits[mask] > 0) == (targets[mask] > 0.5)).float().mean()
+
+
+class MaskedAccuracy(Metric):
+    """
+    Accuracy over the labelled answers of the whole validation set. Unlike averaging
+    `masked_accuracy` per batch, batches with few or no labelled answers don't skew it.
+    """
+
+    def reset(self):
+        self.correct = self.labelled = 0
+
+    def accumulate(self, learn):
+        mask = learn.y != UNLABELLED
+        self.correct += int(((learn.pred[mask] > 0) == (learn.y[mask] > 0.5)).sum())
+        self.labelled += int(mask.sum())
+
+    @property
+    def value(self):
+        return self.correct / self.labelled if self.labelled else None
+
+
+class MultiQuestionModel(nn.Module):
+    """
+    Shared backbone and pooling, then one linear head per question.
+
+    With `frozen_body` set, the backbone stays in eval mode even while the heads train,
+    so its BatchNorm running statistics are never updated.
+    """
+
+    # Class-level default, so learners exported before the flag existed still unpickle
+    frozen_body = False
+
+    def __init__(
+        self, body: nn.Module, n_features: int, n_questions: int, ps: float = 0.25
+    ):
+        super().__init__()
+        self.body = body
+        self.pool = nn.Sequential(AdaptiveConcatPool2d(), Flatten())
+        self.heads = nn.ModuleList(
+            [
+                nn.Sequential(
+                    nn.BatchNorm1d(n_features * 2),
+                    nn.Dropout(ps),
+                    nn.Linear(n_features * 2, 1),
+                )
+                for _ in range(n_questions)
+            ]
+        )
+
+    def train(self, mode: bool = True) -> "MultiQuestionModel":
+        # fastai switches the whole model to train mode at the start of every epoch
+        super().train(mode)
+        if self.frozen_body:
+            self.body.eval()
+        return self
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        features = self.pool(self.body(x))
+        return torch.cat([head(features) for head in self.heads], dim=1)
+
+
+def multi_question_splitter(model: MultiQuestionModel) -> list:
+    # `Learner.freeze` trains only the last group, i.e. the heads
+    return [params(model.body), params(model.pool) + params(model.heads)]
+
+
+class MultiQuestionClassifier:
+    def __init__(
+        self,
+        questions: Dict[str, Tuple[str, str]],
+        category_phrases: Optional[Dict[str, List[str]]] = None,
+        photos_per_phrase: int = 20,
+        batch_size: int = 32,
+        img_res: int = 128,
+        arch=resnet18,
+        pretrained: bool = True,
+        downloads_dirname: str = PHOTO_DL_DIRNAME,
+        dataset_path: Optional[Path] = None,
+        tracer: Optional[Tracer] = None,
+        blob_store: Optional["BlobStore"] = None,
+    ):
+        """
+        Args:
+            questions (Dict[str, Tuple[str, str]]): {question name: (positive category,
+                negative category)}. Categories may be shared between questions.
+            category_phrases (Optional[Dict[str, List[str]]]): Search phrases used to
+                scrape categories that don't have `batch_size` images yet.
+            dataset_path (Optional[Path]): Existing `<dataset_path>/<category>/...` image
+                folder. Nothing is scraped.
+            blob_store (Optional[BlobStore]): Shared corpus to scrape into and train
+                from, see `BinaryImageClassifier`.
+        """
+        self.logger = Logger("MultiQuestionClassifier", "blue")
+        self.tracer = tracer or Tracer(enabled=False)
+        self.questions = [
+            (name, positive, negative) for name, (positive, negative) in questions.items()
+        ]
+        self.question_names = [name for name, _, _ in self.questions]
+        self.categories = list(
+            dict.fromkeys(
+                category
+                for _, positive, negative in self.questions
+                for category in (positive, negative)
+            )
+        )
+        self.category_phrases = category_phrases or {}
+        self.photos_per_phrase = photos_per_phrase
+        self.batch_size = batch_size
+        self.img_res = img_res
+        self.arch = arch
+        self.pretrained = pretrained
+        self.downloads_dirname = downloads_dirname
+        self.blob_store = blob_store
+        self.model_store = ModelStore()
+        self.decoder = ParallelDecoder(img_res)
+
+        with self.tracer.span("MultiQuestionClassifier.__init__"):
+            self.can_scrape = dataset_path is None
+            if dataset_path is not None:
+                self.training_images_path = Path(dataset_path)
+            elif blob_store is not None:
+                self.training_images_path = blob_store.view_path(self.categories)
+            else:
+                self.training_images_path = ProjPaths.get_data() / downloads_dirname
+                self.training_images_path.mkdir(parents=True, exist_ok=True)
+            # A local dataset is the user's own folder: its manifest is kept under data/
+            # and failing images are only excluded, never moved
+            self.manifest = DatasetManifest(
+                self.training_images_path,
+                (
+                    None
+                    if self.can_scrape
+                    else external_manifest_path(self.training_images_path)
+                ),
+            )
+            self.verifier = ImageVerifier(
+                self.manifest,
+                ProjPaths.get_data() / QUARANTINE_DIRNAME if self.can_scrape else None,
+            )
+            self.deduplicator = Deduplicator(self.manifest)
+
+            self.get_photos()
+            self.__verify_dataset()
+            self.create_datablock()
+
+    def __len__(self):
+        return len(self.training_images)
+
+    @traced()
+    def get_photos(self) -> Dict[str, List[Path]]:
+        self.__sync_blob_view()
+        with self.tracer.span("get_photos.manifest_refresh"):
+            self.manifest.refresh()
+        missing = [
+            category
+            for category in self.categories
+            if self.manifest.count(category) < self.batch_size
+        ]
+        if missing and self.can_scrape:
+            self.__scrape(missing)
+        return {category: self.manifest.paths([category]) for category in self.categories}
+
+    @traced()
+    def create_datablock(self) -> None:
+        self.logger.log("Creating datablock")
+        stats = imagenet_stats if self.pretrained else None
+        self.data_loader = DataBlock(
+            blocks=(ImageBlock, TransformBlock),
+            splitter=RandomSplitter(valid_pct=0.2, seed=42),
+            get_y=QuestionTargets(
+                self.training_images_path, self.questions, self.merged_labels
+            ),
+            item_tfms=[Resize(self.img_res, method="squish")],
+            batch_tfms=[Normalize.from_stats(*stats)] if stats else None,
+        ).dataloaders(self.training_images, bs=self.batch_size)
+
+    def create_model(self) -> MultiQuestionModel:
+        # create_vision_model handles the torchvision weights API, keep only its body
+        body = create_vision_model(self.arch, 1, pretrained=self.pretrained)[0]
+        return MultiQuestionModel(body, num_features_model(body), len(self.questions))
+
+    @traced()
+    def train_(self, epochs: int = 4, lr: float = 2e-3, use_cache: bool = True) -> None:
+        model_key = self.model_store.key(
+            self.manifest.dataset_hash(self.categories),
+            kind="multi_question",
+            questions=self.questions,
+            img_res=self.img_res,
+            batch_size=self.batch_size,
+            epochs=epochs,
+            lr=lr,
+            arch=self.arch.__name__,
+            pretrained=self.pretrained,
+            train_bn=False,
+            merged_duplicates=True,
+        )
+        if use_cache and self.model_store.exists(model_key):
+            self.logger.log(f"Dataset unchanged, reusing trained model {model_key}")
+            self.model = self.model_store.load(model_key)
+            return
+
+        learn_ = Learner(
+            self.data_loader,
+            self.create_model(),
+            loss_func=MaskedBCEWithLogitsLoss(),
+            metrics=MaskedAccuracy(),
+            splitter=multi_question_splitter,
+            # BatchNorm layers of a frozen backbone stay frozen too
+            train_bn=False,
+        )
+        # The backbone stays frozen, weights and BatchNorm statistics alike, so only the
+        # per-question heads are fitted and the body is identical to the pretrained one
+        learn_.model.frozen_body = True
+        learn_.freeze()
+        self.logger.log(f"Training {len(self.questions)} question heads")
+        with self.tracer.span(
+            "train_.fit", items=len(self.training_images) * epochs
+        ):
+            learn_.fit_one_cycle(epochs, lr)
+        self.model = learn_
+        self.model_store.save(
+            model_key,
+            learn_,
+            kind="multi_question",
+            questions=self.questions,
+            img_res=self.img_res,
+            batch_size=self.batch_size,
+            epochs=epochs,
+            lr=lr,
+            arch=self.arch.__name__,
+            pretrained=self.pretrained,
+            train_bn=False,
+            merged_duplicates=True,
+        )
+
+    def predict_batch(
+        self, image_paths: Iterable[Path], batch_size: int = 64
+    ) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: float32 array of shape (len(image_paths), n_questions) holding the
+                probability of the positive answer, columns in `self.question_names` order.
+        """
+        image_paths = list(image_paths)
+        with self.tracer.span(
+            "MultiQuestionClassifier.predict_batch", items=len(image_paths)
+        ):
+            return batch_probs(
+                self.model, image_paths, batch_size, decoder=self.decoder
+            )
+
+    def predict(self, image_path: Path) -> Dict[str, dict]:
+        """Answers every question for one image, e.g. {"is_real": {"answer": "real", ...}}."""
+        return self.answers(self.predict_batch([image_path])[0])
+
+    def answers(self, probs: np.ndarray) -> Dict[str, dict]:
+        return {
+            name: {
+                "answer": positive if prob >= 0.5 else negative,
+                "probability": float(prob),
+            }
+            for (name, positive, negative), prob in zip(self.questions, probs)
+        }
+
+    def __scrape(self, categories: List[str]) -> None:
+        from scrapers.images.ddg_images import DuckDuckGoImageScraper
+        from scrapers.images.download_policy import DownloadPolicy
+
+        scraper = DuckDuckGoImageScraper(
+            self.downloads_dirname,
+            download_policy=DownloadPolicy(self.img_res),
+            blob_store=self.blob_store,
+        )
+        for category in categories:
+            phrases = self.category_phrases.get(category)
+            if not phrases:
+                self.logger.log(
+                    f"Category '{category}' has too few images and no search phrases",
+                    color_override="red",
+                )
+                continue
+            self.logger.log(f"Scraping images for '{category}'")
+            with self.tracer.span("get_photos.scrape"):
+                scraper.scrape(
+                    category, [(phrase, self.photos_per_phrase) for phrase in phrases]
+                )
+        self.__sync_blob_view()
+        self.manifest.refresh()
+
+    def __deduplicate(self) -> None:
+        # Dedup within a question's categories as usual, but near-identical images under
+        # categories of different questions are one image with several labels, merged
+        # into a single row. Rows no question can label are left out entirely.
+        targets = QuestionTargets(self.training_images_path, self.questions)
+        duplicates: Dict[Path, Path] = {}
+        self.merged_labels: Dict[Path, List[str]] = {}
+        for cluster in self.deduplicator.clusters(self.categories):
+            kept = cluster[0][0]
+            for path, _ in cluster[1:]:
+                duplicates[path] = kept
+            labels = sorted({label for _, label in cluster})
+            if len(labels) == 1:
+                continue
+            if all(target == UNLABELLED for target in targets.targets(labels)):
+                duplicates[kept] = cluster[1][0]
+                self.logger.log(
+                    "Leaving out near-identical images with conflicting labels: "
+                    + ", ".join(f"{path} ({label})" for path, label in cluster),
+                    color_override="red",
+                )
+            else:
+                self.merged_labels[kept] = labels
+
+        self.manifest.set_duplicates(self.categories, duplicates)
+        if duplicates:
+            self.logger.log(f"Skipping {len(duplicates)} duplicate images")
+        if self.merged_labels:
+            self.logger.log(
+                f"Merged near-identical images into {len(self.merged_labels)} "
+                "multi-label rows"
+            )
+
+    def __scrape_cache(self) -> Optional["ScrapeCache"]:
+        # The ledger of earlier scrapes into `training_images_path`, if there were any
+        if not self.can_scrape or self.blob_store is not None:
+            return None
+        from scrapers.images.scrape_cache import ScrapeCache
+
+        return ScrapeCache.existing(self.training_images_path)
+
+    def __sync_blob_view(self) -> None:
+        if self.blob_store is not None and self.can_scrape:
+            self.blob_store.materialize(self.categories, self.training_images_path)
+
+    def __verify_dataset(self) -> None:
+        with self.tracer.span("init.verify"):
+            # Only exists once `get_photos` has scraped something
+            self.verifier.scrape_cache = self.__scrape_cache()
+            verified, failed = self.verifier.run(self.categories)
+        if verified or failed:
+            self.logger.log(
+                f"[DataBlock Verification] {verified} images passed, {failed} failed"
+            )
+        with self.tracer.span("init.dedup"):
+            self.__deduplicate()
+
+        self.training_images = sorted(
+            self.manifest.paths(self.categories, verified_only=True, unique_only=True)
+        )
+        if len(self.training_images) == 0:
+            raise FileNotFoundError(
+                f"No images found for {self.categories} in {self.training_images_path}"
+            )
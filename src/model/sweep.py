@@ -0,0 +1,360 @@
+"""
+Hyperparameter sweep over `img_res`, `batch_size`, `photos_per_phrase` and `epochs` for
+one `BinaryImageClassifier` question.
+
+Run from `src/`:
+    python -m model.sweep --positive real --negative synthetic --img-res 64 128 \
+        --batch-size 16 32 --epochs 1 2 4 --photos-per-phrase 10 20 --min-accuracy 0.9
+
+Images are decoded and resized once per `img_res` into the question's `TensorCache`,
+the same caches `tensor_cache=True` training uses, and every trial process reads them
+through a memmap. `photos_per_phrase` is emulated by subsampling each phrase directory
+of the already downloaded corpus, so smaller settings need no new downloads. All trials
+are scored on the same held-out validation images, so accuracies are comparable, and
+each reports its training time and single-image inference latency.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+
+from dataset.manifest import CategoryLabeller
+from dataset.tensor_cache import TensorCache
+from logging_.log_and_print import Logger
+from utils.path_utils import ProjPaths
+
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    from model.image_classifier import BinaryImageClassifier
+
+
+PARAMS = ("img_res", "batch_size", "photos_per_phrase", "epochs")
+DEFAULT_SPACE: Dict[str, List[Any]] = {
+    "img_res": [64, 128, 224],
+    "batch_size": [16, 32, 64],
+    # None trains on every downloaded image
+    "photos_per_phrase": [10, 20, None],
+    "epochs": [1, 2, 4],
+}
+
+
+def grid_trials(space: Dict[str, Iterable[Any]]) -> List[Dict[str, Any]]:
+    """Every combination of the values in `space`, one dict per trial."""
+    space = {**DEFAULT_SPACE, **space}
+    return [
+        dict(zip(PARAMS, values))
+        for values in itertools.product(*(space[param] for param in PARAMS))
+    ]
+
+
+def random_trials(
+    space: Dict[str, Iterable[Any]], n_trials: int, seed: int = 42
+) -> List[Dict[str, Any]]:
+    """`n_trials` distinct combinations drawn at random from the grid."""
+    grid = grid_trials(space)
+    return random.Random(seed).sample(grid, min(n_trials, len(grid)))
+
+
+def fastest_meeting(
+    results: List[Dict[str, Any]], min_accuracy: float
+) -> Optional[Dict[str, Any]]:
+    """Lowest-latency trial whose accuracy is at least `min_accuracy`."""
+    passing = [
+        result
+        for result in results
+        if result.get("error") is None and result["accuracy"] >= min_accuracy
+    ]
+    if not passing:
+        return None
+    return min(passing, key=lambda result: (result["p50_ms"], result["train_seconds"]))
+
+
+def _run_trial(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Trains and scores one trial. Runs in a pool process, so it takes only plain data."""
+    params = job["params"]
+    result: Dict[str, Any] = {
+        **params,
+        "n_train": len(job["train_idx"]),
+        "n_valid": len(job["valid_idx"]),
+        "error": None,
+    }
+    try:
+        import torch
+        from fastai.vision.all import (
+            CategoryBlock,
+            DataBlock,
+            IndexSplitter,
+            IntToFloatTensor,
+            TransformBlock,
+            accuracy,
+            set_seed,
+            vision_learner,
+        )
+
+        from model.batch_inference import batch_probs
+
+        torch.set_num_threads(job["torch_threads"])
+        set_seed(job["seed"])
+        cache = TensorCache(job["cache_root"], params["img_res"])
+        items = job["train_idx"] + job["valid_idx"]
+        dls = DataBlock(
+            blocks=(
+                TransformBlock(type_tfms=cache.image_getter(), batch_tfms=IntToFloatTensor),
+                CategoryBlock,
+            ),
+            splitter=IndexSplitter(range(len(job["train_idx"]), len(items))),
+            get_y=cache.label_getter(),
+        ).dataloaders(items, bs=params["batch_size"], num_workers=0)
+        if len(dls.train) == 0:
+            raise ValueError(
+                f"{len(job['train_idx'])} training images do not fill one batch of "
+                f"{params['batch_size']}"
+            )
+
+        learn = vision_learner(
+            dls, job["arch"], metrics=accuracy, pretrained=job["pretrained"]
+        )
+        start = time.perf_counter()
+        with learn.no_bar(), learn.no_logging():
+            learn.fine_tune(params["epochs"])
+        result["train_seconds"] = time.perf_counter() - start
+        with learn.no_bar():
+            result["accuracy"] = float(learn.validate()[1])
+
+        latency_items = job["valid_idx"][: job["n_latency"]]
+        batch_probs(learn, latency_items[:1], batch_size=1)
+        latencies = []
+        for item in latency_items:
+            start = time.perf_counter()
+            batch_probs(learn, [item], batch_size=1)
+            latencies.append(time.perf_counter() - start)
+        result["p50_ms"] = float(np.percentile(latencies, 50) * 1000)
+        start = time.perf_counter()
+        batch_probs(learn, job["valid_idx"], batch_size=64)
+        seconds = time.perf_counter() - start
+        result["images_per_sec"] = len(job["valid_idx"]) / seconds if seconds > 0 else 0.0
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+class HyperparameterSweep:
+    """
+    Runs trials for `classifier`'s question in a pool of `workers` processes, each with
+    `cpu_count // workers` torch threads. The classifier only supplies the verified,
+    deduplicated training images, it is never trained itself.
+    """
+
+    def __init__(
+        self,
+        classifier: "BinaryImageClassifier",
+        valid_pct: float = 0.2,
+        workers: Optional[int] = None,
+        pretrained: bool = True,
+        n_latency: int = 32,
+        seed: int = 42,
+    ):
+        self.logger = Logger("HyperparameterSweep", "cyan")
+        self.classifier = classifier
+        self.workers = workers or max(1, (os.cpu_count() or 1) // 2)
+        self.pretrained = pretrained
+        self.n_latency = n_latency
+        self.seed = seed
+        self.caches: Dict[int, TensorCache] = {}
+        self.__split(valid_pct)
+
+    def prepare(self, img_res_values: Iterable[int]) -> None:
+        """Builds (or reuses) the tensor cache for each resolution."""
+        labeller = CategoryLabeller(self.classifier.training_images_path)
+        images = self.classifier.training_images
+        labels = [labeller(path) for path in images]
+        dataset_hash = self.classifier.manifest.dataset_hash(
+            [self.classifier.positive, self.classifier.negative]
+        )
+        for img_res in sorted(set(img_res_values)):
+            if img_res not in self.caches:
+                self.caches[img_res] = TensorCache(
+                    self.classifier.tensor_cache_root, img_res
+                ).ensure(images, labels, dataset_hash)
+
+    def run(self, trials: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self.prepare(trial["img_res"] for trial in trials)
+        workers = min(self.workers, len(trials))
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+        jobs = [self.__job(trial, torch_threads) for trial in trials]
+        self.logger.log(
+            f"Running {len(jobs)} trials in {workers} processes "
+            f"({torch_threads} torch threads each)"
+        )
+
+        results: List[Dict[str, Any]] = [{} for _ in jobs]
+        if workers == 1:
+            for i, job in enumerate(jobs):
+                results[i] = _run_trial(job)
+                self.__log_result(results[i], i + 1, len(jobs))
+        else:
+            # spawn, since forking a process that already runs torch threads can deadlock
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                futures = {
+                    executor.submit(_run_trial, job): i for i, job in enumerate(jobs)
+                }
+                for done, future in enumerate(as_completed(futures), 1):
+                    results[futures[future]] = future.result()
+                    self.__log_result(results[futures[future]], done, len(jobs))
+        return results
+
+    def report(
+        self, results: List[Dict[str, Any]], min_accuracy: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Logs every trial by accuracy and returns `fastest_meeting(min_accuracy)`."""
+        self.logger.log(
+            f"{'img_res':>7} {'batch':>5} {'photos':>6} {'epochs':>6} {'train':>6} "
+            f"{'accuracy':>8} {'train_s':>8} {'p50_ms':>7} {'img/s':>8}"
+        )
+        for result in sorted(
+            results, key=lambda result: result.get("accuracy") or -1, reverse=True
+        ):
+            if result["error"] is not None:
+                continue
+            self.logger.log(
+                f"{result['img_res']:>7} {result['batch_size']:>5} "
+                f"{str(result['photos_per_phrase']):>6} {result['epochs']:>6} "
+                f"{result['n_train']:>6} {result['accuracy']:>8.4f} "
+                f"{result['train_seconds']:>8.1f} {result['p50_ms']:>7.2f} "
+                f"{result['images_per_sec']:>8.1f}"
+            )
+        if min_accuracy is None:
+            return None
+        best = fastest_meeting(results, min_accuracy)
+        if best is None:
+            self.logger.log(
+                f"No trial reached accuracy {min_accuracy}", color_override="red"
+            )
+        else:
+            self.logger.log(
+                f"Fastest trial with accuracy >= {min_accuracy}: "
+                + ", ".join(f"{param}={best[param]}" for param in PARAMS)
+            )
+        return best
+
+    def __split(self, valid_pct: float) -> None:
+        """
+        Holds out one validation set for every trial, and orders the remaining images of
+        each phrase directory at random so a trial with `photos_per_phrase=n` trains on
+        the first n, a subset of any larger setting.
+        """
+        rng = random.Random(self.seed)
+        # Cache rows follow `training_images`, as in the classifier's cached dataloaders
+        order = list(range(len(self.classifier.training_images)))
+        rng.shuffle(order)
+        n_valid = int(len(order) * valid_pct)
+        self.valid_idx = sorted(order[:n_valid])
+        self.phrase_idx: Dict[Path, List[int]] = {}
+        for i in order[n_valid:]:
+            phrase_dir = Path(self.classifier.training_images[i]).parent
+            self.phrase_idx.setdefault(phrase_dir, []).append(i)
+
+    def __job(self, trial: Dict[str, Any], torch_threads: int) -> Dict[str, Any]:
+        n = trial["photos_per_phrase"]
+        return {
+            "params": {param: trial[param] for param in PARAMS},
+            "cache_root": str(self.classifier.tensor_cache_root),
+            "train_idx": sorted(
+                i
+                for phrase_idx in self.phrase_idx.values()
+                for i in (phrase_idx if n is None else phrase_idx[:n])
+            ),
+            "valid_idx": self.valid_idx,
+            "arch": self.classifier.arch,
+            "pretrained": self.pretrained,
+            "n_latency": self.n_latency,
+            "torch_threads": torch_threads,
+            "seed": self.seed,
+        }
+
+    def __log_result(self, result: Dict[str, Any], done: int, total: int) -> None:
+        trial = ", ".join(f"{param}={result[param]}" for param in PARAMS)
+        if result["error"] is not None:
+            self.logger.log(
+                f"[{done}/{total}] {trial} failed: {result['error']}",
+                color_override="red",
+            )
+            return
+        self.logger.log(
+            f"[{done}/{total}] {trial}: accuracy {result['accuracy']:.4f}, "
+            f"trained in {result['train_seconds']:.1f}s, p50 {result['p50_ms']:.2f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--positive", required=True)
+    parser.add_argument("--negative", required=True)
+    parser.add_argument(
+        "--dataset", type=Path, default=None, help="Local <label>/... image folder"
+    )
+    parser.add_argument("--img-res", type=int, nargs="+", default=DEFAULT_SPACE["img_res"])
+    parser.add_argument(
+        "--batch-size", type=int, nargs="+", default=DEFAULT_SPACE["batch_size"]
+    )
+    parser.add_argument(
+        "--photos-per-phrase",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SPACE["photos_per_phrase"],
+        help="Images per phrase directory, all of them when omitted",
+    )
+    parser.add_argument("--epochs", type=int, nargs="+", default=DEFAULT_SPACE["epochs"])
+    parser.add_argument(
+        "--random", type=int, default=None, help="Sample this many trials from the grid"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--min-accuracy", type=float, default=None)
+    parser.add_argument("--no-pretrained", action="store_true")
+    parser.add_argument("--output", type=Path, default=None, help="Results JSON path")
+    args = parser.parse_args()
+
+    from model.image_classifier import BinaryImageClassifier
+
+    space = {
+        "img_res": args.img_res,
+        "batch_size": args.batch_size,
+        "photos_per_phrase": args.photos_per_phrase,
+        "epochs": args.epochs,
+    }
+    trials = (
+        grid_trials(space) if args.random is None else random_trials(space, args.random)
+    )
+    classifier = BinaryImageClassifier(
+        args.positive,
+        args.negative,
+        batch_size=min(args.batch_size),
+        img_res=min(args.img_res),
+        dataset_path=args.dataset,
+        headless=True,
+    )
+    sweep = HyperparameterSweep(
+        classifier, workers=args.workers, pretrained=not args.no_pretrained
+    )
+    results = sweep.run(trials)
+    best = sweep.report(results, args.min_accuracy)
+
+    output = args.output or ProjPaths.get_proj_root() / "sweep_results.json"
+    with open(output, "w") as f:
+        json.dump({"results": results, "selected": best}, f, indent=2)
+    sweep.logger.log(f"Wrote {len(results)} trial results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import asyncio
+import os
+from collections import defaultdict
+from pathlib import Path
+from urllib.parse import urlparse
+
+import httpx
+
+from logging_.log_and_print import Logger
+from scrapers.images.ddg_images import DuckDuckGoImageScraper
+from scrapers.images.download_policy import DownloadPolicy
+from scrapers.images.download_pool import (
+    DEFAULT_USER_AGENT,
+    FetchResult,
+    TokenBucket,
+)
+from scrapers.images.scrape_cache import SKIP_DOWNLOADED, SKIP_FAILED
+
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from dataset.blob_store import BlobStore
+
+
+class AsyncDuckDuckGoImageScraper(DuckDuckGoImageScraper):
+    """
+    asyncio drop-in for `DuckDuckGoImageScraper` with the same `scrape` return contract.
+
+    Each phrase's downloads start as soon as its search returns, over one pooled
+    keep-alive `httpx.AsyncClient`. `scrape_categories` runs several categories in the
+    same event loop, so positive and negative phrases are fetched concurrently.
+    `search_fn` replaces the DDG search, e.g. with a client for a local mock server.
+    """
+
+    def __init__(
+        self,
+        downloads_dirname: str = "image_downloads",
+        sleep_interval: float = 10.0,
+        timout: int = 10,
+        max_connections: int = 16,
+        per_host_limit: int = 4,
+        download_rate: float = 16.0,
+        search_rate: Optional[float] = None,
+        search_concurrency: int = 2,
+        search_fn: Optional[Callable[[str, int], List[dict]]] = None,
+        revalidate: bool = False,
+        download_policy: Optional[DownloadPolicy] = None,
+        blob_store: Optional["BlobStore"] = None,
+        verbose: Optional[bool] = None,
+    ):
+        super().__init__(
+            downloads_dirname,
+            sleep_interval,
+            timout,
+            max_workers=max_connections,
+            per_host_limit=per_host_limit,
+            download_rate=download_rate,
+            search_rate=search_rate,
+            revalidate=revalidate,
+            download_policy=download_policy,
+            blob_store=blob_store,
+            verbose=verbose,
+        )
+        self.logger = Logger("AsyncDuckDuckGoImageScraper", "cyan", verbose=verbose)
+        self.search_concurrency = search_concurrency
+        # `search_concurrency` searches may start together, then one per
+        # `sleep_interval / search_concurrency` seconds, instead of the base class's
+        # one search at a time
+        self.search_limiter = TokenBucket(
+            search_rate or search_concurrency / max(sleep_interval, 1e-3),
+            capacity=search_concurrency,
+        )
+        self.search_fn = search_fn or self.search_images
+
+    def scrape(
+        self, category: str, search_phrases: List[Tuple[str, int]]
+    ) -> List[dict]:
+        return self.scrape_categories({category: search_phrases})[category]
+
+    def scrape_categories(
+        self, categories: Dict[str, List[Tuple[str, int]]]
+    ) -> Dict[str, List[dict]]:
+        """Scrapes every category concurrently. Returns `scrape`'s result per category."""
+        return asyncio.run(self.ascrape_categories(categories))
+
+    async def ascrape_categories(
+        self, categories: Dict[str, List[Tuple[str, int]]]
+    ) -> Dict[str, List[dict]]:
+        limits = httpx.Limits(
+            max_connections=self.max_workers,
+            max_keepalive_connections=self.max_workers,
+        )
+        host_slots: Dict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(self.per_host_limit)
+        )
+        search_slots = asyncio.Semaphore(self.search_concurrency)
+        async with httpx.AsyncClient(
+            limits=limits,
+            timeout=self.timeout,
+            follow_redirects=True,
+            headers={"User-Agent": DEFAULT_USER_AGENT},
+        ) as client:
+            phrase_tasks = {
+                category: [
+                    self.__scrape_phrase(
+                        client, host_slots, search_slots, category, phrase, limit
+                    )
+                    for phrase, limit in search_phrases
+                ]
+                for category, search_phrases in categories.items()
+            }
+            results = await asyncio.gather(
+                *(asyncio.gather(*tasks) for tasks in phrase_tasks.values())
+            )
+
+        ret = {}
+        for category, phrase_results in zip(phrase_tasks.keys(), results):
+            ret[category] = [result for results in phrase_results for result in results]
+            downloaded = sum("download_path" in result for result in ret[category])
+            self.logger.log(
+                f"Downloaded {downloaded} of {len(ret[category])} images to {self.dl_path / category}"
+            )
+        return ret
+
+    async def __scrape_phrase(
+        self,
+        client: httpx.AsyncClient,
+        host_slots: Dict[str, asyncio.Semaphore],
+        search_slots: asyncio.Semaphore,
+        category: str,
+        phrase: str,
+        limit: int,
+    ) -> List[dict]:
+        image_results = self.scrape_cache.get_search(phrase, limit)
+        if image_results is None:
+            async with search_slots:
+                await self.search_limiter.acquire_async()
+                try:
+                    image_results = await asyncio.to_thread(
+                        self.search_fn, phrase, limit
+                    )
+                except Exception as e:
+                    self.logger.log(
+                        f"Search failed for '{phrase}': {e}", color_override="red"
+                    )
+                    return []
+            image_results = list(image_results)
+            self.scrape_cache.put_search(phrase, limit, image_results)
+        self.logger.log(f"Found {len(image_results)} images for '{phrase}'")
+
+        await asyncio.gather(
+            *(
+                self.__download_result(
+                    client,
+                    host_slots,
+                    category,
+                    result,
+                    self._photo_dl_path(category, phrase, index, result),
+                )
+                for index, result in enumerate(image_results)
+                if not self._reuse_stored(category, result)
+            )
+        )
+        return image_results
+
+    async def __download_result(
+        self,
+        client: httpx.AsyncClient,
+        host_slots: Dict[str, asyncio.Semaphore],
+        category: str,
+        result: dict,
+        photo_dl_path: Path,
+    ) -> None:
+        url = result["image"]
+        action, headers, kept = self.scrape_cache.plan_download(url, photo_dl_path)
+        if action == SKIP_DOWNLOADED:
+            result["download_path"] = photo_dl_path
+            self._store_download(category, result)
+            return
+        if action == SKIP_FAILED:
+            return
+
+        candidates = self.download_policy.candidates(result)
+        if not candidates:
+            return
+
+        try:
+            source, fetched = await self.download_policy.afetch(
+                candidates,
+                photo_dl_path,
+                lambda candidate_url, path, request_headers: self.__fetch(
+                    client, host_slots, candidate_url, path, request_headers
+                ),
+                kept,
+                headers,
+            )
+        except Exception as e:
+            self.scrape_cache.record_failure(url, f"{type(e).__name__}: {e}")
+            self.logger.log(
+                f"Failed to download {url}: {type(e).__name__}: {e}",
+                color_override="red",
+            )
+            return
+        self.scrape_cache.record_success(url, source, fetched)
+        result["download_path"] = photo_dl_path
+        result["download_source"] = source
+        self._store_download(category, result)
+
+    async def __fetch(
+        self,
+        client: httpx.AsyncClient,
+        host_slots: Dict[str, asyncio.Semaphore],
+        url: str,
+        path: Path,
+        headers: Dict[str, str],
+    ) -> FetchResult:
+        async with host_slots[urlparse(url).netloc]:
+            await self.download_limiter.acquire_async()
+            tmp_path = path.with_name(f".{path.name}.part")
+            try:
+                async with client.stream("GET", url, headers=headers) as response:
+                    if response.status_code != 304:
+                        response.raise_for_status()
+                        with open(tmp_path, "wb") as f:
+                            async for chunk in response.aiter_bytes(64 * 1024):
+                                f.write(chunk)
+                        os.replace(tmp_path, path)
+                    return FetchResult(
+                        path,
+                        response.status_code == 304,
+                        response.headers.get("ETag"),
+                        response.headers.get("Last-Modified"),
+                        url,
+                    )
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
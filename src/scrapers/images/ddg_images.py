@@ -2,14 +2,25 @@ import os
 from pathlib import Path
 import time
 
-from duckduckgo_search import DDGS
-from fastdownload import download_url
-from fastcore.all import *
-
 from logging_.log_and_print import Logger
+from scrapers.images.download_policy import DownloadPolicy
+from scrapers.images.download_pool import (
+    ConcurrentImageDownloader,
+    TokenBucket,
+    fetch_url,
+)
+from scrapers.images.scrape_cache import (
+    SCRAPE_CACHE_FILENAME,
+    SKIP_DOWNLOADED,
+    SKIP_FAILED,
+    ScrapeCache,
+)
 from utils.path_utils import ProjPaths
 
-from typing import List, Tuple
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from dataset.blob_store import BlobStore
 
 
 class DuckDuckGoImageScraper:
@@ -18,13 +29,52 @@ class DuckDuckGoImageScraper:
         downloads_dirname: str = "image_downloads",
         sleep_interval: float = 10.0,
         timout: int = 10,
+        concurrent: bool = False,
+        max_workers: int = 8,
+        per_host_limit: int = 2,
+        download_rate: float = 8.0,
+        search_rate: Optional[float] = None,
+        revalidate: bool = False,
+        download_policy: Optional[DownloadPolicy] = None,
+        blob_store: Optional["BlobStore"] = None,
+        verbose: Optional[bool] = None,
     ):
-        self.logger = Logger("DuckDuckGoImageScraper", "cyan")
+        """
+        Args:
+            concurrent (bool): Download through a `ConcurrentImageDownloader` of
+                `max_workers` threads, at most `per_host_limit` per host and
+                `download_rate` per second, instead of one image at a time.
+            search_rate (Optional[float]): Searches per second in concurrent mode.
+                Defaults to one every `sleep_interval` seconds, with no bursts, so
+                searches stay serial like the sequential mode's. Only the downloads
+                run concurrently.
+            blob_store (Optional[BlobStore]): Move each download into this content-
+                addressed store, labelled with its category, and skip URLs it already
+                holds. `download_path` then points at the stored blob.
+        """
+        self.logger = Logger("DuckDuckGoImageScraper", "cyan", verbose=verbose)
         self.dl_dirname = downloads_dirname
         self.dl_path = ProjPaths.get_data(self.dl_dirname)
 
         self.sleep_interval = sleep_interval
         self.timeout = timout
+        # Thumbnails are usually enough at training resolution, see `DownloadPolicy`
+        self.download_policy = download_policy or DownloadPolicy()
+        self.blob_store = blob_store
+
+        # Concurrent mode replaces the blanket sleep between phrases with token buckets
+        self.concurrent = concurrent
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.download_limiter = TokenBucket(download_rate, capacity=max_workers)
+        self.search_limiter = TokenBucket(
+            search_rate or 1.0 / max(sleep_interval, 1e-3), capacity=1.0
+        )
+
+        # Search results and download outcomes persist so interrupted runs can resume
+        self.scrape_cache = ScrapeCache(
+            self.dl_path / SCRAPE_CACHE_FILENAME, revalidate=revalidate
+        )
 
         self.logger.log(f"Download path (abs): {self.dl_path}")
         self.logger.log(f"Download folder name: {self.dl_dirname}")
@@ -50,42 +100,87 @@ class DuckDuckGoImageScraper:
                 "height": (int) Height of the image,
                 "width": (int) Width of the image,
                 "source": (str) Website source of the image,
-                "download_path": (Path) Path to the downloaded image
+                "download_path": (Path) Path to the downloaded image,
+                "download_source": (str) "thumbnail" or "image", whichever was kept
             },...]
         """
+        if self.concurrent:
+            return self.__scrape_concurrent(category, search_phrases)
+
         ret = []
         for phrase, limit in search_phrases:
-            downloaded_photos = self.__search_scrape_images(category, phrase, limit)
+            downloaded_photos, searched = self.__search_scrape_images(
+                category, phrase, limit
+            )
             ret += downloaded_photos
-            time.sleep(self.sleep_interval)
+            if searched:
+                time.sleep(self.sleep_interval)
         return ret
 
     def search_images(self, search_phrase: str, max_images: int = 30) -> List[dict]:
+        # Only searching needs the DDG client, resumed and cached scrapes never load it
+        from duckduckgo_search import DDGS
+        from fastcore.foundation import L
+
         with DDGS() as ddg:
             results = ddg.images(keywords=search_phrase)
             # Only return up to max_images
             truncated = results[:max_images]
             return L(truncated)
 
+    def cached_search_images(
+        self, search_phrase: str, max_images: int = 30
+    ) -> Tuple[List[dict], bool]:
+        """Returns (results, whether a live search was made)."""
+        cached = self.scrape_cache.get_search(search_phrase, max_images)
+        if cached is not None:
+            self.logger.log(f"Using cached search results for '{search_phrase}'")
+            return cached, False
+        results = list(self.search_images(search_phrase, max_images))
+        self.scrape_cache.put_search(search_phrase, max_images, results)
+        return results, True
+
     def __search_scrape_images(
         self, category: str, search_phrase: str, max_images: int = 30
-    ) -> List[dict]:
-        image_results = self.search_images(search_phrase, max_images)
+    ) -> Tuple[List[dict], bool]:
+        image_results, searched = self.cached_search_images(search_phrase, max_images)
 
         for index, result in enumerate(image_results):
-            filename = f"{search_phrase}_{index}{Path(result['image']).suffix}"
+            if self._reuse_stored(category, result):
+                continue
+            photo_dl_path = self._photo_dl_path(category, search_phrase, index, result)
+            action, headers, kept = self.scrape_cache.plan_download(
+                result["image"], photo_dl_path
+            )
+            if action == SKIP_DOWNLOADED:
+                result["download_path"] = photo_dl_path
+                self._store_download(category, result)
+                continue
+            if action == SKIP_FAILED:
+                continue
+            candidates = self.download_policy.candidates(result)
+            if not candidates:
+                self.logger.log(
+                    f"Skipping image {index + 1} of {len(image_results)}: "
+                    f"{self.download_policy.skip_reason(result)}"
+                )
+                continue
+
             self.logger.log(f"Downloading image {index + 1} of {len(image_results)}\n")
             self.logger.log(result)
 
-            photo_dl_path = ProjPaths.get_data(
-                self.dl_path / category / search_phrase / filename
-            )
-
             try:
-                res_dl_path = download_url(
-                    result["image"], photo_dl_path, timeout=self.timeout, show_progress=False
+                source, fetched = self.download_policy.fetch(
+                    candidates,
+                    photo_dl_path,
+                    lambda url, path, request_headers: fetch_url(
+                        url, path, self.timeout, request_headers
+                    ),
+                    kept,
+                    headers,
                 )
             except Exception as e:
+                self.scrape_cache.record_failure(result["image"], str(e))
                 self.logger.log(
                     f"Failed to download image {index + 1} of {len(image_results)}\n",
                     color_override="red",
@@ -93,11 +188,105 @@ class DuckDuckGoImageScraper:
                 self.logger.log(f"Error: {e}", color_override="red")
                 continue
 
-            self.logger.log(f"Downloaded image to {res_dl_path}")
+            self.scrape_cache.record_success(result["image"], source, fetched)
+            self.logger.log(f"Downloaded {source} to {fetched.path}")
             result["download_path"] = photo_dl_path
+            result["download_source"] = source
+            self._store_download(category, result)
 
         self.logger.log(
             f"Images downloaded successfully to {self.dl_path / category / search_phrase}"
         )
 
-        return image_results
+        return image_results, searched
+
+    def __scrape_concurrent(
+        self, category: str, search_phrases: List[Tuple[str, int]]
+    ) -> List[dict]:
+        # Searches run one after another (rate limited), while the downloads for
+        # every phrase already searched proceed in the background worker pool.
+        ret = []
+        pending = []
+        with ConcurrentImageDownloader(
+            max_workers=self.max_workers,
+            per_host_limit=self.per_host_limit,
+            rate_limiter=self.download_limiter,
+            timeout=self.timeout,
+        ) as downloader:
+            for phrase, limit in search_phrases:
+                if self.scrape_cache.get_search(phrase, limit) is None:
+                    self.search_limiter.acquire()
+                image_results, _ = self.cached_search_images(phrase, limit)
+                for index, result in enumerate(image_results):
+                    if self._reuse_stored(category, result):
+                        continue
+                    photo_dl_path = self._photo_dl_path(category, phrase, index, result)
+                    action, headers, kept = self.scrape_cache.plan_download(
+                        result["image"], photo_dl_path
+                    )
+                    candidates = self.download_policy.candidates(result)
+                    if action == SKIP_DOWNLOADED:
+                        result["download_path"] = photo_dl_path
+                        self._store_download(category, result)
+                    elif action != SKIP_FAILED and candidates:
+                        future = downloader.submit_candidates(
+                            self.download_policy,
+                            candidates,
+                            photo_dl_path,
+                            kept,
+                            headers,
+                        )
+                        pending.append((phrase, index, result, photo_dl_path, future))
+                self.logger.log(f"Queued {len(pending)} downloads after '{phrase}'")
+                ret += image_results
+
+            failed = 0
+            for phrase, index, result, photo_dl_path, future in pending:
+                try:
+                    source, fetched = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.scrape_cache.record_failure(result["image"], str(e))
+                    self.logger.log(
+                        f"Failed to download image {index} for '{phrase}': {e}",
+                        color_override="red",
+                    )
+                    continue
+                self.scrape_cache.record_success(result["image"], source, fetched)
+                result["download_path"] = photo_dl_path
+                result["download_source"] = source
+                self._store_download(category, result)
+
+        self.logger.log(
+            f"Downloaded {len(pending) - failed} of {len(pending)} images to {self.dl_path / category}"
+        )
+        return ret
+
+    def _reuse_stored(self, category: str, result: dict) -> bool:
+        """Points `result` at the blob its URL was already downloaded to, if any."""
+        if self.blob_store is None:
+            return False
+        sha = self.blob_store.sha_for_url(result["image"])
+        if sha is None:
+            return False
+        self.blob_store.add_labels(category, [sha])
+        result["download_path"] = self.blob_store.blob_path(sha)
+        result["sha256"] = sha
+        return True
+
+    def _store_download(self, category: str, result: dict) -> None:
+        if self.blob_store is None:
+            return
+        sha = self.blob_store.put_file(
+            result["download_path"], [category], url=result["image"], move=True
+        )
+        result["download_path"] = self.blob_store.blob_path(sha)
+        result["sha256"] = sha
+
+    def _photo_dl_path(
+        self, category: str, search_phrase: str, index: int, result: dict
+    ) -> Path:
+        filename = f"{search_phrase}_{index}{Path(result['image']).suffix}"
+        phrase_dir = self.dl_path / category / search_phrase
+        phrase_dir.mkdir(parents=True, exist_ok=True)
+        return ProjPaths.get_data(phrase_dir) / filename
@@ -0,0 +1,179 @@
+import os
+from dataclasses import replace
+from pathlib import Path
+
+from PIL import Image
+
+from scrapers.images.download_pool import FetchResult
+
+from typing import Awaitable, Callable, Dict, Generator, List, Optional, Tuple, Union
+
+
+# Which URL of a search result ended up on disk, stored as result["download_source"]
+THUMBNAIL = "thumbnail"
+FULL_IMAGE = "image"
+
+# (url, path to download to, request headers) for a fetch function
+FetchRequest = Tuple[str, Path, Dict[str, str]]
+
+
+class DownloadPolicy:
+    """
+    Decides which URL of a DDG result to download, given the resolution images are
+    trained at.
+
+    Results whose reported `width`/`height` are below `min_side` or more elongated than
+    `max_aspect_ratio` are skipped without downloading anything (0 or missing dimensions
+    count as unknown). Otherwise the thumbnail is fetched first, and kept if both of its
+    sides cover `target_res`, since `Resize(img_res, method="squish")` throws the rest of
+    a full-size photo away. The full image is only fetched when the thumbnail is missing,
+    fails, or turns out too small.
+    """
+
+    def __init__(
+        self,
+        target_res: int = 128,
+        min_side: Optional[int] = None,
+        max_aspect_ratio: float = 3.0,
+        thumbnail_first: bool = True,
+    ):
+        self.target_res = target_res
+        self.min_side = target_res if min_side is None else min_side
+        self.max_aspect_ratio = max_aspect_ratio
+        self.thumbnail_first = thumbnail_first
+
+    def skip_reason(self, result: dict) -> Optional[str]:
+        width, height = result.get("width") or 0, result.get("height") or 0
+        if not width or not height:
+            return None
+        if min(width, height) < self.min_side:
+            return f"too small ({width}x{height})"
+        if max(width, height) / min(width, height) > self.max_aspect_ratio:
+            return f"aspect ratio too extreme ({width}x{height})"
+        return None
+
+    def candidates(self, result: dict) -> List[Tuple[str, str]]:
+        """[(source, url)] to try in order. Empty when the result should be skipped."""
+        if self.skip_reason(result) is not None:
+            return []
+        ret = []
+        if self.thumbnail_first and result.get("thumbnail"):
+            ret.append((THUMBNAIL, result["thumbnail"]))
+        if result.get("image"):
+            ret.append((FULL_IMAGE, result["image"]))
+        return ret
+
+    def is_sufficient(self, source: str, path: Path) -> bool:
+        """Whether a downloaded file can be kept, or the next candidate should be tried."""
+        if source == FULL_IMAGE:
+            return True
+        try:
+            # Only reads the header
+            with Image.open(path) as image:
+                width, height = image.size
+        except Exception:
+            return False
+        return min(width, height) >= self.target_res
+
+    def fetch(
+        self,
+        candidates: List[Tuple[str, str]],
+        dest: Path,
+        fetch: Callable[[str, Path, Dict[str, str]], FetchResult],
+        kept: Optional[Tuple[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[Optional[str], FetchResult]:
+        """
+        Downloads `candidates` in order until one is sufficient, and moves it to `dest`.
+        Returns (source, result).
+
+        Each candidate is fetched to its own file next to `dest`, which is only replaced
+        by a kept one. A thumbnail that turned out too small is still kept if every
+        later candidate fails, unless `dest` already exists: an existing file is never
+        replaced by an insufficient one. The last error is raised when nothing downloaded.
+
+        `kept` is the (source, url) candidate `dest` came from and `headers` the
+        conditional request headers for it. Only that URL is revalidated with them,
+        first, and a 304 keeps `dest` as it is.
+        """
+        attempts = self.__attempts(candidates, dest, kept, headers)
+        response = None
+        while True:
+            try:
+                url, path, request_headers = attempts.send(response)
+            except StopIteration as done:
+                return done.value
+            try:
+                response = fetch(url, path, request_headers)
+            except Exception as e:
+                response = e
+
+    async def afetch(
+        self,
+        candidates: List[Tuple[str, str]],
+        dest: Path,
+        fetch: Callable[[str, Path, Dict[str, str]], Awaitable[FetchResult]],
+        kept: Optional[Tuple[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[Optional[str], FetchResult]:
+        """`fetch` for a coroutine function `fetch`."""
+        attempts = self.__attempts(candidates, dest, kept, headers)
+        response = None
+        while True:
+            try:
+                url, path, request_headers = attempts.send(response)
+            except StopIteration as done:
+                return done.value
+            try:
+                response = await fetch(url, path, request_headers)
+            except Exception as e:
+                response = e
+
+    def __attempts(
+        self,
+        candidates: List[Tuple[str, str]],
+        dest: Path,
+        kept: Optional[Tuple[str, str]],
+        headers: Optional[Dict[str, str]],
+    ) -> Generator[
+        FetchRequest, Union[FetchResult, Exception, None], Tuple[Optional[str], FetchResult]
+    ]:
+        # The fallback logic of `fetch` and `afetch`, which send back the result or the
+        # exception of every request yielded here
+        dest = Path(dest)
+        attempts = [(source, url, {}) for source, url in candidates]
+        if kept is not None and headers and dest.exists():
+            # Only the URL the file came from can answer for it with a 304
+            attempts = [(*kept, headers)] + [
+                attempt for attempt in attempts if attempt[1] != kept[1]
+            ]
+        staged = {
+            source: dest.with_name(f".{dest.name}.{source}") for source, _, _ in attempts
+        }
+        fallback, error = None, None
+        try:
+            for source, url, request_headers in attempts:
+                response = yield url, staged[source], request_headers
+                if isinstance(response, Exception):
+                    error = response
+                    continue
+                if response.not_modified:
+                    return source, replace(response, path=dest)
+                if self.is_sufficient(source, staged[source]):
+                    os.replace(staged[source], dest)
+                    return source, replace(response, path=dest)
+                fallback = (source, response)
+            if fallback is not None and dest.exists():
+                # The file already there is no worse than the fallback
+                return (
+                    kept[0] if kept else None,
+                    FetchResult(dest, True, url=kept[1] if kept else None),
+                )
+            if fallback is not None:
+                source, response = fallback
+                os.replace(staged[source], dest)
+                return source, replace(response, path=dest)
+            raise error or ValueError(f"No URL to download to {dest}")
+        finally:
+            for path in staged.values():
+                path.unlink(missing_ok=True)
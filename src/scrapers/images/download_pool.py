@@ -0,0 +1,193 @@
+import asyncio
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlparse
+
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from scrapers.images.download_policy import DownloadPolicy
+
+
+DEFAULT_USER_AGENT = (
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0 Safari/537.36"
+)
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate}")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Blocks until `tokens` are available and returns the seconds spent waiting."""
+        waited = 0.0
+        while (wait := self.try_acquire(tokens)) > 0:
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def acquire_async(self, tokens: float = 1.0) -> float:
+        waited = 0.0
+        while (wait := self.try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Takes `tokens` if available and returns 0, otherwise returns how long to wait."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last_refill) * self.rate
+            )
+            self.last_refill = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+
+@dataclass
+class FetchResult:
+    path: Path
+    not_modified: bool = False
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    url: Optional[str] = None
+
+
+def fetch_url(
+    url: str,
+    dest: Path,
+    timeout: float = 10,
+    headers: Optional[Dict[str, str]] = None,
+) -> FetchResult:
+    """
+    Downloads `url` to `dest`, writing to a temp file first so partial downloads never
+    land. A 304 response to conditional `headers` leaves `dest` untouched.
+    """
+    request = urllib.request.Request(
+        url, headers={"User-Agent": DEFAULT_USER_AGENT, **(headers or {})}
+    )
+    tmp_path = dest.with_name(f".{dest.name}.{threading.get_ident()}.part")
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response, open(
+            tmp_path, "wb"
+        ) as f:
+            while chunk := response.read(64 * 1024):
+                f.write(chunk)
+            response_headers = response.headers
+        os.replace(tmp_path, dest)
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+        return FetchResult(
+            dest, True, e.headers.get("ETag"), e.headers.get("Last-Modified"), url
+        )
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return FetchResult(
+        dest,
+        False,
+        response_headers.get("ETag"),
+        response_headers.get("Last-Modified"),
+        url,
+    )
+
+
+class ConcurrentImageDownloader:
+    """
+    Bounded worker pool for image downloads.
+
+    `max_workers` caps the total number of in-flight downloads, `per_host_limit` caps
+    connections to any single host and the optional `rate_limiter` throttles how often
+    new requests are started.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        per_host_limit: int = 2,
+        rate_limiter: Optional[TokenBucket] = None,
+        timeout: float = 10,
+        fetch: Callable[..., FetchResult] = fetch_url,
+    ):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.fetch = fetch
+
+        self.__host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self.__host_slots_lock = threading.Lock()
+        self.__executor: Optional[ThreadPoolExecutor] = None
+
+    def __enter__(self) -> "ConcurrentImageDownloader":
+        self.__executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="image-download"
+        )
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True)
+            self.__executor = None
+
+    def submit(
+        self, url: str, dest: Path, headers: Optional[Dict[str, str]] = None
+    ) -> "Future[FetchResult]":
+        if self.__executor is None:
+            raise RuntimeError("ConcurrentImageDownloader must be used as a context manager")
+        return self.__executor.submit(self.__download, url, dest, headers)
+
+    def submit_candidates(
+        self,
+        policy: "DownloadPolicy",
+        candidates: List[Tuple[str, str]],
+        dest: Path,
+        kept: Optional[Tuple[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> "Future[Tuple[Optional[str], FetchResult]]":
+        """Like `submit`, falling back through `candidates` as `policy.fetch` does."""
+        if self.__executor is None:
+            raise RuntimeError("ConcurrentImageDownloader must be used as a context manager")
+        return self.__executor.submit(
+            policy.fetch, candidates, dest, self.__download, kept, headers
+        )
+
+    def __host_slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self.__host_slots_lock:
+            if host not in self.__host_slots:
+                self.__host_slots[host] = threading.BoundedSemaphore(
+                    self.per_host_limit
+                )
+            return self.__host_slots[host]
+
+    def __download(
+        self, url: str, dest: Path, headers: Optional[Dict[str, str]]
+    ) -> FetchResult:
+        with self.__host_slot(url):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            return self.fetch(url, dest, self.timeout, headers)
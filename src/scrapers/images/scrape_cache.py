@@ -0,0 +1,191 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from scrapers.images.download_pool import FetchResult
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+SCRAPE_CACHE_FILENAME = ".scrape_cache.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    phrase TEXT PRIMARY KEY,
+    max_images INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    searched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS downloads (
+    url TEXT PRIMARY KEY,
+    path TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    etag TEXT,
+    last_modified TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    source TEXT,
+    fetched_url TEXT
+);
+CREATE INDEX IF NOT EXISTS downloads_path ON downloads (path);
+"""
+
+# Columns added after the first ledger version, applied to older databases on open
+MIGRATIONS = {
+    "source": "ALTER TABLE downloads ADD COLUMN source TEXT",
+    "fetched_url": "ALTER TABLE downloads ADD COLUMN fetched_url TEXT",
+}
+
+# Download plan actions, see `ScrapeCache.plan_download`
+FETCH = "fetch"
+SKIP_DOWNLOADED = "skip_downloaded"
+SKIP_FAILED = "skip_failed"
+
+
+class ScrapeCache:
+    """
+    Persistent search results per phrase plus a per-URL download ledger, so an
+    interrupted scrape resumes where it stopped instead of searching and downloading
+    everything again.
+
+    `attempts` counts consecutive failures and is reset by a successful download.
+    Downloads `ImageVerifier` quarantined are marked as such and never fetched again.
+    Downloads are keyed by the result's `image` URL, while `source` and `fetched_url`
+    record which of its candidates the file on disk actually came from.
+    """
+
+    def __init__(self, db_path: Path, max_attempts: int = 2, revalidate: bool = False):
+        self.db_path = Path(db_path)
+        self.max_attempts = max_attempts
+        self.revalidate = revalidate
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(SCHEMA)
+        self.__migrate()
+
+    @classmethod
+    def existing(cls, dl_path: Path) -> Optional["ScrapeCache"]:
+        """The ledger of a scraper downloading to `dl_path`, None if it has none."""
+        db_path = Path(dl_path) / SCRAPE_CACHE_FILENAME
+        return cls(db_path) if db_path.exists() else None
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get_search(self, phrase: str, max_images: int) -> Optional[List[dict]]:
+        row = self.conn.execute(
+            "SELECT max_images, results FROM searches WHERE phrase = ?", (phrase,)
+        ).fetchone()
+        if row is None:
+            return None
+        cached_max, results = row[0], json.loads(row[1])
+        # A smaller earlier search is only enough if it already ran out of results
+        if cached_max < max_images and len(results) >= cached_max:
+            return None
+        return results[:max_images]
+
+    def put_search(self, phrase: str, max_images: int, results: List[dict]) -> None:
+        serializable = [
+            {k: v for k, v in result.items() if k != "download_path"}
+            for result in results
+        ]
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)",
+                (phrase, max_images, json.dumps(serializable), time.time()),
+            )
+
+    def plan_download(
+        self, url: str, dest: Path
+    ) -> Tuple[str, Dict[str, str], Optional[Tuple[str, str]]]:
+        """
+        Returns (action, request headers, kept (source, url)). Finished downloads whose
+        file still exists are skipped, or revalidated when `revalidate` is set: the
+        headers are conditional ones for the kept candidate's URL only, see
+        `DownloadPolicy.fetch`. URLs that failed `max_attempts` times or were
+        quarantined are skipped as known-bad.
+        """
+        row = self.conn.execute(
+            "SELECT status, attempts, etag, last_modified, source, fetched_url "
+            "FROM downloads WHERE url = ?",
+            (url,),
+        ).fetchone()
+        if row is None:
+            return FETCH, {}, None
+        status, attempts, etag, last_modified, source, fetched_url = row
+        if status == "quarantined" or (
+            status == "failed" and attempts >= self.max_attempts
+        ):
+            return SKIP_FAILED, {}, None
+        if status == "ok" and dest.exists():
+            if not self.revalidate:
+                return SKIP_DOWNLOADED, {}, None
+            if source is None or fetched_url is None:
+                # Recorded before the ledger kept track of the candidate, so there is
+                # no telling which URL the validators belong to
+                return FETCH, {}, None
+            headers = {}
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            return FETCH, headers, (source, fetched_url)
+        return FETCH, {}, None
+
+    def record_success(
+        self, url: str, source: Optional[str], fetched: FetchResult
+    ) -> None:
+        """Records `fetched`, the `source` candidate of the result keyed by `url`."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO downloads (url, path, status, attempts, etag, last_modified, "
+                "updated_at, source, fetched_url) "
+                "VALUES (?, ?, 'ok', 0, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET path = excluded.path, status = 'ok', "
+                "attempts = 0, error = NULL, updated_at = excluded.updated_at, "
+                "etag = COALESCE(excluded.etag, etag), "
+                "last_modified = COALESCE(excluded.last_modified, last_modified), "
+                "source = COALESCE(excluded.source, source), "
+                "fetched_url = COALESCE(excluded.fetched_url, fetched_url)",
+                (
+                    url,
+                    str(fetched.path),
+                    fetched.etag,
+                    fetched.last_modified,
+                    time.time(),
+                    source,
+                    fetched.url,
+                ),
+            )
+
+    def record_failure(self, url: str, error: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO downloads (url, status, attempts, error, updated_at) "
+                "VALUES (?, 'failed', 1, ?, ?) "
+                "ON CONFLICT (url) DO UPDATE SET status = 'failed', "
+                "attempts = attempts + 1, error = excluded.error, "
+                "updated_at = excluded.updated_at",
+                (url, error, time.time()),
+            )
+
+    def record_quarantined(self, failures: Iterable[Tuple[Path, str]]) -> int:
+        """Marks the downloads at these (path, error) as quarantined, returns how many."""
+        now = time.time()
+        marked = 0
+        with self.conn:
+            for path, error in failures:
+                marked += self.conn.execute(
+                    "UPDATE downloads SET status = 'quarantined', error = ?, "
+                    "updated_at = ? WHERE path = ?",
+                    (error, now, str(path)),
+                ).rowcount
+        return marked
+
+    def __migrate(self) -> None:
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(downloads)")}
+        with self.conn:
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    self.conn.execute(statement)
@@ -0,0 +1,92 @@
+"""
+A local HTTP server for the scraper tests.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import io
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+
+def jpeg_bytes(size, color=(200, 0, 0)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class ImageServer:
+    """
+    Serves `routes` ({path: bytes}) with an ETag, answering a matching If-None-Match
+    with 304 and unknown paths with 404. Records every request and the most requests
+    in flight at once per Host header.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.routes = {}
+        self.delay = delay
+        self.requests = []
+        self.max_in_flight = defaultdict(int)
+        self._in_flight = defaultdict(int)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.__handler_class())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, path: str, host: str = "127.0.0.1") -> str:
+        return f"http://{host}:{self.httpd.server_address[1]}{path}"
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host = self.headers.get("Host", "").split(":")[0]
+                with server._lock:
+                    server.requests.append((self.path, dict(self.headers)))
+                    server._in_flight[host] += 1
+                    server.max_in_flight[host] = max(
+                        server.max_in_flight[host], server._in_flight[host]
+                    )
+                try:
+                    time.sleep(server.delay)
+                    body = server.routes.get(self.path)
+                    etag = f'"{self.path}"'
+                    if body is None:
+                        self.send_error(404)
+                    elif self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                    else:
+                        self.send_response(200)
+                        self.send_header("Content-Type", "image/jpeg")
+                        self.send_header("Content-Length", str(len(body)))
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        self.wfile.write(body)
+                finally:
+                    with server._lock:
+                        server._in_flight[host] -= 1
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def image_server():
+    server = ImageServer()
+    yield server
+    server.close()
@@ -0,0 +1,109 @@
+"""
+`AsyncDuckDuckGoImageScraper` with an injected search, downloading from a local HTTP
+server.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import pytest
+
+from conftest import jpeg_bytes
+from scrapers.images.async_ddg_images import AsyncDuckDuckGoImageScraper
+from scrapers.images.download_policy import FULL_IMAGE, THUMBNAIL, DownloadPolicy
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def make_search(image_server):
+    searches = []
+
+    def search(phrase, max_images):
+        searches.append(phrase)
+        if phrase == "broken":
+            raise RuntimeError("search failed")
+        return [
+            {
+                "title": name,
+                "image": image_server.url(f"/{name}.jpg"),
+                "thumbnail": image_server.url(f"/{name}_thumb.jpg"),
+                "url": image_server.url(f"/{name}.html"),
+                "width": 0,
+                "height": 0,
+                "source": "local",
+            }
+            for name in ["small_thumb", "big_thumb", "missing"]
+        ][:max_images]
+
+    return search, searches
+
+
+@pytest.mark.anyio
+async def test_downloads_results_and_records_them(tmp_path, image_server):
+    image_server.routes = {
+        # Too small for the policy, so the full image is fetched
+        "/small_thumb_thumb.jpg": jpeg_bytes((16, 16)),
+        "/small_thumb.jpg": jpeg_bytes((96, 96)),
+        "/big_thumb_thumb.jpg": jpeg_bytes((80, 80)),
+        "/big_thumb.jpg": jpeg_bytes((96, 96)),
+    }
+    search, searches = make_search(image_server)
+    (tmp_path / "downloads").mkdir()
+    scraper = AsyncDuckDuckGoImageScraper(
+        downloads_dirname=tmp_path / "downloads",
+        search_rate=100,
+        search_fn=search,
+        download_policy=DownloadPolicy(target_res=64),
+    )
+
+    results = await scraper.ascrape_categories(
+        {"cat": [("cats", 3)], "dog": [("broken", 3)]}
+    )
+
+    assert results["dog"] == []
+    small, big, missing = results["cat"]
+    phrase_dir = tmp_path / "downloads" / "cat" / "cats"
+    assert small["download_path"] == phrase_dir / "cats_0.jpg"
+    assert small["download_source"] == FULL_IMAGE
+    assert small["download_path"].read_bytes() == (
+        image_server.routes["/small_thumb.jpg"]
+    )
+    assert big["download_source"] == THUMBNAIL
+    assert big["download_path"].read_bytes() == (
+        image_server.routes["/big_thumb_thumb.jpg"]
+    )
+    assert "download_path" not in missing
+    assert sorted(path.name for path in phrase_dir.iterdir()) == [
+        "cats_0.jpg",
+        "cats_1.jpg",
+    ]
+
+    ledger = {
+        url: (status, source, attempts)
+        for url, status, source, attempts in scraper.scrape_cache.conn.execute(
+            "SELECT url, status, source, attempts FROM downloads"
+        )
+    }
+    assert ledger == {
+        small["image"]: ("ok", FULL_IMAGE, 0),
+        big["image"]: ("ok", THUMBNAIL, 0),
+        missing["image"]: ("failed", None, 1),
+    }
+
+    # A rerun reuses the cached search and the finished downloads
+    requests = len(image_server.requests)
+    results = await scraper.ascrape_categories({"cat": [("cats", 3)]})
+    assert sorted(searches) == ["broken", "cats"]
+    assert [result.get("download_path") for result in results["cat"]] == [
+        small["download_path"],
+        big["download_path"],
+        None,
+    ]
+    # Only the failed download is tried again, thumbnail then full image
+    assert [path for path, _ in image_server.requests[requests:]] == [
+        "/missing_thumb.jpg",
+        "/missing.jpg",
+    ]
@@ -0,0 +1,54 @@
+"""
+Near-duplicate detection in `dataset.dedup`.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from dataset.dedup import Deduplicator
+from dataset.manifest import DatasetManifest
+
+
+def noise_image(path, seed: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pixels = np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+def make_manifest(root) -> DatasetManifest:
+    manifest = DatasetManifest(root)
+    manifest.refresh()
+    manifest.set_verified({path: True for path in manifest.unverified()})
+    return manifest
+
+
+def test_duplicates_within_a_label_keep_the_first(tmp_path):
+    noise_image(tmp_path / "cat" / "a.jpg", 0)
+    shutil.copy(tmp_path / "cat" / "a.jpg", tmp_path / "cat" / "b.jpg")
+    noise_image(tmp_path / "dog" / "c.jpg", 1)
+    manifest = make_manifest(tmp_path)
+
+    assert Deduplicator(manifest).run(["cat", "dog"]) == 1
+    assert manifest.paths(["cat", "dog"], unique_only=True) == [
+        tmp_path / "cat" / "a.jpg",
+        tmp_path / "dog" / "c.jpg",
+    ]
+
+
+def test_near_identical_images_with_different_labels_are_both_left_out(tmp_path):
+    noise_image(tmp_path / "cat" / "a.jpg", 0)
+    noise_image(tmp_path / "cat" / "b.jpg", 1)
+    noise_image(tmp_path / "dog" / "c.jpg", 2)
+    shutil.copy(tmp_path / "cat" / "a.jpg", tmp_path / "dog" / "a_copy.jpg")
+    manifest = make_manifest(tmp_path)
+
+    assert Deduplicator(manifest).run(["cat", "dog"]) == 2
+    assert sorted(manifest.paths(["cat", "dog"], unique_only=True)) == [
+        tmp_path / "cat" / "b.jpg",
+        tmp_path / "dog" / "c.jpg",
+    ]
@@ -0,0 +1,106 @@
+"""
+Candidate fallback of `DownloadPolicy.fetch`, downloading from a local HTTP server.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+from conftest import jpeg_bytes
+from scrapers.images.download_policy import FULL_IMAGE, THUMBNAIL, DownloadPolicy
+from scrapers.images.download_pool import fetch_url
+
+
+POLICY = DownloadPolicy(target_res=64)
+
+
+def fetch(url, path, headers):
+    return fetch_url(url, path, 10, headers)
+
+
+def candidates(image_server):
+    return [
+        (THUMBNAIL, image_server.url("/thumb.jpg")),
+        (FULL_IMAGE, image_server.url("/full.jpg")),
+    ]
+
+
+def requested(image_server):
+    return [path for path, _ in image_server.requests]
+
+
+def test_sufficient_thumbnail_is_kept(tmp_path, image_server):
+    image_server.routes = {
+        "/thumb.jpg": jpeg_bytes((80, 80)),
+        "/full.jpg": jpeg_bytes((400, 400)),
+    }
+    dest = tmp_path / "0.jpg"
+
+    source, fetched = POLICY.fetch(candidates(image_server), dest, fetch)
+
+    assert source == THUMBNAIL
+    assert fetched.path == dest
+    assert dest.read_bytes() == image_server.routes["/thumb.jpg"]
+    assert requested(image_server) == ["/thumb.jpg"]
+    assert [path.name for path in tmp_path.iterdir()] == ["0.jpg"]
+
+
+def test_too_small_thumbnail_falls_back_to_full_image(tmp_path, image_server):
+    image_server.routes = {
+        "/thumb.jpg": jpeg_bytes((32, 32)),
+        "/full.jpg": jpeg_bytes((400, 400)),
+    }
+    dest = tmp_path / "0.jpg"
+
+    source, _ = POLICY.fetch(candidates(image_server), dest, fetch)
+
+    assert source == FULL_IMAGE
+    assert dest.read_bytes() == image_server.routes["/full.jpg"]
+    assert requested(image_server) == ["/thumb.jpg", "/full.jpg"]
+    assert [path.name for path in tmp_path.iterdir()] == ["0.jpg"]
+
+
+def test_missing_thumbnail_falls_back_to_full_image(tmp_path, image_server):
+    image_server.routes = {"/full.jpg": jpeg_bytes((400, 400))}
+    dest = tmp_path / "0.jpg"
+
+    source, _ = POLICY.fetch(candidates(image_server), dest, fetch)
+
+    assert source == FULL_IMAGE
+    assert dest.read_bytes() == image_server.routes["/full.jpg"]
+
+
+def test_304_on_kept_candidate_leaves_dest_untouched(tmp_path, image_server):
+    image_server.routes = {
+        "/thumb.jpg": jpeg_bytes((80, 80)),
+        "/full.jpg": jpeg_bytes((400, 400)),
+    }
+    dest = tmp_path / "0.jpg"
+    dest.write_bytes(b"previously downloaded")
+    kept = (FULL_IMAGE, image_server.url("/full.jpg"))
+
+    source, fetched = POLICY.fetch(
+        candidates(image_server), dest, fetch, kept, {"If-None-Match": '"/full.jpg"'}
+    )
+
+    assert source == FULL_IMAGE
+    assert fetched.not_modified
+    assert dest.read_bytes() == b"previously downloaded"
+    # The kept URL is revalidated first, and the thumbnail is never tried
+    assert requested(image_server) == ["/full.jpg"]
+    assert image_server.requests[0][1]["If-None-Match"] == '"/full.jpg"'
+
+
+def test_existing_dest_is_not_replaced_by_insufficient_fallback(tmp_path, image_server):
+    image_server.routes = {"/thumb.jpg": jpeg_bytes((32, 32))}
+    dest = tmp_path / "0.jpg"
+    dest.write_bytes(b"previously downloaded")
+    kept = (FULL_IMAGE, image_server.url("/full.jpg"))
+
+    source, fetched = POLICY.fetch(
+        candidates(image_server), dest, fetch, kept, {"If-None-Match": '"stale"'}
+    )
+
+    assert (source, fetched.path, fetched.not_modified) == (FULL_IMAGE, dest, True)
+    assert dest.read_bytes() == b"previously downloaded"
+    assert requested(image_server) == ["/full.jpg", "/thumb.jpg"]
+    assert [path.name for path in tmp_path.iterdir()] == ["0.jpg"]
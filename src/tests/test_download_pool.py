@@ -0,0 +1,75 @@
+"""
+`ConcurrentImageDownloader` against a local HTTP server.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import time
+import urllib.error
+
+import pytest
+
+from conftest import jpeg_bytes
+from scrapers.images.download_pool import ConcurrentImageDownloader, TokenBucket
+
+
+def test_downloads_are_capped_per_host(tmp_path, image_server):
+    image_server.delay = 0.2
+    image_server.routes = {f"/{i}.jpg": jpeg_bytes((32, 32)) for i in range(6)}
+    urls = [
+        image_server.url(f"/{i}.jpg", host)
+        for host in ("127.0.0.1", "localhost")
+        for i in range(6)
+    ]
+
+    with ConcurrentImageDownloader(max_workers=8, per_host_limit=2) as downloader:
+        futures = [
+            downloader.submit(url, tmp_path / f"{index}.jpg")
+            for index, url in enumerate(urls)
+        ]
+        results = [future.result() for future in futures]
+
+    assert [result.path for result in results] == [
+        tmp_path / f"{index}.jpg" for index in range(len(urls))
+    ]
+    assert dict(image_server.max_in_flight) == {"127.0.0.1": 2, "localhost": 2}
+
+
+def test_404_fails_only_that_download(tmp_path, image_server):
+    image_server.routes = {"/0.jpg": jpeg_bytes((32, 32))}
+
+    with ConcurrentImageDownloader() as downloader:
+        found = downloader.submit(image_server.url("/0.jpg"), tmp_path / "0.jpg")
+        missing = downloader.submit(image_server.url("/1.jpg"), tmp_path / "1.jpg")
+        assert found.result().path.read_bytes() == image_server.routes["/0.jpg"]
+        with pytest.raises(urllib.error.HTTPError) as error:
+            missing.result()
+
+    assert error.value.code == 404
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["0.jpg"]
+
+
+def test_token_bucket_spaces_out_requests(tmp_path, image_server):
+    image_server.routes = {f"/{i}.jpg": jpeg_bytes((32, 32)) for i in range(6)}
+    limiter = TokenBucket(rate=20, capacity=1)
+
+    start = time.monotonic()
+    with ConcurrentImageDownloader(max_workers=6, rate_limiter=limiter) as downloader:
+        futures = [
+            downloader.submit(image_server.url(f"/{i}.jpg"), tmp_path / f"{i}.jpg")
+            for i in range(6)
+        ]
+        for future in futures:
+            future.result()
+
+    # The first request takes the only token, the other five wait 1/20 s each
+    assert time.monotonic() - start >= 5 / 20
+    assert len(image_server.requests) == 6
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == pytest.approx(0.1, abs=0.01)
@@ -0,0 +1,81 @@
+"""
+Batched classification in `model.folder_watch`.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import json
+
+import pytest
+from fastai.vision.all import (
+    CategoryBlock,
+    DataBlock,
+    ImageBlock,
+    Learner,
+    RandomSplitter,
+    Resize,
+    get_image_files,
+    parent_label,
+)
+from PIL import Image
+from torch import nn
+
+from model.folder_watch import FolderClassifier
+
+
+class RejectsRed(nn.Module):
+    """Fails any batch that contains a mostly red image."""
+
+    def __init__(self):
+        super().__init__()
+        self.head = nn.Sequential(
+            nn.Conv2d(3, 4, 3), nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(4, 2)
+        )
+
+    def forward(self, x):
+        if (x[:, 0].mean(dim=(1, 2)) > 0.5).any():
+            raise RuntimeError("model failure")
+        return self.head(x)
+
+
+@pytest.fixture
+def learner(tmp_path):
+    train_path = tmp_path / "train"
+    for label, color in [("cat", (200, 0, 0)), ("dog", (0, 0, 200))]:
+        (train_path / label).mkdir(parents=True)
+        for index in range(4):
+            Image.new("RGB", (40, 40), color).save(train_path / label / f"{index}.jpg")
+    dls = DataBlock(
+        blocks=(ImageBlock, CategoryBlock),
+        get_items=get_image_files,
+        get_y=parent_label,
+        splitter=RandomSplitter(seed=0),
+        item_tfms=Resize(32, method="squish"),
+    ).dataloaders(train_path, bs=4, num_workers=0)
+    return Learner(dls, RejectsRed())
+
+
+def test_failing_items_are_recorded_and_the_rest_classified(tmp_path, learner):
+    watch_dir = tmp_path / "incoming"
+    watch_dir.mkdir()
+    Image.new("RGB", (40, 40), (0, 0, 200)).save(watch_dir / "blue.jpg")
+    Image.new("RGB", (40, 40), (200, 0, 0)).save(watch_dir / "red.jpg")
+    (watch_dir / "broken.jpg").write_bytes(b"not an image")
+    output_path = tmp_path / "results.jsonl"
+
+    folder_classifier = FolderClassifier(
+        learner, watch_dir, output_path, decode_workers=1, use_watchdog=False
+    )
+    folder_classifier.run(once=True)
+
+    rows = {
+        row["path"]: row
+        for row in map(json.loads, output_path.read_text().splitlines())
+    }
+    names = ["blue.jpg", "red.jpg", "broken.jpg"]
+    assert set(rows) == {str(watch_dir / name) for name in names}
+    assert set(rows[str(watch_dir / "blue.jpg")]["probabilities"]) == {"cat", "dog"}
+    assert "model failure" in rows[str(watch_dir / "red.jpg")]["error"]
+    assert "error" in rows[str(watch_dir / "broken.jpg")]
+    assert (folder_classifier.classified, folder_classifier.failed) == (1, 2)
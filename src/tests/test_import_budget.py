@@ -0,0 +1,44 @@
+"""
+Startup cost of the prediction entry points, see `benchmarks.pipeline_benchmark` for
+the full import timings.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+# Same default as the benchmark's --import-budget-ms
+IMPORT_BUDGET_MS = 1000.0
+HEAVY_MODULES = ("torch", "fastai")
+
+SCRIPT = (
+    "import json, sys, time\n"
+    "start = time.perf_counter()\n"
+    "__import__(sys.argv[1])\n"
+    "seconds = time.perf_counter() - start\n"
+    f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+    "print(json.dumps({'seconds': seconds, 'heavy': heavy}))\n"
+)
+
+
+@pytest.mark.parametrize("module", ["model.image_classifier", "model.inference_server"])
+def test_import_is_lazy_and_within_budget(module):
+    # A fresh interpreter, since this one may already have torch loaded
+    completed = subprocess.run(
+        [sys.executable, "-c", SCRIPT, module],
+        cwd=Path(__file__).resolve().parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    measured = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    assert measured["heavy"] == []
+    assert measured["seconds"] * 1000 < IMPORT_BUDGET_MS
@@ -0,0 +1,116 @@
+"""
+Status codes of `model.inference_server`.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import http.client
+import io
+import json
+import threading
+
+import pytest
+from fastai.vision.all import (
+    CategoryBlock,
+    DataBlock,
+    ImageBlock,
+    Learner,
+    RandomSplitter,
+    Resize,
+    get_image_files,
+    parent_label,
+)
+from PIL import Image
+from torch import nn
+
+from model.inference_server import InferenceServer
+
+
+class BrokenModel(nn.Module):
+    def forward(self, x):
+        raise RuntimeError("model failure")
+
+
+def jpeg_bytes(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 40), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def learner(tmp_path):
+    for label, color in [("cat", (200, 0, 0)), ("dog", (0, 0, 200))]:
+        (tmp_path / label).mkdir()
+        for index in range(4):
+            Image.new("RGB", (40, 40), color).save(tmp_path / label / f"{index}.jpg")
+    dls = DataBlock(
+        blocks=(ImageBlock, CategoryBlock),
+        get_items=get_image_files,
+        get_y=parent_label,
+        splitter=RandomSplitter(seed=0),
+        item_tfms=Resize(32, method="squish"),
+    ).dataloaders(tmp_path, bs=4, num_workers=0)
+    model = nn.Sequential(
+        nn.Conv2d(3, 4, 3), nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Linear(4, 2)
+    )
+    return Learner(dls, model)
+
+
+@pytest.fixture
+def serve(learner):
+    servers = []
+
+    def start(learner=learner):
+        server = InferenceServer(learner, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def post(server, body: bytes, headers: dict):
+    conn = http.client.HTTPConnection(*server.address, timeout=10)
+    conn.putrequest("POST", "/predict")
+    for key, value in headers.items():
+        conn.putheader(key, value)
+    conn.endheaders()
+    conn.send(body)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_predicts_uploaded_image(serve):
+    body = jpeg_bytes((200, 0, 0))
+    status, payload = post(serve(), body, {"Content-Length": str(len(body))})
+    assert status == 200
+    assert set(payload["probabilities"]) == {"cat", "dog"}
+
+
+@pytest.mark.parametrize(
+    "body,headers",
+    [
+        (b"not an image", {"Content-Length": "12"}),
+        (
+            b'{"path": "/does/not/exist.jpg"}',
+            {"Content-Type": "application/json", "Content-Length": "31"},
+        ),
+        (b"{", {"Content-Type": "application/json", "Content-Length": "1"}),
+        (b"", {"Content-Length": "-1"}),
+    ],
+)
+def test_bad_input_is_400(serve, body, headers):
+    status, payload = post(serve(), body, headers)
+    assert status == 400
+    assert "error" in payload
+
+
+def test_model_failure_is_500(serve, learner):
+    learner.model = BrokenModel()
+    body = jpeg_bytes((200, 0, 0))
+    status, payload = post(serve(learner), body, {"Content-Length": str(len(body))})
+    assert status == 500
+    assert "model failure" in payload["error"]
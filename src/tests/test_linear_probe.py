@@ -0,0 +1,58 @@
+"""
+Storing fitted probes of `model.linear_probe` in the `ModelStore`.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+from fastai.vision.all import resnet18
+from PIL import Image
+
+from model.linear_probe import PROBE_SUFFIX, LinearProbe, LinearProbeClassifier
+
+
+def noise_image(path, seed: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pixels = np.random.default_rng(seed).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+def make_classifier(dataset_path) -> LinearProbeClassifier:
+    return LinearProbeClassifier(
+        "cat",
+        "dog",
+        arch=resnet18,
+        img_res=32,
+        pretrained=False,
+        dataset_path=dataset_path,
+    )
+
+
+def test_fitted_probe_is_reused_until_the_dataset_changes(tmp_path, monkeypatch):
+    for seed, label in enumerate(["cat", "dog"]):
+        for index in range(4):
+            noise_image(tmp_path / label / f"{index}.jpg", 10 * seed + index)
+
+    classifier = make_classifier(tmp_path)
+    metrics = classifier.train_(use_cache=False)
+    fitted_key = classifier.model_key
+    assert classifier.model_store.exists(fitted_key, PROBE_SUFFIX)
+    weight = classifier.model.weight
+
+    def refit(*args, **kwargs):
+        raise AssertionError("probe was fitted again")
+
+    monkeypatch.setattr(LinearProbe, "fit", refit)
+    classifier = make_classifier(tmp_path)
+    reused = classifier.train_()
+    assert classifier.model_key == fitted_key
+    assert reused["valid_accuracy"] == metrics["valid_accuracy"]
+    np.testing.assert_array_equal(classifier.model.weight, weight)
+
+    noise_image(tmp_path / "dog" / "4.jpg", 99)
+    classifier = make_classifier(tmp_path)
+    with pytest.raises(AssertionError, match="fitted again"):
+        classifier.train_()
+    assert classifier.model_key != fitted_key
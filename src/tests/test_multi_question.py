@@ -0,0 +1,68 @@
+"""
+Dataset preparation and metrics of `model.multi_question_classifier`.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from PIL import Image
+
+from model.multi_question_classifier import (
+    UNLABELLED,
+    MaskedAccuracy,
+    MultiQuestionClassifier,
+    QuestionTargets,
+    masked_accuracy,
+)
+
+
+QUESTIONS = {"animal": ("cat", "dog"), "place": ("indoor", "outdoor")}
+
+
+def noise_image(path, seed: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pixels = np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+def test_cross_question_duplicates_are_merged_into_one_row(tmp_path):
+    for seed, category in enumerate(["cat", "dog", "indoor", "outdoor"]):
+        for index in range(2):
+            noise_image(tmp_path / category / f"{index}.jpg", 10 * seed + index)
+    # The same photo answers both questions
+    shutil.copy(tmp_path / "cat" / "0.jpg", tmp_path / "indoor" / "cat_0.jpg")
+    # And can't be both a cat and a dog
+    shutil.copy(tmp_path / "cat" / "1.jpg", tmp_path / "dog" / "cat_1.jpg")
+
+    classifier = MultiQuestionClassifier(
+        QUESTIONS, dataset_path=tmp_path, batch_size=2, img_res=32, pretrained=False
+    )
+
+    kept = tmp_path / "cat" / "0.jpg"
+    assert kept in classifier.training_images
+    assert tmp_path / "indoor" / "cat_0.jpg" not in classifier.training_images
+    assert tmp_path / "cat" / "1.jpg" not in classifier.training_images
+    assert tmp_path / "dog" / "cat_1.jpg" not in classifier.training_images
+    assert len(classifier) == 7
+
+    targets = QuestionTargets(tmp_path, classifier.questions, classifier.merged_labels)
+    assert targets(kept).tolist() == [1.0, 1.0]
+    assert targets(tmp_path / "dog" / "0.jpg").tolist() == [0.0, UNLABELLED]
+
+
+def test_masked_accuracy_without_labelled_answers():
+    logits = torch.tensor([[2.0, -1.0]])
+    unlabelled = torch.full((1, 2), UNLABELLED)
+    assert masked_accuracy(logits, unlabelled).item() == 0.0
+
+    metric = MaskedAccuracy()
+    metric.reset()
+    metric.accumulate(SimpleNamespace(pred=logits, y=unlabelled))
+    assert metric.value is None
+    metric.accumulate(SimpleNamespace(pred=logits, y=torch.tensor([[1.0, 1.0]])))
+    assert metric.value == 0.5
@@ -0,0 +1,56 @@
+"""
+The scraper's download ledger.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+from PIL import Image
+
+from dataset.manifest import DatasetManifest
+from dataset.verification import ImageVerifier
+from scrapers.images.download_pool import FetchResult
+from scrapers.images.scrape_cache import (
+    FETCH,
+    SCRAPE_CACHE_FILENAME,
+    SKIP_DOWNLOADED,
+    SKIP_FAILED,
+    ScrapeCache,
+)
+
+
+def test_quarantined_download_is_not_fetched_again(tmp_path):
+    dl_path = tmp_path / "downloads"
+    good = dl_path / "cat" / "cats" / "cats_0.jpg"
+    bad = dl_path / "cat" / "cats" / "cats_1.jpg"
+    good.parent.mkdir(parents=True)
+    Image.new("RGB", (64, 64)).save(good)
+    bad.write_bytes(b"not an image")
+
+    cache = ScrapeCache(dl_path / SCRAPE_CACHE_FILENAME)
+    cache.record_success("http://host/0.jpg", "image", FetchResult(good))
+    cache.record_success("http://host/1.jpg", "image", FetchResult(bad))
+
+    manifest = DatasetManifest(dl_path)
+    manifest.refresh()
+    verified, failed = ImageVerifier(
+        manifest, tmp_path / "quarantine", scrape_cache=cache
+    ).run()
+
+    assert (verified, failed) == (1, 1)
+    assert not bad.exists()
+    assert cache.plan_download("http://host/0.jpg", good)[0] == SKIP_DOWNLOADED
+    assert cache.plan_download("http://host/1.jpg", bad)[0] == SKIP_FAILED
+    # Reopened as the next run would
+    assert ScrapeCache.existing(dl_path).plan_download("http://host/1.jpg", bad)[
+        0
+    ] == SKIP_FAILED
+
+
+def test_failures_are_retried_up_to_max_attempts(tmp_path):
+    cache = ScrapeCache(tmp_path / SCRAPE_CACHE_FILENAME, max_attempts=2)
+    dest = tmp_path / "0.jpg"
+    cache.record_failure("http://host/0.jpg", "HTTP Error 404")
+    assert cache.plan_download("http://host/0.jpg", dest)[0] == FETCH
+    cache.record_failure("http://host/0.jpg", "HTTP Error 404")
+    assert cache.plan_download("http://host/0.jpg", dest)[0] == SKIP_FAILED
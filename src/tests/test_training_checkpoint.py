@@ -0,0 +1,133 @@
+"""
+Resuming `fine_tune_resumable` from a `TrainingCheckpointCallback`.
+
+Run from `src/`:
+    python -m pytest tests
+"""
+
+import copy
+import time
+
+import pytest
+import torch
+from fastai.vision.all import (
+    Callback,
+    CrossEntropyLossFlat,
+    DataLoaders,
+    Learner,
+    error_rate,
+    params,
+)
+from torch import nn
+
+from model.callbacks import (
+    TimeBudgetCallback,
+    TrainingCheckpointCallback,
+    fine_tune_resumable,
+)
+
+
+FNAME = "model"
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashCallback(Callback):
+    """Interrupts training once `fit_index`'s `epoch` has been checkpointed."""
+
+    order = 100
+
+    def __init__(self, checkpoint: TrainingCheckpointCallback, fit_index: int, epoch: int):
+        self.checkpoint = checkpoint
+        self.fit_index = fit_index
+        self.crash_epoch = epoch
+
+    def after_epoch(self):
+        if (self.checkpoint.fit_index, self.epoch) == (self.fit_index, self.crash_epoch):
+            raise Crash(f"Interrupted after fit {self.fit_index} epoch {self.epoch}")
+
+
+class FitRecorder(Callback):
+    """Records the optimizer state and starting epoch of every fit."""
+
+    order = 0
+
+    def __init__(self):
+        self.fits = []
+
+    def before_fit(self):
+        self.fits.append(
+            {
+                "frozen": not all(p.requires_grad for p in self.learn.model.parameters()),
+                # The state tensors keep being updated in place by the fit
+                "opt_state": copy.deepcopy(self.learn.opt.state_dict()["state"]),
+            }
+        )
+
+
+def make_learner(model_dir) -> Learner:
+    torch.manual_seed(0)
+    x = torch.randn(64, 4)
+    y = (x[:, 0] > 0).long()
+    dsets = [list(zip(x[:48], y[:48])), list(zip(x[48:], y[48:]))]
+    dls = DataLoaders.from_dsets(*dsets, bs=8)
+    model = nn.Sequential(nn.Linear(4, 8), nn.ReLU(), nn.Linear(8, 2))
+    return Learner(
+        dls,
+        model,
+        loss_func=CrossEntropyLossFlat(),
+        metrics=error_rate,
+        splitter=lambda m: [params(m[0]), params(m[2])],
+        model_dir=model_dir,
+    )
+
+
+def assert_same_state(state, expected):
+    assert len(state) == len(expected)
+    for param_state, expected_param_state in zip(state, expected):
+        assert param_state.keys() == expected_param_state.keys()
+        for key, value in expected_param_state.items():
+            if isinstance(value, torch.Tensor):
+                assert torch.equal(param_state[key], value), key
+            else:
+                assert param_state[key] == value, key
+
+
+def test_resume_mid_unfrozen_phase_keeps_optimizer_state(tmp_path):
+    learn = make_learner(tmp_path)
+    checkpoint = TrainingCheckpointCallback(tmp_path, FNAME)
+    with pytest.raises(Crash):
+        fine_tune_resumable(
+            learn, 3, checkpoint, [checkpoint, CrashCallback(checkpoint, 1, 1)]
+        )
+    saved_state = torch.load(
+        tmp_path / f"{FNAME}.last.pth", weights_only=False
+    )["opt"]["state"]
+    # Adam's moving averages exist for the body once it is unfrozen
+    assert all(param_state.get("step") for param_state in saved_state)
+
+    learn = make_learner(tmp_path)
+    checkpoint = TrainingCheckpointCallback(tmp_path, FNAME)
+    assert checkpoint.start_epoch(0, 1) is None
+    assert checkpoint.start_epoch(1, 3) == 2
+    recorder = FitRecorder()
+    fine_tune_resumable(learn, 3, checkpoint, [checkpoint, recorder])
+
+    assert len(recorder.fits) == 1
+    assert not recorder.fits[0]["frozen"]
+    assert_same_state(recorder.fits[0]["opt_state"], saved_state)
+    assert checkpoint.done
+
+
+def test_time_budget_skips_unfrozen_phase(tmp_path):
+    learn = make_learner(tmp_path)
+    checkpoint = TrainingCheckpointCallback(tmp_path, FNAME)
+    recorder = FitRecorder()
+    budget = TimeBudgetCallback(time.monotonic())
+    fine_tune_resumable(learn, 3, checkpoint, [checkpoint, recorder, budget])
+
+    assert budget.exceeded
+    assert len(recorder.fits) == 1
+    assert recorder.fits[0]["frozen"]
@@ -0,0 +1,213 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from typing import Any, Callable, Dict, List, Optional
+
+
+def peak_rss_kb() -> Optional[int]:
+    """Peak resident set size of this process so far, in KiB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux but bytes on macOS
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Span:
+    """One timed stage. Set `items` inside the `with` block to record a throughput."""
+
+    def __init__(self, name: str, parent: Optional[str], items: Optional[int], meta: dict):
+        self.name = name
+        self.parent = parent
+        self.items = items
+        self.meta = meta
+        self.thread_id = threading.get_ident()
+        self.start = 0.0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rss_start_kb: Optional[int] = None
+        self.rss_peak_kb: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "parent": self.parent,
+            "start": self.start,
+            "wall_s": self.wall,
+            "cpu_s": self.cpu,
+            "items": self.items,
+            "items_per_sec": self.items / self.wall if self.items and self.wall else None,
+            "peak_rss_kb": self.rss_peak_kb,
+            "rss_growth_kb": (
+                self.rss_peak_kb - self.rss_start_kb
+                if self.rss_peak_kb is not None
+                else None
+            ),
+            "thread_id": self.thread_id,
+            "error": self.error,
+            **self.meta,
+        }
+
+
+class _NullSpan:
+    """Shared stand-in returned while tracing is disabled; swallows attribute writes."""
+
+    items = None
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _ActiveSpan:
+    def __init__(self, tracer: "Tracer", span: Span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self) -> Span:
+        span = self.span
+        self.tracer._stack().append(span.name)
+        span.rss_start_kb = peak_rss_kb()
+        span.start = time.time()
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return span
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        span = self.span
+        span.wall = time.perf_counter() - self.wall_start
+        span.cpu = time.process_time() - self.cpu_start
+        span.rss_peak_kb = peak_rss_kb()
+        if exc_type is not None:
+            span.error = f"{exc_type.__name__}: {exc}"
+        self.tracer._stack().pop()
+        self.tracer._finish(span)
+
+
+class Tracer:
+    """
+    Records nested spans with wall time, process CPU time, peak RSS and item counts.
+
+    A disabled tracer hands out a shared no-op span, so instrumented code costs one
+    attribute check per stage. Spans export as a flat JSON list or as Chrome trace
+    events (load in chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.spans: List[Span] = []
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    def span(self, name: str, items: Optional[int] = None, **meta: Any):
+        if not self.enabled:
+            return NULL_SPAN
+        stack = self._stack()
+        return _ActiveSpan(self, Span(name, stack[-1] if stack else None, items, meta))
+
+    def trace(self, name: Optional[str] = None) -> Callable:
+        """Decorator that wraps every call of a function in a span."""
+
+        def decorator(fn: Callable) -> Callable:
+            span_name = name or fn.__qualname__
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self.span(span_name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def summary(self) -> Dict[str, dict]:
+        """Totals per span name, in first-seen order."""
+        totals: Dict[str, dict] = {}
+        for span in self.spans:
+            total = totals.setdefault(
+                span.name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "items": 0}
+            )
+            total["calls"] += 1
+            total["wall_s"] += span.wall
+            total["cpu_s"] += span.cpu
+            total["items"] += span.items or 0
+            total["peak_rss_kb"] = span.rss_peak_kb
+        return totals
+
+    def export_json(self, path: Path) -> None:
+        with open(path, "w") as f:
+            json.dump([span.to_dict() for span in self.spans], f, indent=2)
+
+    def export_chrome_trace(self, path: Path) -> None:
+        pid = os.getpid()
+        events = []
+        for span in self.spans:
+            args = {
+                key: value
+                for key, value in span.to_dict().items()
+                if key not in ("name", "start", "wall_s", "thread_id") and value is not None
+            }
+            events.append(
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": span.start * 1e6,
+                    "dur": span.wall * 1e6,
+                    "pid": pid,
+                    "tid": span.thread_id,
+                    "args": args,
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def _stack(self) -> List[str]:
+        if not hasattr(self.__local, "stack"):
+            self.__local.stack = []
+        return self.__local.stack
+
+    def _finish(self, span: Span) -> None:
+        with self.__lock:
+            self.spans.append(span)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    Method decorator that records a span on the instance's `tracer` attribute, if any.
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            tracer = getattr(self, "tracer", None)
+            if tracer is None or not tracer.enabled:
+                return fn(self, *args, **kwargs)
+            with tracer.span(span_name):
+                return fn(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator